@@ -0,0 +1,382 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - batchPlan.py
+
+usage: batchPlan.py [-h] [-n NUM_AGENTS] [-s SAMPLES] [-w MK_WEIGHT]
+                    [-t TIME_WEIGHT] [--split SPLIT] [-g] [-a API_KEY]
+                    [-j JOBS] [-m MANIFEST] [-o OUTPUT_ROOT] [--solve_only]
+                    [--outputs OUTPUTS] [--profile PROFILE]
+                    [inputs [inputs ...]]
+
+Plan many portal lists with one shared pool of worker processes. Every solve
+and every set of maps is a task for the pool, so at most JOBS run at once and
+the interpreter and matplotlib start once per worker instead of once per plan.
+
+positional arguments:
+  inputs                Portal lists, or directories whose .csv files are
+                        portal lists
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -n, -s, -w, -t, --split, -g, -a, --outputs, --profile
+                        As for makePlan.py, for every plan
+  -j JOBS, --jobs JOBS  Number of worker processes. Default: number of CPUs
+  -m MANIFEST, --manifest MANIFEST
+                        A file listing portal lists, one per line (relative
+                        to the manifest's directory, # starts a comment).
+                        May be given more than once.
+  -o OUTPUT_ROOT, --output_root OUTPUT_ROOT
+                        Each plan goes in OUTPUT_ROOT/<input file name>/
+                        like makePlan.py. Default: ~/Ingress/Fielding
+  --solve_only          Only solve and save the plans (.npz), no maps or
+                        agent files. Default: False
+
+A summary of every plan (portals, links, fields, AP, keys lacked, timings and
+any error) is printed and written to OUTPUT_ROOT/batch_summary.csv
+If a worker dies (e.g. killed for memory), the pool is started again and the
+solves and renders it took down with it are tried again (twice at most).
+"""
+
+import sys
+import os
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor,wait,FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from makePlan import _MAX_PORTALS_,OUTPUTS,parseOutputs,plotOptimization
+from lib.cancel import Cancelled
+
+SUMMARY_FIELDS = ['input','output_directory','portals','links','fields','AP',
+                  'TK','MK','solve_seconds','render_seconds','error']
+
+# Times a task is tried again after a worker died under it (see main)
+MAX_RETRIES = 2
+
+SETTINGS = ['num_agents','samples','mk_weight','time_weight','split','google','api_key','profile']
+
+def settingsError(settings):
+    '''
+    Returns what is wrong with settings (a dict with the keys in SETTINGS), or None
+    '''
+    if settings['num_agents'] < 0:
+        return "Number of agents should be positive"
+    if settings['mk_weight'] < 0:
+        return "MK weight should be positive"
+    if settings['time_weight'] < 0:
+        return "Time weight should be positive"
+    if settings['samples'] < 0:
+        return "Number of extra samples should be positive"
+    elif settings['samples'] > 100:
+        return "Extra samples may not be more than 100"
+
+    from lib.Triangle import splitPolicy
+    from lib import renderProfile
+    try:
+        splitPolicy(settings['split'])
+        renderProfile.get(settings['profile'])
+    except ValueError as err:
+        return "Error: {0}".format(err)
+    return None
+
+def planAP(nportals,nlinks,nfields):
+    # As makePlan reports it
+    return (125*8 + 500 + 250)*nportals + 313*nlinks + 1250*nfields
+
+def jobError(err):
+    # How an exception in a job is reported in its summary
+    if isinstance(err,Cancelled):
+        return 'Cancelled'
+    return '{0}: {1}'.format(type(err).__name__,err)
+
+def solveJob(input_file,output_directory,output_file,settings,cancel=None,status=None):
+    '''
+    Solves one portal list and saves the plan in output_directory
+    Runs in a worker process, so everything it needs is imported here
+    cancel  an Event (e.g. from a multiprocessing Manager) that stops the job when set
+    status  a dict (e.g. from a Manager) kept up to date with the samples made and best TK,MK
+    Returns a summary dict (see SUMMARY_FIELDS) with 'allTK','allMK','allWeights' added
+    '''
+    summary = {'input':input_file,'output_directory':output_directory}
+    t0 = time.time()
+    try:
+        from lib import planFile,portalList
+        from lib.solver import Solver
+        from lib.cancel import CancelToken
+
+        portals = portalList.read(input_file)
+        if len(portals) < 3:
+            raise ValueError("Must have more than 2 portals!")
+        if len(portals) > _MAX_PORTALS_:
+            raise ValueError("Portal limit is {0}".format(_MAX_PORTALS_))
+        a,e6locs = portalList.portalGraph(portals)
+
+        def progress(event,sample,result):
+            if result.best is not None:
+                status.update({'stage':'solving','samples':result.samples,
+                               'TK':int(result.best.TK),'MK':int(result.best.MK)})
+
+        token = CancelToken(cancel) if cancel is not None else None
+        solver = Solver(settings['mk_weight'],settings['time_weight'],settings['num_agents'],
+                        settings['samples'],settings['split'],
+                        progress=progress if status is not None else None,cancel=token)
+        result = solver.solve(a)
+        if result.cancelled:
+            raise Cancelled()
+        if result.best is None:
+            raise ValueError("No plan found")
+
+        if not os.path.exists(output_directory):
+            os.makedirs(output_directory)
+        planFile.save(result.plan,output_directory+output_file)
+
+        b = result.plan
+        nfields = sum(len(data['fields']) for p,q,data in b.edges_iter(data=True))
+        summary.update({'portals':b.order(),'links':b.size(),'fields':nfields,
+                        'AP':planAP(b.order(),b.size(),nfields),
+                        'TK':result.best.TK,'MK':result.best.MK,
+                        'allTK':result.allTK,'allMK':result.allMK,'allWeights':result.allWeights})
+    except Exception as err:
+        summary['error'] = jobError(err)
+    summary['solve_seconds'] = round(time.time()-t0,2)
+    return summary
+
+def renderJob(summary,output_file,settings,cancel=None,status=None,outputs=OUTPUTS,directory=None):
+    '''
+    Makes the maps and agent files for a plan saved by solveJob
+    outputs are the ones to make (see makePlan.OUTPUTS)
+    directory is where they go (default: the plan's output directory)
+    cancel and status are as for solveJob (status gets the agent ordering level)
+    Returns summary with 'render_seconds' (and 'error' if it failed)
+    '''
+    t0 = time.time()
+    try:
+        from lib import planFile,PlanPrinterMap
+        from lib.cancel import CancelToken
+
+        def progress(level,levels):
+            status.update({'stage':'ordering','level':level,'levels':levels})
+
+        token = CancelToken(cancel) if cancel is not None else None
+
+        output_directory = summary['output_directory']
+        a = planFile.load(output_directory+output_file)
+        if directory is not None:
+            output_directory = directory
+        if 'optimization' in outputs:
+            plotOptimization(summary['allTK'],summary['allMK'],summary['allWeights'],
+                             output_directory+'optimization.png')
+
+        useGoogle = settings['google']
+        PP = PlanPrinterMap.PlanPrinter(a,output_directory,settings['num_agents'],color='#2ABBFF',
+                                        useGoogle=useGoogle,api_key=settings['api_key'],
+                                        progress=progress if status is not None else None,cancel=token,
+                                        profile=settings['profile'])
+        # The agent order first, so that status says when drawing starts
+        if set(outputs) & set(PlanPrinterMap.AGENT_OUTPUTS):
+            PP.orderAgents()
+        if status is not None:
+            status['stage'] = 'drawing'
+        PP.write(outputs,useGoogle=useGoogle)
+    except Exception as err:
+        summary['error'] = jobError(err)
+    summary['render_seconds'] = round(time.time()-t0,2)
+    return summary
+
+def findInputs(inputs,manifests):
+    '''
+    Returns the portal lists named by inputs (files or directories of .csv files)
+    and by the manifests, in order and without repeats
+    '''
+    found = []
+    for path in inputs:
+        if os.path.isdir(path):
+            found += sorted(os.path.join(path,f) for f in os.listdir(path) if f.endswith('.csv'))
+        else:
+            found.append(path)
+    for manifest in manifests:
+        base = os.path.dirname(manifest)
+        with open(manifest,'r') as fin:
+            for line in fin:
+                line = line.split('#')[0].strip()
+                if line:
+                    found.append(os.path.join(base,line))
+
+    unique = []
+    for path in found:
+        if path not in unique:
+            unique.append(path)
+    return unique
+
+def writeSummary(summaries,filename):
+    import csv
+    with open(filename,'w') as fout:
+        writer = csv.DictWriter(fout,SUMMARY_FIELDS,extrasaction='ignore')
+        writer.writeheader()
+        for summary in summaries:
+            writer.writerow(summary)
+
+def main():
+    description=("Ingress Maxfield - Plan many portal lists with one "
+                 "shared pool of worker processes.")
+    parser = argparse.ArgumentParser(description=description,
+                                     prog="batchPlan.py")
+    parser.add_argument('-n','--num_agents',type=int,default=1,
+                        help='Number of agents. Default: 1')
+    parser.add_argument('-s','--samples',type=int,default=50,
+                        help="Number of iterations to perform for each plan. "
+                        "Default: 50")
+    parser.add_argument('-w','--mk_weight',type=float,default=2,
+                        help="Weight of MK against TK (see makePlan.py). "
+                        "Default: 2")
+    parser.add_argument('-t','--time_weight',type=float,default=0,
+                        help="Weight of the estimated minutes (see "
+                        "makePlan.py). Default: 0")
+    parser.add_argument('--split',default='random',
+                        help="Split policy (see makePlan.py). Default: random")
+    parser.add_argument('-g','--google',action='store_true',
+                        help='Make maps with google maps API. Default: False')
+    parser.add_argument('-a','--api_key',default=None,
+                        help='Google API key for Google maps. Default: None')
+    parser.add_argument('-j','--jobs',type=int,default=os.cpu_count(),
+                        help="Number of worker processes. "
+                        "Default: number of CPUs")
+    parser.add_argument('-m','--manifest',action='append',default=[],
+                        help="A file listing portal lists, one per line. "
+                        "May be given more than once.")
+    parser.add_argument('-o','--output_root',
+                        default=os.path.expanduser('~')+"/Ingress/Fielding",
+                        help="Each plan goes in OUTPUT_ROOT/<input file "
+                        "name>/. Default: ~/Ingress/Fielding")
+    parser.add_argument('--solve_only',action='store_true',
+                        help="Only solve and save the plans (.npz). "
+                        "Default: False")
+    parser.add_argument('--outputs',default=','.join(OUTPUTS),
+                        help="Files to make for each plan (see makePlan.py). "
+                        "Default: all of them")
+    parser.add_argument('--profile',default='default',
+                        help="Size and detail of the images (see "
+                        "makePlan.py). Default: default")
+    parser.add_argument('inputs',nargs='*',
+                        help="Portal lists, or directories whose .csv "
+                        "files are portal lists")
+    args = vars(parser.parse_args())
+
+    settings = dict((k,args[k]) for k in SETTINGS)
+    error = settingsError(settings)
+    if error is not None:
+        sys.exit(error)
+    if args['jobs'] < 1:
+        sys.exit("Number of jobs should be positive")
+    try:
+        outputs = parseOutputs(args['outputs'])
+    except ValueError as err:
+        sys.exit("Error: {0}".format(err))
+
+    inputs = findInputs(args['inputs'],args['manifest'])
+    if len(inputs) == 0:
+        sys.exit("Error: No portal lists given")
+
+    output_root = args['output_root']
+    if output_root[-1] != os.sep:
+        output_root += os.sep
+
+    # Output directories are named like makePlan.py names them
+    jobs = []
+    seen = set()
+    for input_file in inputs:
+        stem = os.path.split(input_file)[1][:-4]
+        output_directory = output_root+stem+os.sep
+        if output_directory in seen:
+            sys.exit("Error: {0} would write to {1} like an earlier input".format(input_file,output_directory))
+        seen.add(output_directory)
+        jobs.append((input_file,output_directory,stem+'.npz'))
+
+    print ("Planning {0} portal lists with {1} workers".format(len(jobs),args['jobs']))
+    t0 = time.time()
+    summaries = []
+    pool = [ProcessPoolExecutor(max_workers=args['jobs'])]
+    def submit(fn,*fnargs,**kwargs):
+        # Replaces the pool once a dead worker has broken it
+        try:
+            return pool[0].submit(fn,*fnargs,**kwargs)
+        except BrokenProcessPool:
+            print ("A worker died, starting new workers")
+            pool[0].shutdown(wait=False)
+            pool[0] = ProcessPoolExecutor(max_workers=args['jobs'])
+            return pool[0].submit(fn,*fnargs,**kwargs)
+
+    def task(output_file,solved):
+        # Solves the job for output_file, or renders it once solved (its solve summary)
+        input_file,output_directory = [job[:2] for job in jobs if job[2] == output_file][0]
+        if solved is None:
+            return submit(solveJob,input_file,output_directory,output_file,settings)
+        return submit(renderJob,solved,output_file,settings,outputs=outputs)
+
+    try:
+        # Renders are queued as soon as their solve is done, so they share the pool with the other solves
+        # pending[future] = (output_file, its solve summary (None while solving))
+        pending = {}
+        retries = {}
+        for input_file,output_directory,output_file in jobs:
+            pending[task(output_file,None)] = (output_file,None)
+
+        while len(pending) > 0:
+            done,_ = wait(list(pending),return_when=FIRST_COMPLETED)
+            for future in done:
+                output_file,solved = pending.pop(future)
+                error = None
+                try:
+                    summary = future.result()
+                except BrokenProcessPool as err:
+                    # A worker died and every task in the pool failed with it, most of them through
+                    # no fault of their own: they are tried again on new workers, up to MAX_RETRIES times
+                    if retries.get(output_file,0) < MAX_RETRIES:
+                        retries[output_file] = retries.get(output_file,0)+1
+                        pending[task(output_file,solved)] = (output_file,solved)
+                        continue
+                    error = '{0}: {1}'.format(type(err).__name__,err)
+                except Exception as err:
+                    # The task's own errors are caught in the task
+                    error = '{0}: {1}'.format(type(err).__name__,err)
+                if error is not None:
+                    if solved is None:
+                        input_file = [job[0] for job in jobs if job[2] == output_file][0]
+                        summary = {'input':input_file,'output_directory':output_root+output_file[:-4]+os.sep}
+                    else:
+                        # Keep what the solve found
+                        summary = dict(solved)
+                    summary['error'] = error
+                rendered = 'render_seconds' in summary
+                if rendered or 'error' in summary or args['solve_only']:
+                    print ("Finished {0}{1}".format(summary['input'],
+                           ' ('+summary['error']+')' if 'error' in summary else ''))
+                    summaries.append(summary)
+                    continue
+
+                print ("Solved {0} in {1}s".format(summary['input'],summary['solve_seconds']))
+                pending[task(output_file,summary)] = (output_file,summary)
+    finally:
+        pool[0].shutdown()
+
+    # Report in the order the inputs were given
+    order = dict((job[0],i) for i,job in enumerate(jobs))
+    summaries.sort(key=lambda summary: order[summary['input']])
+
+    rowFormat = '{0:30s} {1:>7} {2:>5} {3:>6} {4:>9} {5:>5} {6:>4} {7:>8} {8:>8}  {9}'
+    print ('')
+    print (rowFormat.format('input','portals','links','fields','AP','TK','MK','solve s','render s','error'))
+    for summary in summaries:
+        print (rowFormat.format(*[ summary.get(field,'') for field in
+                                  ['input','portals','links','fields','AP','TK','MK',
+                                   'solve_seconds','render_seconds','error'] ]))
+    print ("Total time: {0:.1f}s".format(time.time()-t0))
+
+    if not os.path.exists(output_root):
+        os.makedirs(output_root)
+    writeSummary(summaries,output_root+'batch_summary.csv')
+    print ("Summary saved to {0}".format(output_root+'batch_summary.csv'))
+
+if __name__ == "__main__":
+    main()
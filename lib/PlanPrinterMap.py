@@ -11,26 +11,34 @@ original version by jpeterbaker
 """
 
 import os
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 from . import geometry
+# Figures are drawn on Agg canvases of their own, without pyplot and its global state
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.colors import colorConverter
 from matplotlib.patches import Polygon
 import numpy as np
 from . import agentOrder
+from . import mercator
 import networkx as nx
 from . import electricSpring
-#from cStringIO import StringIO
-from io import StringIO
-from io import BytesIO
-from PIL import Image
-#import urllib2
-try:
-    import urllib.request as urllib2
-except ImportError:
-    import urllib2
+from . import renderProfile
 import math
 
+# What PlanPrinter.write can make
+#   keys    keyPrep.txt, ownershipPrep.txt and the agents' key lists
+#   links   the agents' link schedules
+#   maps    portalMap.png and linkMap.png
+#   frames  frame_*.png, the links made one by one (animate)
+#   depths  depth_*.png, the triangulation depth by depth (split3instruct)
+OUTPUTS = ['keys','links','maps','frames','depths']
+# The outputs that need the links split among the agents (agentOrder.getAgentOrder)
+AGENT_OUTPUTS = ['keys','links']
+# The outputs drawn with matplotlib, which PlanPrinter.write can make in processes of their own
+DRAWN_OUTPUTS = ['maps','frames','depths']
+
 # returns the points in a shrunken toward their centroid
 def shrink(a):
     centroid = a.mean(1).reshape([2,1])
@@ -41,8 +49,62 @@ def commaGroup(n):
     s = str(n)
     return ','.join([ s[max(i,0):i+3] for i in range(len(s)-3,-3,-3)][::-1])
 
+def newFigure(size=None):
+    # A figure (size inches wide and high) on an Agg canvas of its own. Nothing else
+    # refers to it (as pyplot would), so it is freed with the last reference to it
+    fig = Figure(figsize=size)
+    FigureCanvasAgg(fig)
+    return fig
+
+def closeFigure(fig):
+    # Frees everything drawn on fig now, not when the garbage collector gets to the figure
+    fig.clf()
+
+def drawEdges(ax,xy,edges,color,width=1.):
+    '''
+    Draws the links edges (p,q pairs of indices into xy) on ax in color, the way
+    networkx 1.x draws a DiGraph's edges: a line width points wide for each, with
+    its last quarter thicker to show which way it goes
+    '''
+    pos = xy[np.array(edges,dtype=int).reshape([-1,2])]
+    if len(pos) == 0:
+        return
+    colors = (colorConverter.to_rgba(color),)
+
+    lines = LineCollection(pos,colors=colors,linewidths=(width,),antialiaseds=(1,),linestyle='solid')
+    lines.set_zorder(1)
+    lines.set_alpha(1.)
+    ax.add_collection(lines)
+
+    src = pos[:,0]
+    dst = pos[:,1]
+    d = np.sqrt(((dst-src)**2).sum(1))
+    theta = np.arctan2(dst[:,1]-src[:,1],dst[:,0]-src[:,0])
+    head = src + .75*d[:,np.newaxis]*np.column_stack([np.cos(theta),np.sin(theta)])
+    # Horizontal links stay exactly horizontal
+    flat = dst[:,1] == src[:,1]
+    head[flat,1] = dst[flat,1]
+    heads = LineCollection(np.stack([head,dst],1)[d > 0],colors=colors,linewidths=(4*width,),antialiaseds=(1,))
+    heads.set_zorder(1)
+    ax.add_collection(heads)
+
+    lo = pos.min((0,1))
+    hi = pos.max((0,1))
+    pad = .05*(hi-lo)
+    ax.update_datalim([lo-pad,hi+pad])
+    ax.autoscale_view()
+
+def drawOutput(printer,output,useGoogle):
+    # Makes one of printer's DRAWN_OUTPUTS, in a worker process of PlanPrinter.write
+    printer.run(output,useGoogle)
+
 class PlanPrinter:
-    def __init__(self,a,outputDir,nagents,color='#FF004D',useGoogle=False,api_key=None):
+    def __init__(self,a,outputDir,nagents,color='#FF004D',useGoogle=False,api_key=None,progress=None,cancel=None,
+                 profile='default'):
+        # progress and cancel are passed on to agentOrder.getAgentOrder
+        # cancel (a cancel.CancelToken) is also checked before each stage of write and each animation frame
+        # profile names the size and detail of the images (see renderProfile)
+        # The agent order and the google map are only worked out once something needs them
         self.a = a
         self.n = a.order() # number of nodes
         self.m = a.size()  # number of links
@@ -50,27 +112,16 @@ class PlanPrinter:
         self.nagents = nagents
         self.outputDir = outputDir
         self.color = color
+        self.progress = progress
+        self.cancel = cancel
 
         # if the ith link to be made is (p,q) then orderedEdges[i] = (p,q)
         self.orderedEdges = [None]*self.m
         for e in a.edges_iter():
             self.orderedEdges[a.edge[e[0]][e[1]]['order']] = e
 
-        # movements[i][j] is the index (in orderedEdges) of agent i's jth link
-        self.movements = agentOrder.getAgentOrder(a,nagents,self.orderedEdges)
-
-        # link2agent[i] is the agent that will make the ith link
-        self.link2agent = [-1]*self.m
-        for i in range(nagents):
-            for e in self.movements[i]:
-                self.link2agent[e] = i
-
-        # keyneeds[i,j] = number of keys agent i needs for portal j
-        self.agentkeyneeds = np.zeros([self.nagents,self.n],dtype=int)
-        for i in range(self.nagents):
-            for e in self.movements[i]:
-                p,q = self.orderedEdges[e]
-                self.agentkeyneeds[i][q] += 1
+        # Set by orderAgents
+        self.movements = None
 
         self.names = np.array([a.node[i]['name'] for i in range(self.n)])
         # The alphabetical order
@@ -91,58 +142,22 @@ class PlanPrinter:
         # total stats for this plan
         self.num_portals = self.n
         self.num_links = self.m
-        self.num_fields = -1
+        self.num_fields = sum(len(a.edge[p][q]['fields']) for p,q in self.orderedEdges)
+
+        self.google_image = None
+        self.mapUrl = None
 
         if useGoogle:
-            # convert xy coordinates to web mercator
-            x_merc = np.array([128./np.pi * (self.a.node[i]['geo'][1] + np.pi) for i in self.a.node.keys()])
-            min_x_merc = np.min(x_merc)
-            #print "min_x_merc",min_x_merc
-            x_merc = x_merc - min_x_merc
-            #print "Xmin, Xmax",np.min(x_merc),np.max(x_merc)
-            y_merc = np.array([128./np.pi * (np.pi - np.log(np.tan(np.pi/4. + self.a.node[i]['geo'][0]/2.))) for i in self.a.node.keys()])
-            min_y_merc = np.min(y_merc)
-            #print "min_y_merc",min_y_merc
-            y_merc = y_merc - min_y_merc
-            #print "Ymin, Ymax",np.min(y_merc),np.max(y_merc)
-            # determine proper zoom such that the map is smaller than 640 on both sides
-            zooms = np.arange(0,20,1)
-            largest_x_zoom = 0
-            largest_y_zoom = 0
-            for zm in zooms:
-                #print "X max",np.max(x_merc * 2.**zm + 20.)
-                #print "Y max",np.max(y_merc * 2.**zm + 20.)
-                if np.max(x_merc * 2.**zm) < 256.:
-                    largest_x_zoom = zm
-                    #print "X",largest_x_zoom
-                if np.max(y_merc * 2.**zm) < 256.:
-                    largest_y_zoom = zm
-                    #print "Y",largest_y_zoom
-            zoom = np.min([largest_x_zoom,largest_y_zoom])
-            min_x_merc = min_x_merc*2.**(1+zoom)
-            min_y_merc = min_y_merc*2.**(1+zoom)
-            self.xy[:,0] = x_merc*2.**(1+zoom)
-            self.xy[:,1] = y_merc*2.**(1+zoom)
-            for i in range(self.n):
-                self.a.node[i]['xy'] = self.xy[i]
-            xsize = np.max(self.xy[:,0])+20
-            ysize = np.max(self.xy[:,1])+20
+            # Web Mercator pixel coordinates on a static map that fits every portal
+            # Only self.xy changes: the portals' gnomonic 'xy' in a are left as they are
+            geo = np.array([self.a.node[i]['geo'] for i in range(self.n)])
+            self.xy,zoom,(latcenter,loncenter),(xsize,ysize) = mercator.mapView(geo)
             self.xylims = [-10,xsize-10,ysize-10,-10]
-            # coordinates needed for google maps
-            loncenter = np.rad2deg((min_x_merc+xsize/2.-10.)*np.pi/(128.*2.**(zoom+1)) - np.pi)
-            latcenter = np.rad2deg(2.*np.arctan(np.exp(-1.*((min_y_merc+ysize/2.-10.)*np.pi/(128.*2.**(zoom+1)) - np.pi))) - np.pi/2.)
-            #latmax = np.rad2deg(max([self.a.node[i]['geo'][0] for i in self.a.node.keys()]))
-            #latmin = np.rad2deg(min([self.a.node[i]['geo'][0] for i in self.a.node.keys()]))
-            #lonmax = np.rad2deg(max([self.a.node[i]['geo'][1] for i in self.a.node.keys()]))
-            #lonmin = np.rad2deg(min([self.a.node[i]['geo'][1] for i in self.a.node.keys()]))
-            #loncenter = (lonmax-lonmin)/2. + lonmin
-            #latcenter = (latmax-latmin)/2. + latmin
             print ("Center Coordinates (lat,lon): ",latcenter,loncenter)
 
             # turn things in to integers for maps API
             map_xwidth = int(xsize)
             map_ywidth = int(ysize)
-            zoom = int(zoom)+1
 
             # google maps API
             # get API key
@@ -151,15 +166,129 @@ class PlanPrinter:
             else:
                 url = "http://maps.googleapis.com/maps/api/staticmap?center={0},{1}&size={2}x{3}&zoom={4}&sensor=false".format(latcenter,loncenter,map_xwidth,map_ywidth,zoom)
             #print url
-        
+            self.mapUrl = url
+
+        self.profile = renderProfile.get(profile)
+        # Markers, lines and fonts are scale times matplotlib's default sizes
+        if self.profile['scaled']:
+            self.scale = renderProfile.sizeScale(self.xy,self.profile['size'])
+        else:
+            self.scale = 1.
+        self.markerSize = matplotlib.rcParams['lines.markersize']*self.scale
+        self.lineWidth  = matplotlib.rcParams['lines.linewidth']*self.scale
+        self.fontSize   = matplotlib.rcParams['font.size']*self.scale
+
+    def googleMap(self):
+        '''
+        Returns the google map under the portals, or None if it could not be had
+        It is fetched the first time a map needs it
+        '''
+        if self.mapUrl is not None:
+            url = self.mapUrl
+            self.mapUrl = None
+
             # determine if we can use google maps
-            self.google_image = None
+            # (PIL and urllib are only needed here)
+            from io import BytesIO
+            from PIL import Image
+            try:
+                import urllib.request as urllib2
+            except ImportError:
+                import urllib2
             try:
                 buffer = BytesIO(urllib2.urlopen(url).read())
                 self.google_image = Image.open(buffer)
-                plt.clf()
             except urllib2.URLError as err:
                 print("Could not connect to google maps server!")
+        return self.google_image
+
+    def orderAgents(self):
+        # Splits the links among the agents, the first time it is needed
+        if self.movements is not None:
+            return
+
+        # movements[i][j] is the index (in orderedEdges) of agent i's jth link
+        self.movements = agentOrder.getAgentOrder(self.a,self.nagents,self.orderedEdges,\
+                                                  progress=self.progress,cancel=self.cancel)
+
+        # link2agent[i] is the agent that will make the ith link
+        self.link2agent = [-1]*self.m
+        for i in range(self.nagents):
+            for e in self.movements[i]:
+                self.link2agent[e] = i
+
+        # keyneeds[i,j] = number of keys agent i needs for portal j
+        self.agentkeyneeds = np.zeros([self.nagents,self.n],dtype=int)
+        for i in range(self.nagents):
+            for e in self.movements[i]:
+                p,q = self.orderedEdges[e]
+                self.agentkeyneeds[i][q] += 1
+
+    def __getstate__(self):
+        # What a worker process of write gets: callbacks and cancel tokens stay in this one
+        state = dict(self.__dict__)
+        state['progress'] = None
+        state['cancel'] = None
+        return state
+
+    def stages(self,useGoogle=False):
+        # (output,stage) for every stage, in the order they run one after another
+        return [('keys'  ,self.keyPrep),
+                ('keys'  ,self.agentKeys),
+                ('maps'  ,lambda: self.planMap(useGoogle=useGoogle)),
+                ('links' ,self.agentLinks),
+                ('frames',lambda: self.animate(useGoogle=useGoogle)),
+                ('depths',lambda: self.split3instruct(useGoogle=useGoogle))]
+
+    def run(self,output,useGoogle=False):
+        # Runs the stages of one output
+        for name,stage in self.stages(useGoogle):
+            if name == output:
+                if self.cancel is not None:
+                    self.cancel.check()
+                stage()
+
+    def write(self,outputs=OUTPUTS,useGoogle=False,jobs=1):
+        '''
+        Makes the files of each output named in outputs (see OUTPUTS) and nothing else
+        The agent order is only worked out if an output in AGENT_OUTPUTS is asked for
+
+        With jobs > 1, each of the DRAWN_OUTPUTS asked for is made in a process of its own
+        (up to jobs at once) while this thread writes the text files, so the whole takes
+        about as long as the slowest of them (usually the frames)
+        Cancelling stops the text files and the drawings not yet started
+        '''
+        drawn = [ output for output in DRAWN_OUTPUTS if output in outputs ]
+        if jobs <= 1 or len(drawn) == 0:
+            for output,stage in self.stages(useGoogle):
+                if output in outputs:
+                    if self.cancel is not None:
+                        self.cancel.check()
+                    stage()
+            return
+
+        from concurrent.futures import ProcessPoolExecutor,wait
+        # Fetched once here, not by every process
+        if useGoogle:
+            self.googleMap()
+
+        with ProcessPoolExecutor(max_workers=min(jobs,len(drawn))) as pool:
+            futures = [ pool.submit(drawOutput,self,output,useGoogle) for output in drawn ]
+            try:
+                for output in OUTPUTS:
+                    if output in outputs and output not in drawn:
+                        self.run(output,useGoogle)
+                pending = futures
+                while len(pending) > 0:
+                    if self.cancel is not None:
+                        self.cancel.check()
+                    done,pending = wait(pending,timeout=1.)
+                for future in futures:
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
 
     def keyPrep(self):
         rowFormat = '{0:11d} | {1:6d} | {2}\n'
@@ -201,113 +330,99 @@ class PlanPrinter:
 
 
     def agentKeys(self):
+        self.orderAgents()
         rowFormat = '%4s %4s %s\n'
-        csv_file = open(self.outputDir+'keys_for_agents.csv','w')
-        csv_file.write('agent, mapNum, name, keys\n')
+        csvRows = ['agent, mapNum, name, keys\n']
         for agent in range(self.nagents):
+            rows = ['Keys for Agent %s of %s\n\n'%(agent+1,self.nagents),\
+                    'Map# Keys Name\n']
+
+            for portal in self.nameOrder:
+
+                keys = self.agentkeyneeds[agent,portal]
+                if self.agentkeyneeds[agent,portal] == 0:
+                    keys = ''
+
+                rows.append(rowFormat%(\
+                    self.nslabel[portal],\
+                    keys,\
+                    self.names[portal]\
+                ))
+                csvRows.append('{0}, {1}, {2}, {3}\n'.\
+                               format(agent,self.nslabel[portal],
+                                      self.names[portal],keys))
+
             with open(self.outputDir+'keys_for_agent_%s_of_%s.txt'\
                     %(agent+1,self.nagents),'w') as fout:
-                fout.write('Keys for Agent %s of %s\n\n'%(agent+1,self.nagents))
-                fout.write('Map# Keys Name\n')
-
-                for portal in self.nameOrder:
-                    
-                    keys = self.agentkeyneeds[agent,portal]
-                    if self.agentkeyneeds[agent,portal] == 0:
-                        keys = ''
-                        
-                    fout.write(rowFormat%(\
-                        self.nslabel[portal],\
-                        keys,\
-                        self.names[portal]\
-                    ))
-                    csv_file.write('{0}, {1}, {2}, {3}\n'.\
-                                   format(agent,self.nslabel[portal],
-                                          self.names[portal],keys))
-        csv_file.close()
-
-    def drawBlankMap(self):
-        plt.plot(self.xy[:,0],self.xy[:,1],'o',ms=16,color=self.color)
+                fout.write(''.join(rows))
+
+        with open(self.outputDir+'keys_for_agents.csv','w') as csv_file:
+            csv_file.write(''.join(csvRows))
+
+    def newFigure(self):
+        return newFigure(self.profile['size'])
+
+    def save(self,fig,filename):
+        # Writes fig to filename in the output directory, at the profile's resolution
+        fig.savefig(self.outputDir+filename,dpi=self.profile['dpi'])
+
+    def drawBlankMap(self,ax):
+        ax.plot(self.xy[:,0],self.xy[:,1],'o',ms=16*self.scale,color=self.color)
 
         for i in range(self.n):
-            plt.text(self.xy[i,0],self.xy[i,1],self.nslabel[i],\
-                     fontweight='bold',ha='center',va='center',fontsize=10)
+            ax.text(self.xy[i,0],self.xy[i,1],self.nslabel[i],\
+                    fontweight='bold',ha='center',va='center',fontsize=10*self.scale)
 
-    def drawSubgraph(self,edges=None):
+    def drawSubgraph(self,ax,edges=None):
         '''
-        Draw a subgraph of a
+        Draw a subgraph of a on ax
         Only includes the edges in 'edges'
         Default is all edges
         '''
-        if edges == None:
-            edges = range(self.m)
-
-#        anchors = np.array([ self.xy[self.orderedEdges[e],:] for e in edges]).mean(1)
-#        edgeLabelPos = electricSpring.edgeLabelPos(self.xy,anchors)
-#
-#        self.drawBlankMap()
-#
-#        for i in range(len(edges)):
-#            j = edges[i]
-#            p,q = self.orderedEdges[j]
-#            plt.plot([ self.xy[p,0],edgeLabelPos[i,0],self.xy[q,0] ]  ,\
-#                     [ self.xy[p,1],edgeLabelPos[i,1],self.xy[q,1] ],'r-')
-#
-#            plt.text(edgeLabelPos[i,0],edgeLabelPos[i,1],j,\
-#                     ha='center',va='center')
-
-### The code below works. It just uses networkx draw functions
         if edges == None:
             b = self.a
         else:
             b = nx.DiGraph()
             b.add_nodes_from(range(self.n))
 
-            b = nx.DiGraph()
-            b.add_nodes_from(range(self.n))
-
             for e in edges:
                 p,q = self.orderedEdges[e]
                 b.add_edge(p,q,{'order':e})
 
-        edgelabels = dict([ (e,self.a.edge[e[0]][e[1]]['order'])\
-                            for e in b.edges_iter() ])
+        labeled = [ (self.a.edge[p][q]['order'],p,q) for p,q in b.edges_iter() ]
 
-        plt.plot(self.xy[:,0],self.xy[:,1],'o',ms=16,color=self.color)
+        ax.plot(self.xy[:,0],self.xy[:,1],'o',ms=16*self.scale,color=self.color)
 
         for j in range(self.n):
             i = self.posOrder[j]
-            plt.text(self.xy[i,0],self.xy[i,1],j,\
-                     fontweight='bold',ha='center',va='center')
-
-        try:
-            nx.draw_networkx_edge_labels(b,self.ptmap,edgelabels,font_size=8,
-                                         bbox=dict(boxstyle="round",fc="w"))
-        except AttributeError:
-            self.ptmap   = dict([(i,self.a.node[i]['xy']) for i in range(self.n) ])
-            nx.draw_networkx_edge_labels(b,self.ptmap,edgelabels,font_size=8,
-                                         bbox=dict(boxstyle="round",fc="w"))
-
-        # edge_color does not seem to support arbitrary colors easily
+            ax.text(self.xy[i,0],self.xy[i,1],j,\
+                    fontweight='bold',ha='center',va='center',fontsize=self.fontSize)
+
+        if self.profile['labels']:
+            # Link numbers start at the middle of their links and are pushed off portals and each other
+            anchors = np.array([ self.xy[[p,q]].mean(0) for order,p,q in labeled ]).reshape([-1,2])
+            labelPos = electricSpring.edgeLabelPos(self.xy,anchors)
+            for (order,p,q),pos in zip(labeled,labelPos):
+                ax.text(pos[0],pos[1],order,fontsize=8*self.scale,ha='center',va='center',
+                        bbox=dict(boxstyle="round",fc="w"),zorder=3)
+
         if self.color == '#3BF256':
-            nx.draw_networkx_edges(b,self.ptmap,edge_color='g')
-        elif self.color == '#2ABBFF':
-            nx.draw_networkx_edges(b,self.ptmap,edge_color='k')
+            drawEdges(ax,self.xy,[ (p,q) for order,p,q in labeled ],'g',self.scale)
         else:
-            nx.draw_networkx_edges(b,self.ptmap,edge_color='k')
-        plt.axis('off')
+            drawEdges(ax,self.xy,[ (p,q) for order,p,q in labeled ],'k',self.scale)
+        ax.axis('off')
 
     def planMap(self,useGoogle=False):
-        fig = plt.figure()
+        fig = self.newFigure()
         ax  = fig.add_subplot(111)
         if useGoogle:
-            if self.google_image is None:
+            if self.googleMap() is None:
                 return
-            implot = plt.imshow(self.google_image,extent=self.xylims,origin='upper')
+            ax.imshow(self.google_image,extent=self.xylims,origin='upper')
         # Plot labels aligned to avoid other portals
         for j in range(self.n):
             i = self.posOrder[j]
-            plt.plot(self.xy[i,0],self.xy[i,1],'o',color=self.color)
+            ax.plot(self.xy[i,0],self.xy[i,1],'o',ms=self.markerSize,color=self.color)
 
             displaces = self.xy[i] - self.xy
             displaces[i,:] = np.inf
@@ -323,35 +438,36 @@ class PlanPrinter:
             else:
                 va = 'top'
             
-            plt.text(self.xy[i,0],self.xy[i,1],str(j),ha=ha,va=va)
+            ax.text(self.xy[i,0],self.xy[i,1],str(j),ha=ha,va=va,fontsize=self.fontSize)
 
-        fig = plt.gcf()
         #fig.set_size_inches(8.5,11)
-        if useGoogle: plt.axis(self.xylims)
-        plt.axis('off')
-        plt.title('Portals numbered north to south\nNames on key list')
-        plt.savefig(self.outputDir+"portalMap.png")
-        plt.clf()
+        if useGoogle: ax.axis(self.xylims)
+        ax.axis('off')
+        ax.set_title('Portals numbered north to south\nNames on key list')
+        self.save(fig,"portalMap.png")
+        fig.clf()
 
+        ax = fig.add_subplot(111)
         if useGoogle:
-            if self.google_image is None:
-                return
-            implot = plt.imshow(self.google_image,extent=self.xylims,origin='upper')
+            ax.imshow(self.google_image,extent=self.xylims,origin='upper')
         # Draw the map with all edges in place and labeled
-        self.drawSubgraph()
-        if useGoogle: plt.axis(self.xylims)
-        plt.axis('off')
-        plt.title('Portal and Link Map')
-        plt.savefig(self.outputDir+"linkMap.png")
-        plt.clf()
+        self.drawSubgraph(ax)
+        if useGoogle: ax.axis(self.xylims)
+        ax.axis('off')
+        ax.set_title('Portal and Link Map')
+        self.save(fig,"linkMap.png")
+        closeFigure(fig)
 
 #        for agent in range(self.nagents):
-#            self.drawSubgraph(self.movements[agent])
-#            plt.axis(xylims)
-#            plt.savefig(self.outputDir+'linkMap_agent_%s_of_%s.png'%(agent+1,self.nagents))
-#            plt.clf()
+#            fig = self.newFigure()
+#            ax = fig.add_subplot(111)
+#            self.drawSubgraph(ax,self.movements[agent])
+#            ax.axis(xylims)
+#            self.save(fig,'linkMap_agent_%s_of_%s.png'%(agent+1,self.nagents))
+#            closeFigure(fig)
 
     def agentLinks(self):
+        self.orderAgents()
         # Total distance traveled by each agent
         agentdists = np.zeros(self.nagents)
         # Total experience for each agent
@@ -374,16 +490,48 @@ class PlanPrinter:
         plainStr = '{0:4d}{1:1s} {2: 5d}{3:5d} {4:s}\n            {5:4d} {6:s}\n\n'
         hilitStr = '{0:4d}{1:1s} {2:_>5d}{3:5d} {4:s}\n            {5:4d} {6:s}\n\n'
 
-        csv_file = open(self.outputDir+'links_for_agents.csv','w')
-        
+        # The link table is formatted once
+        # Each agent's schedule is the plain table with that agent's rows swapped for highlighted ones
+        plainRows = [None]*self.m
+        hilitRows = [None]*self.m
+        csvRows = ['Link, Agent, MapNumOrigin, OriginName, MapNumDestination, DestinationName\n']
+
+        for i in range(self.m):
+            p,q = self.orderedEdges[i]
+
+            linkagent = self.link2agent[i]
+
+            # Put a star by links that can be completed early since they complete no fields
+            numfields = len(self.a.edge[p][q]['fields'])
+            if numfields == 0:
+                star = '*'
+#                print '%s %s completes nothing'%(p,q)
+            else:
+                star = ''
+#                print '%s %s completes'%(p,q)
+#                for t in self.a.edge[p][q]['fields']:
+#                    print '   ',t
+
+            row = (i,star,linkagent+1,\
+                   self.nslabel[p],self.names[p],\
+                   self.nslabel[q],self.names[q])
+
+            plainRows[i] = plainStr.format(*row)
+            hilitRows[i] = hilitStr.format(*row)
+            csvRows.append("{0}{1}, {2}, {3}, {4}, {5}, {6}\n".format(*row))
+
+        totalTime = self.a.walktime+self.a.linktime+self.a.commtime
+
         for agent in range(self.nagents):
+            rows = list(plainRows)
+            for e in self.movements[agent]:
+                rows[e] = hilitRows[e]
+
             with open(self.outputDir+'links_for_agent_%s_of_%s.txt'\
                     %(agent+1,self.nagents),'w') as fout:
 
                 fout.write('Complete link schedule issued to agent %s of %s\n'\
                     %(agent+1,self.nagents))
-                
-                totalTime = self.a.walktime+self.a.linktime+self.a.commtime
 
                 fout.write('\nTotal time estimate: %s minutes\n\n'%int(totalTime/60+.5))
 
@@ -396,55 +544,17 @@ class PlanPrinter:
                 fout.write('                 Link Destination\n')
                 fout.write('-----------------------------------\n')
                 #             1234112345612345 name
-                csv_file.write('Link, Agent, MapNumOrigin, OriginName, MapNumDestination, DestinationName\n')
-                
-                for i in range(self.m):
-                    p,q = self.orderedEdges[i]
-                    
-                    linkagent = self.link2agent[i]
-
-                    # Put a star by links that can be completed early since they complete no fields
-                    numfields = len(self.a.edge[p][q]['fields'])
-                    if numfields == 0:
-                        star = '*'
-#                        print '%s %s completes nothing'%(p,q)
-                    else:
-                        star = ''
-#                        print '%s %s completes'%(p,q)
-#                        for t in self.a.edge[p][q]['fields']:
-#                            print '   ',t
-
-                    if linkagent != agent:
-                        fout.write(plainStr.format(\
-                            i,\
-                            star,\
-                            linkagent+1,\
-                            self.nslabel[p],\
-                            self.names[p],\
-                            self.nslabel[q],\
-                            self.names[q]\
-                        ))
-                    else:
-                        fout.write(hilitStr.format(\
-                            i,\
-                            star,\
-                            linkagent+1,\
-                            self.nslabel[p],\
-                            self.names[p],\
-                            self.nslabel[q],\
-                            self.names[q]\
-                        ))
-                    csv_file.write("{0}{1}, {2}, {3}, {4}, {5}, {6}\n".\
-                                   format(i,star,linkagent+1,
-                                          self.nslabel[p],self.names[p],
-                                          self.nslabel[q],self.names[q]))
-        csv_file.close()
+                fout.write(''.join(rows))
+
+        with open(self.outputDir+'links_for_agents.csv','w') as csv_file:
+            csv_file.write(''.join(csvRows))
 
     def animate(self,useGoogle=False):
         """
         Show how the links will unfold
+        Each frame adds to the one before (the links and fields so far are drawn once, not every frame)
         """
-        fig = plt.figure()
+        fig = self.newFigure()
         ax  = fig.add_subplot(111)
 
         GREEN     = ( 0.0 , 1.0 , 0.0 , 0.3)
@@ -452,155 +562,132 @@ class PlanPrinter:
         RED       = ( 1.0 , 0.0 , 0.0 , 0.5)
         INVISIBLE = ( 0.0 , 0.0 , 0.0 , 0.0 )
 
-        portals = np.array([self.a.node[i]['xy']
-                            for i in self.a.nodes_iter()]).T
-        
-        # Plot all edges lightly
-        def dashAllEdges():
-            for p,q in self.a.edges_iter():
-                plt.plot(portals[0,[p,q]],portals[1,[p,q]],'k:')
+        portals = self.xy.T
 
         aptotal = 0
         edges   = []
         patches = []
 
         if useGoogle:
-            if self.google_image is None:
+            if self.googleMap() is None:
                 return
-            implot = plt.imshow(self.google_image,extent=self.xylims,origin='upper')
-        plt.plot(portals[0],portals[1],marker='o',markerfacecolor='#2ABBFF',linestyle=' ')
-        dashAllEdges()
+            ax.imshow(self.google_image,extent=self.xylims,origin='upper')
+        ax.plot(portals[0],portals[1],marker='o',markerfacecolor='#2ABBFF',linestyle=' ',ms=self.markerSize)
+        # Plot all edges lightly
+        if self.profile['dashes']:
+            for p,q in self.a.edges_iter():
+                ax.plot(portals[0,[p,q]],portals[1,[p,q]],'k:',lw=self.lineWidth)
 
-        plt.title('AP:\n%s'%commaGroup(aptotal),ha='center')
-        if useGoogle: plt.axis(self.xylims)
-        plt.axis('off')
-        plt.savefig(self.outputDir+'frame_-1.png')
-        plt.clf()
+        ax.set_title('AP:\n%s'%commaGroup(aptotal),ha='center')
+        if useGoogle: ax.axis(self.xylims)
+        ax.axis('off')
+        self.save(fig,'frame_-1.png')
 
+        # The last frame's new link, drawn black with an arrowhead
+        newLines = []
         # let's plot some stuff
         for i in range(self.m):
-            if useGoogle:
-                if self.google_image is None:
-                    return
-                implot = plt.imshow(self.google_image,extent=self.xylims,origin='upper')
+            if self.cancel is not None:
+                self.cancel.check()
             p,q = self.orderedEdges[i]
-            plt.plot(portals[0],portals[1],marker='o',markerfacecolor='#2ABBFF', linestyle=' ')
-            # Plot all edges lightly
-            dashAllEdges()
-            for edge in edges:
-                plt.plot(edge[0],edge[1],color='#2ABBFF')
+
+            # The link before is now drawn like the older ones
+            for line in newLines:
+                line.remove()
+            if len(edges) > 0:
+                ax.plot(edges[-1][0],edges[-1][1],color='#2ABBFF',lw=self.lineWidth)
 
             # We'll display the new fields in red
             newPatches = []
             for tri in self.a.edge[p][q]['fields']:
-                coords = np.array([ self.a.node[v]['xy'] for v in tri ])
-                newPatches.append(Polygon(shrink(coords.T).T,facecolor=RED,\
-                                                 edgecolor=INVISIBLE))
-            
+                coords = self.xy[tri]
+                newPatches.append(ax.add_patch(Polygon(shrink(coords.T).T,facecolor=RED,\
+                                                       edgecolor=INVISIBLE)))
+
             aptotal += 313+1250*len(newPatches)
-            newEdge = np.array([self.a.node[p]['xy'],self.a.node[q]['xy']]).T
+            newEdge = self.xy[[p,q]].T
             patches += newPatches
-            edges.append(newEdge)            
-            plt.plot(newEdge[0],newEdge[1],'k-',lw=2)
+            edges.append(newEdge)
             x0 = newEdge[0][0]
             x1 = newEdge[0][1]
             y0 = newEdge[1][0]
             y1 = newEdge[1][1]
-            plt.plot([x1-0.05*(x1-x0),x1-0.4*(x1-x0)],
-                     [y1-0.05*(y1-y0),y1-0.4*(y1-y0)],'k-',lw=6)
-            ax = plt.gca()
-            for patch in patches:
-                ax.add_patch(patch)
+            newLines = ax.plot(newEdge[0],newEdge[1],'k-',lw=2*self.scale) +\
+                       ax.plot([x1-0.05*(x1-x0),x1-0.4*(x1-x0)],
+                               [y1-0.05*(y1-y0),y1-0.4*(y1-y0)],'k-',lw=6*self.scale)
             ax.set_title('AP:\n%s'%commaGroup(aptotal),ha='center')
-            if useGoogle: plt.axis(self.xylims)
-            ax.axis('off')
-            plt.savefig(self.outputDir+'frame_{0:03d}.png'.format(i))
-            ax.cla()
-                
+            self.save(fig,'frame_{0:03d}.png'.format(i))
+
             # reset patches to green
             for patch in newPatches:
                 patch.set_facecolor("#2ABBFF")
 
+        # The whole plan, without the dotted links
+        ax.cla()
         if useGoogle:
-            if self.google_image is None:
-                return
-            implot = plt.imshow(self.google_image,extent=self.xylims,origin='upper')
+            ax.imshow(self.google_image,extent=self.xylims,origin='upper')
 
-        plt.plot(portals[0],portals[1],marker='o',markerfacecolor='#2ABBFF')
+        ax.plot(portals[0],portals[1],marker='o',markerfacecolor='#2ABBFF',ms=self.markerSize,lw=self.lineWidth)
         for edge in edges:
-            plt.plot(edge[0],edge[1],color='#2ABBFF',linestyle='-')
+            ax.plot(edge[0],edge[1],color='#2ABBFF',linestyle='-',lw=self.lineWidth)
         for patch in patches:
-            ax.add_patch(patch)
+            ax.add_patch(Polygon(patch.get_xy(),facecolor="#2ABBFF",edgecolor=INVISIBLE))
         ax.set_title('AP:\n%s'%commaGroup(aptotal),ha='center')
-        if useGoogle: plt.axis(self.xylims)
+        if useGoogle: ax.axis(self.xylims)
         ax.axis('off')
-        plt.savefig(self.outputDir+'frame_{0:03d}.png'.format(self.m))
-        ax.cla()
-
-        self.num_fields = len(patches)
+        self.save(fig,'frame_{0:03d}.png'.format(self.m))
+        closeFigure(fig)
 
     def split3instruct(self, useGoogle=False):
-        portals = np.array([self.a.node[i]['xy'] for i in self.a.nodes_iter()]).T
+        portals = self.xy.T
         
         gen1 = self.a.triangulation
 
-        oldedges = []
-
-        plt.clf()
+        fig = self.newFigure()
+        ax  = fig.add_subplot(111)
         if useGoogle:
-            if self.google_image is None:
+            if self.googleMap() is None:
                 return
-            implot = plt.imshow(self.google_image,extent=self.xylims,origin='upper')
-        plt.plot(portals[0],portals[1],marker='o',markerfacecolor='#2ABBFF',linestyle=' ')
-        # plt.plot(portals[0],portals[1],'go')
-        if useGoogle: plt.axis(self.xylims)
-        plt.axis('off')
-        plt.savefig(self.outputDir+'depth_-1.png')
-        plt.clf()
+            ax.imshow(self.google_image,extent=self.xylims,origin='upper')
+        ax.plot(portals[0],portals[1],marker='o',markerfacecolor='#2ABBFF',linestyle=' ',ms=self.markerSize)
+        # ax.plot(portals[0],portals[1],'go')
+        if useGoogle: ax.axis(self.xylims)
+        ax.axis('off')
+        self.save(fig,'depth_-1.png')
+        fig.clf()
 
+        # Each depth adds its edges in red to the black ones before
+        ax = fig.add_subplot(111)
+        if useGoogle:
+            ax.imshow(self.google_image,extent=self.xylims,origin='upper')
+        ax.plot(portals[0],portals[1],marker='o',markerfacecolor='#2ABBFF', linestyle='-',ms=self.markerSize,lw=self.lineWidth)
+
+        newLines = []
         depth = 0
         while True:
             # newedges[i][0] has the x-coordinates of both verts of edge i
-            newedges = [ np.array([
-                                self.a.node[p]['xy'] ,\
-                                self.a.node[q]['xy']
-                         ]).T\
-                             for j in range(len(gen1)) \
-                             for p,q in gen1[j].edgesByDepth(depth)\
-                       ]
+            newedges = np.vstack([ t.tree.edgesByDepth(t.index,depth) for t in gen1 ])
+            newedges = list(self.xy[newedges].transpose(0,2,1))
 
             if len(newedges) == 0:
                 break
 
-            if useGoogle:
-                if self.google_image is None:
-                    return
-                implot = plt.imshow(self.google_image,extent=self.xylims,origin='upper')
-            plt.plot(portals[0],portals[1],marker='o',markerfacecolor='#2ABBFF', linestyle='-')
-
-            for edge in oldedges:
-                plt.plot(edge[0],edge[1],'k-')
+            for line in newLines:
+                line.set_color('k')
 
+            newLines = []
             for edge in newedges:
-                plt.plot(edge[0],edge[1],'r-')
+                newLines += ax.plot(edge[0],edge[1],'r-',lw=self.lineWidth)
             
-            oldedges += newedges
-            if useGoogle: plt.axis(self.xylims)
-            plt.axis('off')
-            plt.savefig(self.outputDir+'depth_{0:03d}.png'.format(depth))
-            plt.clf()
+            if useGoogle: ax.axis(self.xylims)
+            ax.axis('off')
+            self.save(fig,'depth_{0:03d}.png'.format(depth))
 
             depth += 1
 
-        if useGoogle:
-            if self.google_image is None:
-                return
-            implot = plt.imshow(self.google_image,extent=self.xylims,origin='upper')
-        plt.plot(portals[0],portals[1],marker='o',markerfacecolor='#2ABBFF',linestyle='-')
-
-        for edge in oldedges:
-            plt.plot(edge[0],edge[1],'k-')
-        if useGoogle: plt.axis(self.xylims)
-        plt.axis('off')
-        plt.savefig(self.outputDir+'depth_{0:03d}.png'.format(depth))
-        plt.clf()
+        for line in newLines:
+            line.set_color('k')
+        if useGoogle: ax.axis(self.xylims)
+        ax.axis('off')
+        self.save(fig,'depth_{0:03d}.png'.format(depth))
+        closeFigure(fig)
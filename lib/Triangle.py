@@ -3,6 +3,11 @@
 from . import geometry
 np = geometry.np
 
+# Tasks for TriTree.build
+BUILD_GRAPH        = 0
+BUILD_EXCEPT_FINAL = 1
+BUILD_FINAL        = 2
+
 class Deadend(Exception):
     def __init__(self,s):
         self.explain = s
@@ -22,7 +27,7 @@ def try_ordered_edge(a,p,q,reversible):
 #            print '%s and %s already have 8 outgoing'%(p,q)
             raise(Deadend('%s and %s already have 8 outgoing'%(p,q)))
         p,q = q,p
-    
+
     m = a.size()
     a.add_edge(p,q,{'order':m,'reversible':reversible,'fields':[]})
 
@@ -33,187 +38,526 @@ def try_ordered_edge(a,p,q,reversible):
 #    print 'adding',p,q
 #    print a.edgeStack
 
-class Triangle:
-    def __init__(self,verts,a,exterior=False):
+class TriTree:
+    '''
+    A first generation triangle and all of its descendants, stored in flat arrays
+    Triangle t of the tree has
+        verts[t]    its three portals (verts[t,0] is the final one used in linking)
+        children[t] the triangles it is split into (-1,-1,-1 if it is not split)
+                    children[t,0] is the one opposite the final vertex
+        parent[t]   the triangle it was split from (-1 for the root, which is triangle 0)
+        center[t]   the portal it is split on (-1 if it is not split)
+        depth[t]    the number of splits between it and the root
+        exterior[t] whether the orientation of its outer edges is free
+
+    contents[t] lists the portals inside triangle t that have not been placed yet
+        it is only needed while splitting and is dropped once t is split
+
+    Triangles are numbered in the order they are made, so at any given depth they appear left to right
+    '''
+    ARRAYS = ('verts','children','parent','center','depth','exterior')
+
+    def __init__(self,verts,a,exterior=False,rng=np.random):
+        self.a = a
+        # Random choices made for and by this tree (np.random or a np.random.RandomState)
+        self.rng = rng
+        self.size = 0
+
+        self.verts    = np.empty([1,3],dtype=int)
+        self.children = np.empty([1,3],dtype=int)
+        self.parent   = np.empty(1,dtype=int)
+        self.center   = np.empty(1,dtype=int)
+        self.depth    = np.empty(1,dtype=int)
+        self.exterior = np.empty(1,dtype=bool)
+        self.contents = []
+
+        # xyz coordinates of every portal, only kept while splitting
+        self.xyz = None
+
+        self.add(verts,-1,exterior)
+
+    def __getstate__(self):
+        # np.random is a module, which cannot be pickled (e.g. to draw a plan in another process)
+        state = dict(self.__dict__)
+        if state['rng'] is np.random:
+            state['rng'] = None
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if self.rng is None:
+            self.rng = np.random
+
+    def reserve(self,capacity):
+        # Make room for capacity triangles
+        if capacity <= len(self.parent):
+            return
+        for name in TriTree.ARRAYS:
+            old = getattr(self,name)
+            new = np.empty((capacity,)+old.shape[1:],dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self,name,new)
+
+    def add(self,verts,parent,exterior):
         '''
-        verts should be a 3-list of Portals
-        verts[0] should be the final one used in linking
+        Appends a triangle on verts and returns its index
         exterior should be set to true if this triangle has no triangle parent
             the orientation of the outer edges of exterior Triangles do not matter
         '''
-        # If this portal is exterior, the final vertex doesn't matter
-        self.verts = list(verts)
-        self.a = a
-        self.exterior = exterior
+        t = self.size
+        if t >= len(self.parent):
+            self.reserve(2*t)
 
+        verts = list(verts)
+        # If this portal is exterior, the final vertex doesn't matter
         if exterior:
             # Randomizing should help prevent perimeter nodes from getting too many links
-            final = np.random.randint(3)
-            tmp = self.verts[final]
-            self.verts[final] = self.verts[0]
-            self.verts[0] = tmp
-
-        self.pts = np.array([a.node[p]['xyz'] for p in verts])
-        self.children = []
-        self.contents = []
-        self.center = None
-
-    def findContents(self,candidates=None):
-        if candidates == None:
+            final = self.rng.randint(3)
+            verts[final],verts[0] = verts[0],verts[final]
+
+        self.verts[t]    = verts
+        self.children[t] = -1
+        self.parent[t]   = parent
+        self.center[t]   = -1
+        self.depth[t]    = 0 if parent < 0 else self.depth[parent]+1
+        self.exterior[t] = exterior
+        self.contents.append([])
+
+        self.size += 1
+        return t
+
+    def triangle(self,t):
+        # A Triangle view of triangle t
+        view = Triangle.__new__(Triangle)
+        view.tree  = self
+        view.index = t
+        return view
+
+    def pts(self,t):
+        return np.array([self.a.node[p]['xyz'] for p in self.verts[t]])
+
+    def findContents(self,t,candidates=None):
+        if candidates is None:
             candidates = range(self.a.order())
-        for p in candidates:
-            if p in self.verts:
-                continue
-            if geometry.sphereTriContains(self.pts,self.a.node[p]['xyz']):
-                self.contents.append(p)
+        if self.xyz is None:
+            self.xyz = np.array([self.a.node[p]['xyz'] for p in range(self.a.order())])
 
-    def randSplit(self):
-        if len(self.contents) == 0:
+        verts = self.verts[t]
+        candidates = [p for p in candidates if p not in verts]
+        if len(candidates) == 0:
+            self.contents[t] = []
             return
-        
-        p = self.contents[np.random.randint(len(self.contents))]
-        
-        self.splitOn(p)
 
-        for child in self.children:
-            child.randSplit()
+        inside = geometry.sphereTriContains(self.pts(t),self.xyz[candidates])
+        self.contents[t] = [p for p,isin in zip(candidates,inside) if isin]
 
-    def nearSplit(self):
-        # Split on the node closest to final
-        if len(self.contents) == 0:
-            return
-        contentPts = np.array([self.a.node[p]['pos'] for p in self.contents])
-        displaces = contentPts - self.a.node[self.verts[0]]['pos']
-        dists = np.sum(displaces**2,1)
-        closest = np.argmin(dists)
+        # Every content portal will split one triangle into three
+        if t == 0:
+            self.reserve(1+3*len(self.contents[t]))
 
-        self.splitOn(self.contents[closest])
-
-        for child in self.children:
-            child.nearSplit()
-
-    def splitOn(self,p):
+    def splitOn(self,t,p):
+        v0,v1,v2 = self.verts[t].tolist()
         # 'opposite' is the child that does not share the final vertex
         # Because of the build order, it's safe for this triangle to believe it is exterior
-        opposite  =  Triangle([self.verts[1],p,\
-                               self.verts[2]],self.a,True)
+        opposite = self.add([v1,p,v2],t,True)
         # The other two children must also use my final as their final
-        adjacents = [\
-                     Triangle([self.verts[0],\
-                               self.verts[2],p],self.a),\
-                     Triangle([self.verts[0],\
-                               self.verts[1],p],self.a)\
-                    ]
-        
-        self.children = [opposite]+adjacents
-        self.center = p
-
-        for child in self.children:
-            child.findContents(self.contents)
+        adjacents = [ self.add([v0,v2,p],t,False) ,\
+                      self.add([v0,v1,p],t,False) ]
 
-    def tostr(self):
-        # Just a string representation of the triangle
-        return str([self.a.node[self.verts[i]]['name'] for i in range(3)])
+        self.children[t] = [opposite]+adjacents
+        self.center[t] = p
 
-    def buildFinal(self):
+        for child in self.children[t]:
+            self.findContents(child,self.contents[t])
+        # The contents have all been handed to the children
+        self.contents[t] = None
+
+    def splitAll(self,t,choose):
+        '''
+        Splits triangle t and all its descendants (depth-first, children in order)
+        choose(triangle) returns the content portal on which to split a Triangle view
+        '''
+        stack = [t]
+        while len(stack) > 0:
+            u = stack.pop()
+            if len(self.contents[u]) == 0:
+                continue
+
+            self.splitOn(u,choose(self.triangle(u)))
+
+            stack.extend(self.children[u,::-1])
+
+        # Splitting is over, so the coordinates are no longer needed
+        self.xyz = None
+
+    def addFinalEdges(self,t):
+        v = self.verts[t]
 #        print 'building final',self.tostr()
-        if self.exterior:
+        if self.exterior[t]:
             # Avoid making the final the link origin when possible
 #            print self.tostr(),'is exterior'
-            try_ordered_edge(self.a,self.verts[1],\
-                               self.verts[0],self.exterior)
-            try_ordered_edge(self.a,self.verts[2],\
-                               self.verts[0],self.exterior)
+            try_ordered_edge(self.a,v[1],v[0],True)
+            try_ordered_edge(self.a,v[2],v[0],True)
         else:
 #            print self.tostr(),'is NOT exterior'
-            try_ordered_edge(self.a,self.verts[0],\
-                               self.verts[1],self.exterior)
-            try_ordered_edge(self.a,self.verts[0],\
-                               self.verts[2],self.exterior)
-
-        if len(self.children) > 0:
-            for i in [1,2]:
-                self.children[i].buildFinal()
-
-    def buildExceptFinal(self):
-#        print 'building EXCEPT final',self.tostr()
-        if len(self.children) == 0:
-#            print 'no children'
-            p,q = self.verts[2] , self.verts[1]
-            try_ordered_edge(self.a,p,q,True)
-            return
-
-        # Child 0 is guaranteed to be the one opposite final
-        self.children[0].buildGraph()
+            try_ordered_edge(self.a,v[0],v[1],False)
+            try_ordered_edge(self.a,v[0],v[2],False)
 
-        for child in self.children[1:3]:
-            child.buildExceptFinal()
-
-    def buildGraph(self):
-#        print 'building',self.tostr()
+    def checkFinal(self,t):
         # A first generation triangle could have its final vertex's edges already completed by neighbors. This will cause the first generation to be completed when the opposite edge is added which complicates  completing inside descendents. This could be solved by choosing a new final vertex (or carefully choosing the order of completion of first generation triangles).
-        if (                                                \
-            self.a.has_edge(self.verts[0],self.verts[1]) or \
-            self.a.has_edge(self.verts[1],self.verts[0])    \
-           ) and                                            \
-           (                                                \
-            self.a.has_edge(self.verts[0],self.verts[2]) or \
-            self.a.has_edge(self.verts[2],self.verts[0])    \
+        v = self.verts[t]
+        if (                               \
+            self.a.has_edge(v[0],v[1]) or \
+            self.a.has_edge(v[1],v[0])    \
+           ) and                           \
+           (                               \
+            self.a.has_edge(v[0],v[2]) or \
+            self.a.has_edge(v[2],v[0])    \
            ):
 #            print 'Final vertex completed!!!'
             raise Deadend('Final vertex completed by neighbors')
-        self.buildExceptFinal()
-        self.buildFinal()
-
-    def contains(self,pt):
-        return np.all(np.sum(self.orths*(pt-self.pts),1) < 0)
 
-    # Attach to each edge a list of fields that it completes
-    def markEdgesWithFields(self):
+    def build(self,t,task):
+        '''
+        Adds the edges of triangle t and its descendants to self.a
+        task is one of BUILD_GRAPH, BUILD_EXCEPT_FINAL, BUILD_FINAL
+
+        A graph build is
+            the build of everything except the final vertex's edges
+            followed by the build of the final vertex's edges
+        Everything except final is
+            a leaf's edge opposite final
+            or the graph of child 0 (opposite final) then everything except final for children 1 and 2
+        The final build is
+            this triangle's final edges then the final builds of children 1 and 2
+
+        Pending tasks are kept on an explicit stack (pushed in reverse so they run in the order above)
+        '''
+        stack = [(task,t)]
+        while len(stack) > 0:
+            task,u = stack.pop()
+            children = self.children[u]
+            if task == BUILD_GRAPH:
+                self.checkFinal(u)
+                stack.append( (BUILD_FINAL       ,u) )
+                stack.append( (BUILD_EXCEPT_FINAL,u) )
+            elif task == BUILD_EXCEPT_FINAL:
+                if children[0] < 0:
+#                    print 'no children'
+                    p,q = self.verts[u,2] , self.verts[u,1]
+                    try_ordered_edge(self.a,p,q,True)
+                    continue
+                # Child 0 is guaranteed to be the one opposite final
+                stack.append( (BUILD_EXCEPT_FINAL,children[2]) )
+                stack.append( (BUILD_EXCEPT_FINAL,children[1]) )
+                stack.append( (BUILD_GRAPH       ,children[0]) )
+            else:
+                self.addFinalEdges(u)
+                if children[0] >= 0:
+                    stack.append( (BUILD_FINAL,children[2]) )
+                    stack.append( (BUILD_FINAL,children[1]) )
+
+    def forcedOut(self):
+        '''
+        Returns {portal: the number of outgoing links building this tree is sure to add}
+        These are the non-reversible final edges (see addFinalEdges) not already in self.a,
+        leaving out pairs the build might also link reversibly or the other way around
+        '''
+        v = self.verts[:self.size]
+        exterior = self.exterior[:self.size]
+        leaf = self.children[:self.size,0] < 0
+
+        fixed = np.vstack([ v[~exterior][:,[0,1]] , v[~exterior][:,[0,2]] ]).tolist()
+        free  = np.vstack([ v[exterior][:,[1,0]] , v[exterior][:,[2,0]] , v[leaf][:,[2,1]] ]).tolist()
+
+        freePairs = set( (min(p,q),max(p,q)) for p,q in free )
+        origins = {}
+        for p,q in fixed:
+            pair = (min(p,q),max(p,q))
+            if pair not in freePairs:
+                origins.setdefault(pair,set()).add(p)
+
+        counts = {}
+        for (p,q),ps in origins.items():
+            if len(ps) == 1 and not (self.a.has_edge(p,q) or self.a.has_edge(q,p)):
+                origin = ps.pop()
+                counts[origin] = counts.get(origin,0)+1
+        return counts
+
+    def descendants(self,t=0):
+        # Iterates over the indices of t and all its descendants (depth-first, children in order)
+        stack = [t]
+        while len(stack) > 0:
+            u = stack.pop()
+            yield u
+            if self.children[u,0] >= 0:
+                stack.extend(self.children[u,::-1])
+
+    def markOwnField(self,t):
+        a = self.a
+        verts = self.verts[t].tolist()
         edges = [(0,0)]*3
         for i in range(3):
-            p = self.verts[i-1]
-            q = self.verts[i-2]
-            if not self.a.has_edge(p,q):
+            p = verts[i-1]
+            q = verts[i-2]
+            if not a.has_edge(p,q):
                 p,q = q,p
             # The graph should have been completed by now, so the edge p,q exists
             edges[i] = (p,q)
-            if not self.a.has_edge(p,q):
+            if not a.has_edge(p,q):
                 print ('a does NOT have edge',p,q)
                 print ('there is a programming error')
                 print ('a only has the edges:')
-                for p,q in self.a.edges_iter():
+                for p,q in a.edges_iter():
                     print (p,q)
-                print ('a has %s 1st gen triangles:'%len(self.a.triangulation))
-                for t in self.a.triangulation:
-                    print (t.verts)
+                print ('a has %s 1st gen triangles:'%len(a.triangulation))
+                for tri in a.triangulation:
+                    print (tri.verts)
 
-        edgeOrders = [self.a.edge[p][q]['order'] for p,q in edges]
+        edgeOrders = [a.edge[p][q]['order'] for p,q in edges]
 
         lastInd = np.argmax(edgeOrders)
         # The edge that completes this triangle
         p,q = edges[lastInd]
 
-        self.a.edge[p][q]['fields'].append(self.verts)
+        a.edge[p][q]['fields'].append(verts)
 
-        for child in self.children:
-            child.markEdgesWithFields()
+    # Attach to each edge a list of fields that it completes
+    def markEdgesWithFields(self,t=0):
+        for u in self.descendants(t):
+            self.markOwnField(u)
 
-    def edgesByDepth(self,depth):
-        # Return list of edges of triangles at given depth
-        # 0 means edges of this very triangle
-        # 1 means edges splitting this triangle
-        # 2 means edges splitting this triangle's children 
-        # etc.
+    def edgesByDepth(self,t,depth):
+        '''
+        Returns a k x 2 array of edges of triangles at given depth below t
+        0 means edges of t itself
+        1 means edges splitting t
+        2 means edges splitting t's children
+        etc.
+        '''
         if depth == 0:
-            return [ (self.verts[i],self.verts[i-1]) for i in range(3) ]
-        if depth == 1:
-            if self.center == None:
-                return []
-            return [ (self.verts[i],self.center) for i in range(3) ]
-        return [e for child in self.children\
-                  for e in child.edgesByDepth(depth-1)]
+            return self.verts[t,[[0,2],[1,0],[2,1]]]
+
+        # The triangles whose splitting edges are at the given depth
+        generation = np.array([t])
+        for d in range(depth-1):
+            generation = self.children[generation].reshape(-1)
+            generation = generation[generation >= 0]
+        generation = generation[self.center[generation] >= 0]
+
+        return np.column_stack([ self.verts[generation].reshape(-1) ,\
+                                 np.repeat(self.center[generation],3) ])
+
+def treeFromArrays(a,verts,children,parent,center,depth,exterior,rng=np.random):
+    '''
+    Rebuilds a TriTree of graph a from arrays laid out like its own (root at index 0)
+    Returns the root Triangle
+    '''
+    tree = TriTree.__new__(TriTree)
+    tree.a = a
+    tree.rng = rng
+    tree.size = len(parent)
+
+    tree.verts    = np.array(verts,dtype=int).reshape([-1,3])
+    tree.children = np.array(children,dtype=int).reshape([-1,3])
+    tree.parent   = np.array(parent,dtype=int)
+    tree.center   = np.array(center,dtype=int)
+    tree.depth    = np.array(depth,dtype=int)
+    tree.exterior = np.array(exterior,dtype=bool)
+    tree.contents = [ [] for t in range(tree.size) ]
+    tree.xyz = None
+
+    return tree.triangle(0)
+
+# Split policies
+# A split policy is a function choose(t) returning the content portal of Triangle view t to split t on
+# They are called while a tree is being split, so t.tree.xyz holds the coordinates of every portal
+# Random choices are made with the tree's own generator t.tree.rng
+
+def chooseRandom(t):
+    # Any content portal, uniformly
+    return t.contents[t.tree.rng.randint(len(t.contents))]
+
+def chooseNear(t):
+    # The content portal closest to the final vertex
+    xyz = t.tree.xyz
+    return t.contents[np.argmax(np.dot(xyz[t.contents],xyz[t.verts[0]]))]
+
+def chooseBalanced(t):
+    '''
+    The content portal that leaves the fewest portals in the fullest child (ties broken at random)
+    '''
+    contents = t.contents
+    xyz = t.tree.xyz
+    v   = xyz[t.verts]
+    pts = xyz[contents]
+
+    # normals[i,c] is orthogonal to the plane through vertex i and candidate c
+    normals = np.cross(v[:,np.newaxis,:],pts[np.newaxis,:,:])
+    # side[i,c,q] is the side of that plane portal q is on, vside[i,c,j] that of vertex j
+    side  = np.sign(np.einsum('ick,qk->icq',normals,pts))
+    vside = np.sign(np.einsum('ick,jk->icj',normals,v))
+
+    # The child on vertices i,c,j holds the portals on j's side of plane i,c and on i's side of plane j,c
+    fullest = np.zeros(len(contents),dtype=int)
+    for i,j in ((1,2),(2,0),(0,1)):
+        inside = (side[i] == vside[i,:,j,np.newaxis]) & (side[j] == vside[j,:,i,np.newaxis])
+        fullest = np.maximum(fullest,inside.sum(1))
+
+    best = np.flatnonzero(fullest == fullest.min())
+    return contents[best[t.tree.rng.randint(len(best))]]
+
+def chooseSpareKeys(t):
+    '''
+    A random content portal, with probability proportional to 1 + its keys
+    Portals split on early get the most incoming links, so they should be the ones with keys to spare
+    '''
+    weights = np.array([t.a.node[p]['keys'] for p in t.contents],dtype=float)+1
+    return t.contents[t.tree.rng.choice(len(weights),p=weights/weights.sum())]
+
+def mixChoices(policies,weights):
+    '''
+    Returns a split policy that uses policies[i] for a split with probability proportional to weights[i]
+    '''
+    weights = np.array(weights,dtype=float)
+    weights /= weights.sum()
+    def choose(t):
+        return policies[t.tree.rng.choice(len(policies),p=weights)](t)
+    return choose
+
+SPLIT_POLICIES = {
+    'random'   : chooseRandom,
+    'near'     : chooseNear,
+    'balanced' : chooseBalanced,
+    'keys'     : chooseSpareKeys,
+}
+
+def splitPolicy(spec):
+    '''
+    Returns the split policy named by spec, one of SPLIT_POLICIES
+    or a weighted mix of them like 'balanced:2,random:1'
+    Raises ValueError for a bad spec
+    '''
+    policies = []
+    weights  = []
+    for part in spec.split(','):
+        name,_,weight = part.strip().partition(':')
+        if name not in SPLIT_POLICIES:
+            raise ValueError('Unknown split policy %s (choose from %s)'%\
+                             (name,', '.join(sorted(SPLIT_POLICIES))))
+        weight = float(weight) if weight else 1.
+        if weight < 0:
+            raise ValueError('Split policy weights should be positive')
+        policies.append(SPLIT_POLICIES[name])
+        weights.append(weight)
+
+    if len(policies) == 1:
+        return policies[0]
+    if sum(weights) <= 0:
+        raise ValueError('Split policy weights should not all be 0')
+    return mixChoices(policies,weights)
 
+class Triangle:
+    '''
+    A lightweight view of one triangle of a TriTree
 
+    Triangle(verts,a,exterior,rng) starts a new TriTree with verts as its root
+        verts should be a 3-list of Portals
+        verts[0] should be the final one used in linking
+        exterior should be set to true if this triangle has no triangle parent
+            the orientation of the outer edges of exterior Triangles do not matter
+        rng makes the tree's random choices (np.random or a np.random.RandomState)
+    '''
+    __slots__ = ('tree','index')
+
+    def __init__(self,verts,a,exterior=False,rng=np.random):
+        self.tree  = TriTree(verts,a,exterior,rng)
+        self.index = 0
+
+    @property
+    def a(self):
+        return self.tree.a
+
+    @property
+    def verts(self):
+        return self.tree.verts[self.index].tolist()
+
+    @property
+    def exterior(self):
+        return bool(self.tree.exterior[self.index])
+
+    @property
+    def pts(self):
+        return self.tree.pts(self.index)
+
+    @property
+    def children(self):
+        return [self.tree.triangle(c) for c in self.tree.children[self.index] if c >= 0]
+
+    @property
+    def contents(self):
+        # Only meaningful before this triangle is split
+        return self.tree.contents[self.index]
+
+    @property
+    def center(self):
+        p = self.tree.center[self.index]
+        if p < 0:
+            return None
+        return int(p)
 
+    def findContents(self,candidates=None):
+        self.tree.findContents(self.index,candidates)
 
+    def setFinal(self,p):
+        # Makes vertex p the final one (only before this triangle is split)
+        v = self.tree.verts[self.index]
+        k = v.tolist().index(p)
+        v[[0,k]] = v[[k,0]]
+
+    def splitAll(self,choose):
+        self.tree.splitAll(self.index,choose)
+
+    def randSplit(self):
+        self.splitAll(chooseRandom)
+
+    def nearSplit(self):
+        # Split on the node closest to final
+        self.splitAll(chooseNear)
+
+    def splitOn(self,p):
+        self.tree.splitOn(self.index,p)
+
+    def tostr(self):
+        # Just a string representation of the triangle
+        return str([self.a.node[p]['name'] for p in self.verts])
+
+    def buildFinal(self):
+        self.tree.build(self.index,BUILD_FINAL)
+
+    def buildExceptFinal(self):
+        self.tree.build(self.index,BUILD_EXCEPT_FINAL)
+
+    def buildGraph(self):
+#        print 'building',self.tostr()
+        self.tree.build(self.index,BUILD_GRAPH)
+
+    def descendants(self):
+        # Iterates over this triangle and all its descendants (depth-first, children in order)
+        for t in self.tree.descendants(self.index):
+            yield self.tree.triangle(t)
+
+    def contains(self,pt):
+        return np.all(np.sum(self.orths*(pt-self.pts),1) < 0)
+
+    # Attach to each edge a list of fields that it completes
+    def markEdgesWithFields(self):
+        self.tree.markEdgesWithFields(self.index)
+
+    def edgesByDepth(self,depth):
+        # Return list of edges of triangles at given depth
+        # 0 means edges of this very triangle
+        # 1 means edges splitting this triangle
+        # 2 means edges splitting this triangle's children
+        # etc.
+        return [ tuple(e) for e in self.tree.edgesByDepth(self.index,depth).tolist() ]
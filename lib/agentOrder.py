@@ -149,10 +149,88 @@ def expandOrder(s,mult):
 
     return order
 
-def getAgentOrder(a,nagents,orderedEdges):
+def planTimes(link2agent,times,walkspeed=WALKSPEED,commtime=COMMTIME,linktime=LINKTIME):
+    '''
+    link2agent[i] is the agent who makes link i
+    times are the walking distances returned by orderedTSP.getVisits (or greedyVisits)
+    walkspeed (m/s), commtime and linktime (s) default to WALKSPEED, COMMTIME and LINKTIME
+
+    returns (walktime,commtime,linktime) in seconds
+    '''
+    # If agents communicate sequential completions all at once, we avoid waiting for multiple messages
+    # To find out how many communications will be sent, we count the number of same-agent link sequences
+    condensed , mult = condenseOrder(link2agent)
+    numCOMMs = len(condensed)
+
+    # Time that must be spent just walking
+    walking = times[-1]/walkspeed
+    # Waiting for link completion messages to be sent
+    communicating = numCOMMs*commtime
+    # Time spent navigating linking menu
+    linking = len(link2agent)*linktime
+
+    return walking,communicating,linking
+
+def greedyVisits(d,order,nagents):
+    '''
+    A fast stand-in for orderedTSP.getVisits
+    Each visit goes to the agent who could make it soonest, with no look-ahead
+        (like the branch-and-bound keeping a single branch per level)
+
+    returns visits,time as getVisits does
+    '''
+    m = len(order)
+    visits = [0]*m
+    time = np.zeros(m)
+
+    # Where each agent made its last visit (-1 if not yet deployed) and when
+    lastpos  = np.full(nagents,-1,dtype=int)
+    lasttime = np.zeros(nagents)
+    lastpos[0] = order[0]
+
+    for i in range(1,m):
+        nextpos = order[i]
+        # Deployment is instantaneous, otherwise an agent must walk from its last visit
+        walks = np.where(lastpos >= 0,d[nextpos,lastpos],-np.inf)
+        newtimes = np.maximum(time[i-1],lasttime+walks)
+
+        agent = np.argmin(newtimes)
+        visits[i] = agent
+        time[i] = newtimes[agent]
+        lastpos[agent]  = nextpos
+        lasttime[agent] = time[i]
+
+    return visits,time
+
+def estimateTime(a,nagents,d=None,walkspeed=WALKSPEED,commtime=COMMTIME,linktime=LINKTIME):
+    '''
+    Quickly estimates the seconds plan a takes with nagents agents
+        (walking + communication + linking, as getAgentOrder would report)
+    greedyVisits is used in place of the branch-and-bound
+    d is the distance matrix between portals (computed if not given)
+    walkspeed, commtime and linktime are as in planTimes
+
+    a is not changed
+    '''
+    if d is None:
+        geo = np.array([ a.node[i]['geo'] for i in range(a.order())])
+        d = geometry.sphereDist(geo,geo)
+
+    order = [None]*a.size()
+    for p,q,data in a.edges_iter(data=True):
+        order[data['order']] = p
+
+    condensed , mult = condenseOrder(order)
+    link2agent , times = greedyVisits(d,condensed,nagents)
+    link2agent = expandOrder(link2agent,mult)
+
+    return sum(planTimes(link2agent,times,walkspeed,commtime,linktime))
+
+def getAgentOrder(a,nagents,orderedEdges,maxBranches=orderedTSP.MAX_BRANCHES,progress=None,cancel=None):
     '''
     returns visits
     visits[i] = j means agent j should make edge i
+    maxBranches, progress and cancel are passed on to orderedTSP.getVisits
     
     ALSO creates time attributes in a:
         
@@ -171,22 +249,12 @@ def getAgentOrder(a,nagents,orderedEdges):
     # Reduce sequences of links made from same portal to single entry
     condensed , mult = condenseOrder(order)
 
-    link2agent , times = orderedTSP.getVisits(d,condensed,nagents)
+    link2agent , times = orderedTSP.getVisits(d,condensed,nagents,maxBranches,progress,cancel)
 
     # Expand links made from same portal to original count
     link2agent = expandOrder(link2agent,mult)
 
-    # If agents communicate sequential completions all at once, we avoid waiting for multiple messages
-    # To find out how many communications will be sent, we count the number of same-agent link sequences
-    condensed , mult = condenseOrder(link2agent)
-    numCOMMs = len(condensed)
-
-    # Time that must be spent just walking
-    a.walktime = times[-1]/WALKSPEED
-    # Waiting for link completion messages to be sent
-    a.commtime = numCOMMs*COMMTIME
-    # Time spent navigating linking menu
-    a.linktime = a.size()*LINKTIME
+    a.walktime,a.commtime,a.linktime = planTimes(link2agent,times)
 
     movements = [None]*nagents
 
@@ -12,7 +12,10 @@ class InfState:
     def split(self,num):
         raise CantSplit()
 
-def branch_bound(root,lo,hi):
+def printLevel(level,levels=None):
+    print (level)
+
+def branch_bound(root,lo,hi,progress=None,cancel=None,levels=None):
     '''
     Uses a branch-and-bound style approach to minimize a function
 
@@ -26,6 +29,11 @@ def branch_bound(root,lo,hi):
         each member of root.children should also be a state class
         members of root.values correspond to members of root.children
 
+    progress(level,levels) is called as each level is finished
+        levels is the number of levels expected (None if not known)
+        by default the level is printed
+    cancel (a cancel.CancelToken) is checked before each level
+
     returns s,v (the state and lowest found value)
     '''
     # number of branches to make from each branch
@@ -34,11 +42,15 @@ def branch_bound(root,lo,hi):
 
     states = np.array([root])
 
-    print ('Planning agent movements:')
+    if progress is None:
+        print ('Planning agent movements:')
+        progress = printLevel
 
     # This is only for the printout
     counter = 0
     while True:
+        if cancel is not None:
+            cancel.check()
         # The branches of the states
         try:
             for state in states:
@@ -54,7 +66,7 @@ def branch_bound(root,lo,hi):
         bestlo = np.argsort(branchvalues)[:lo]
         states = branches[bestlo]
 
-        print (counter)
+        progress(counter,levels)
         counter += 1
 
     return states[0],states[0].value
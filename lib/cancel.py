@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - cancel.py
+
+Stopping a long solve or agent ordering from outside
+
+The searches call token.check() as they go (see maxfield.triangulate,
+solver.Solver.solve and branch_bound.branch_bound), which raises Cancelled
+once someone has called token.cancel(). The token wraps anything with
+set() and is_set(): a threading.Event by default, or a multiprocessing
+(or Manager) Event to cancel work running in another process.
+"""
+import time
+import threading
+
+class Cancelled(Exception):
+    pass
+
+class CancelToken:
+    '''
+    event       has set() and is_set(), shared with whoever may cancel
+    interval    seconds between looks at event (a Manager Event costs a round trip
+                to the manager for every look, and check() is called very often)
+    '''
+    def __init__(self,event=None,interval=0.1):
+        if event is None:
+            event = threading.Event()
+        self.event = event
+        self.interval = interval
+        self.nextLook = 0.
+        self.seen = False
+
+    def cancel(self):
+        self.event.set()
+        self.seen = True
+
+    def cancelled(self):
+        if not self.seen:
+            now = time.time()
+            if now >= self.nextLook:
+                self.nextLook = now+self.interval
+                self.seen = self.event.is_set()
+        return self.seen
+
+    def check(self):
+        # Raises Cancelled if the token was cancelled
+        if self.cancelled():
+            raise Cancelled()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - checkpoint.py
+
+The state of a Solver's search, saved now and then so that a killed search
+can carry on where it was (see solver.Solver)
+
+A checkpoint is a plan file (see planFile) of the best plan so far, with
+these arrays added
+    ckpt_problem        identifies the portals, keys and settings searched (see problemKey)
+    ckpt_counts         samples made, samples that failed, samples since the last improvement
+    ckpt_TK, ckpt_MK, ckpt_weights
+                        the key scores of every sampled plan
+    ckpt_rng_keys, ckpt_rng_state
+                        the state of the Solver's np.random.RandomState
+                        (the key array, and position, has_gauss, cached_gaussian)
+It is written under a temporary name and renamed into place, so a checkpoint
+is never seen half written.
+"""
+import os
+import numpy as np
+
+from . import geometry,planFile,planStore
+
+def problemKey(a,keys,mkweight,timeweight,nagents,split,tries):
+    '''
+    Returns a string identifying the search: the portal coordinates, keys and
+    the settings that decide which plan is best (like the plan store's fingerprint)
+    and those that decide which plans are sampled (split names the split policy)
+    '''
+    geo = np.array([ a.node[i]['geo'] for i in range(a.order()) ]).reshape([-1,2])
+    return planStore.fingerprint(geo/geometry.radPERe6degree,keys,\
+        {'mk_weight':mkweight,'time_weight':timeweight,\
+         'num_agents':nagents if timeweight > 0 else None,\
+         'split':split,'tries':tries})
+
+class Checkpoint:
+    '''
+    A saved search
+        problem         see problemKey
+        plan            the best plan found (finished)
+        samples,failures,sinceImprove   as counted by Solver.solve
+        allTK,allMK,allWeights          the key scores of every sampled plan
+        rngState        for np.random.RandomState.set_state
+    '''
+    def __init__(self,problem,plan,samples,failures,sinceImprove,allTK,allMK,allWeights,rngState):
+        self.problem      = problem
+        self.plan         = plan
+        self.samples      = samples
+        self.failures     = failures
+        self.sinceImprove = sinceImprove
+        self.allTK        = allTK
+        self.allMK        = allMK
+        self.allWeights   = allWeights
+        self.rngState     = rngState
+
+def save(filename,ckpt):
+    name,rngkeys,pos,hasGauss,cachedGaussian = ckpt.rngState
+    extra = {
+        'ckpt_problem'   : np.array(ckpt.problem),
+        'ckpt_counts'    : np.array([ckpt.samples,ckpt.failures,ckpt.sinceImprove],dtype=int),
+        'ckpt_TK'        : np.array(ckpt.allTK,dtype=int),
+        'ckpt_MK'        : np.array(ckpt.allMK,dtype=int),
+        'ckpt_weights'   : np.array(ckpt.allWeights,dtype=float),
+        'ckpt_rng_keys'  : np.asarray(rngkeys,dtype=np.uint32),
+        'ckpt_rng_state' : np.array([pos,hasGauss,cachedGaussian],dtype=float),
+    }
+    # np.savez would add .npz to a name without it
+    tmpname = filename+'.tmp.npz'
+    planFile.save(ckpt.plan,tmpname,extra)
+    os.replace(tmpname,filename)
+
+def load(filename):
+    '''
+    Returns the Checkpoint in filename
+    Raises ValueError if it is not a checkpoint
+    '''
+    plan = planFile.load(filename)
+    with np.load(filename,allow_pickle=False) as arrays:
+        if 'ckpt_problem' not in arrays.files:
+            raise ValueError('%s is a plan, not a checkpoint'%filename)
+        samples,failures,sinceImprove = arrays['ckpt_counts'].tolist()
+        pos,hasGauss,cachedGaussian = arrays['ckpt_rng_state'].tolist()
+        rngState = ('MT19937',arrays['ckpt_rng_keys'],int(pos),int(hasGauss),cachedGaussian)
+        return Checkpoint(str(arrays['ckpt_problem']),plan,samples,failures,sinceImprove,\
+                          arrays['ckpt_TK'].tolist(),arrays['ckpt_MK'].tolist(),\
+                          arrays['ckpt_weights'].tolist(),rngState)
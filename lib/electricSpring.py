@@ -1,81 +1,107 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - electricSpring.py
+
+Placing labels (e.g. link numbers) near their anchors without covering
+each other or the portals
+
+Each label is held to its anchor by a spring and pushed away from every
+portal and label closer than radius. Only close pairs push, and they are
+found by bucketing the points into a grid of radius-sized cells, so each
+step costs about as much as the number of points (plus close pairs) rather
+than labels times points.
+"""
 from . import geometry
 np = geometry.np
 
-def edgeLabelPos(fixed,anchors):
-    '''
-    This is for choosing label positions
-    Each portal and label is modeled as a particle with repelling charge
-    The connection between label and object is modeled as a sping
-
-    fixed:      positions of repelling objects that do not move (portals)
-                a numpy array of portal positions: n x 2
-
-    anchors:    positions to which labels should be attracted
-
-    k:          the spring constant (proportional to the repelling force)
+# Strength of the spring holding a label to its anchor. A label pushed on by
+# one neighbour settles within radius/(2*SPRING) of its anchor
+SPRING = 0.1
+ITERATIONS = 30
 
-    returns labels: a numpy array of label positions
+def closePairs(pts,query,radius):
+    '''
+    pts is an N x 2 array, query an array of indices into pts
+    Returns i,j: every pair with i in query, j != i and pts[i],pts[j] closer than radius
+    '''
+    cells = np.floor(pts/radius).astype(np.int64)
+    cells -= cells.min(0)-1
+    height = cells[:,1].max()+2
+    keys = cells[:,0]*height + cells[:,1]
+
+    order = np.argsort(keys,kind='mergesort')
+    sortedKeys = keys[order]
+
+    I = []
+    J = []
+    for dx in (-1,0,1):
+        for dy in (-1,0,1):
+            near = keys[query] + dx*height + dy
+            lo = np.searchsorted(sortedKeys,near,'left')
+            hi = np.searchsorted(sortedKeys,near,'right')
+            counts = hi-lo
+            total = counts.sum()
+            if total == 0:
+                continue
+            # Every member of each query point's neighbouring cell
+            first = np.repeat(lo,counts)
+            within = np.arange(total) - np.repeat(np.cumsum(counts)-counts,counts)
+            I.append(np.repeat(query,counts))
+            J.append(order[first+within])
+
+    if len(I) == 0:
+        return np.empty(0,dtype=int),np.empty(0,dtype=int)
+    I = np.concatenate(I)
+    J = np.concatenate(J)
+    d2 = ((pts[I]-pts[J])**2).sum(1)
+    close = (I != J) & (d2 < radius**2)
+    return I[close],J[close]
+
+def edgeLabelPos(fixed,anchors,radius=None,iterations=ITERATIONS,seed=0):
+    '''
+    fixed:      n x 2 array of the positions of things labels should not cover (portals)
+    anchors:    m x 2 array of the positions labels are tied to (e.g. link midpoints)
+    radius:     how far apart labels and portals should be
+                Default: 3% of the larger side of the bounding box of fixed and anchors
+    seed:       seeds the small random offsets that separate labels with the same anchor
+
+    Returns an m x 2 array of label positions
+    The same arguments always give the same positions
     '''
+    fixed = np.asarray(fixed,dtype=float).reshape([-1,2])
+    anchors = np.asarray(anchors,dtype=float).reshape([-1,2])
     n = fixed.shape[0]
     m = anchors.shape[0]
+    if m == 0:
+        return anchors.copy()
 
-    scale = np.max([ fixed[:,0].max()-fixed[:,0].min() ,\
-                     fixed[:,1].max()-fixed[:,1].min() ])
+    if radius is None:
+        extent = np.vstack([fixed,anchors])
+        radius = 0.03*(extent.max(0)-extent.min(0)).max()
+    if radius <= 0:
+        return anchors.copy()
 
-    # Normalize
-    fixed = fixed.copy()/scale
+    rng = np.random.RandomState(seed)
+    pts = np.vstack([fixed,anchors + rng.uniform(-0.01,0.01,[m,2])*radius])
+    labels = np.arange(n,n+m)
 
-    # If portals are uniformly distributed, I think this is sensible
-    k = 10
-    print ('k =',k)
+    for it in range(iterations):
+        I,J = closePairs(pts,labels,radius)
 
-    # labels start near anchors
-    labels = anchors/scale + np.random.randn(m,2)*n
+        # Each close pair pushes the label away, harder the closer they are
+        away = pts[I]-pts[J]
+        dist = np.sqrt((away**2).sum(1))
+        dist[dist == 0] = radius
+        push = away*((radius-dist)/dist)[:,np.newaxis]
 
-    # labels are repeleld from all portals and labels
-    charges = np.vstack([fixed,labels])
+        forces = SPRING*(anchors - pts[n:])
+        np.add.at(forces,I-n,push/2.)
 
-    MAXIT = 10
+        # Smaller steps as the labels settle
+        pts[n:] += forces*(1.-it/float(iterations))
 
-    count = 1
-    delta = np.inf
-    while delta > 0.001 and count<MAXIT:
-        oldlabels = labels.copy()
-
-        dx = np.column_stack([labels[:,0]]*(n+m)) - np.tile(charges[:,0],[m,1])
-        dy = np.column_stack([labels[:,1]]*(n+m)) - np.tile(charges[:,1],[m,1])
-        
-        print()
-        print (np.min(np.abs(dx)),np.max(np.abs(dx)))
-        print (np.min(np.abs(dy)),np.max(np.abs(dy)))
-
-        # force is proportional to 1/dist^2 (normalization cancels one out)
-        # distance cubed (combines force normalization with 1/d^2 factor)
-        dists3 = (dx**2+dy**2)**1.5
-        dists3[range(m),range(n,n+m)]=1 # avoid 0/0
-
-        print (np.min(np.abs(dists3)),np.max(np.abs(dists3)))
-        
-        elecForces = np.column_stack([ np.sum(dx/dists3,1) ,\
-                                       np.sum(dy/dists3,1) ])
-        springForces = k*(anchors - labels)
-        print (np.max(np.abs(elecForces)),np.max(np.abs(springForces)))
-        forces = elecForces + springForces
-        forces /= count*n
-
-        labels += forces
-
-        charges[n:,:] = labels
-        delta = np.max(np.abs(forces))
-        count += 1
-
-    print ('ending delta =',delta)
-    if count >= MAXIT:
-        print ('WARNING: label placement loop exiting after max iterations')
-        
-    return labels*scale
+    return pts[n:]
 
 if __name__=='__main__':
     import matplotlib
@@ -84,8 +110,8 @@ if __name__=='__main__':
 
     portals = np.array([[0.,0],[0,1],[1,0]])
     anchors = np.array([[0,.5],[.5,.5],[.5,0]])
-    
-    labelpos = edgeLabelPos(portals,anchors)
+
+    labelpos = edgeLabelPos(portals,anchors,0.2)
 
     n = portals.shape[0]
 
@@ -94,5 +120,4 @@ if __name__=='__main__':
         plt.plot([ portals[i-n,0],labelpos[i-n,0],portals[i-n+1,0] ]  ,\
                  [ portals[i-n,1],labelpos[i-n,1],portals[i-n+1,1] ],'r-')
 
-    plt.show()
-        
+    plt.savefig('electricSpring.png')
@@ -10,7 +10,8 @@ Original version by jpeterbaker
 """
 from . import geometry
 np = geometry.np
-from .Triangle import Triangle,Deadend
+import networkx as nx
+from .Triangle import Triangle,Deadend,chooseRandom
 
 '''
 Some things are chosen randomly:
@@ -20,74 +21,154 @@ This is the number of times to randomly rebuild each first generation triangle w
 '''
 TRIES_PER_TRI = 10
 
-def canFlip(degrees,keylacks,p,q):
+def degrees(a):
     '''
-    True iff reversing edge p,q is a paraeto improvement
-        out-degree of q must be <8
-        p must have a key surplus
+    Returns arrays (indeg,outdeg) with the in- and out-degree of every portal of a
     '''
-    return (degrees[q,1] < 8) & (keylacks[p]<0)
+    n = a.order()
+    edges = np.array(a.edges(),dtype=int).reshape([-1,2])
+    return np.bincount(edges[:,1],minlength=n),np.bincount(edges[:,0],minlength=n)
+
+def portalKeys(a):
+    # The number of keys available for every portal of a
+    return np.array([a.node[i]['keys'] for i in range(a.order())],dtype=int)
+
+def keyScore(indeg,keys,mkweight=2):
+    '''
+    Scores a plan by the keys it lacks (lower is better)
+        indeg[i] is the number of links into portal i (keys needed)
+        keys[i] is the number of keys available for portal i
+    TK is the total number of missing keys
+    MK is the maximum number of missing keys for any single portal
 
-def flip(a,p,q,degrees=None,keylacks=None):
+    Returns (TK + mkweight*MK, TK, MK)
+    Any function score(indeg,keys,mkweight) returning such a triple (weighted,TK,MK) can be
+    passed as score to orientEdges, maxFields and solver.Solver to score plans instead
+    '''
+    keylacks = np.maximum(indeg-keys,0)
+    TK = int(keylacks.sum())
+    MK = int(keylacks.max()) if len(keylacks) > 0 else 0
+    return TK+mkweight*MK,TK,MK
+
+def flip(a,p,q):
     if not a.edge[p][q]['reversible']:
         print ('!!!! Trying to reverse a non-reversible edge !!!!')
         print (p,q)
     # Give the reversed edge the same properties
     a.add_edge(q,p,a.edge[p][q])
     a.remove_edge(p,q)
-    if degrees is not None:
-        degrees[p,0] += 1
-        degrees[p,1] -= 1
-        degrees[q,0] -= 1
-        degrees[q,1] += 1
 
-    if keylacks is not None:
-        keylacks[p] += 1
-        keylacks[q] -= 1
+def orientationFlow(fixedIn,lo,keys,M,revEdges):
+    '''
+    Builds the flow network for orienting revEdges with at most M missing keys at any portal
+        each reversible edge k sends one unit to the portal it will point into
+        portal v must take at least lo[v] units (so that its out-degree stays <= 8)
+        units that v takes beyond its spare keys cost 1
+        v may take no more than keys[v]+M-fixedIn[v] units
 
-def flipSome(a):
+    Returns the flow network, or None if no orientation can meet M
     '''
-    Tries to make each in and out degree of a <=8 by reversing edges
-    Only edges with the property reversible=True will be flipped
+    n = len(keys)
+    hi = keys+M-fixedIn
+    if np.any(hi < lo):
+        return None
+
+    free = np.clip(keys-fixedIn,lo,hi)-lo
+    paid = hi-lo-free
+
+    f = nx.DiGraph()
+    f.add_node('sink',demand=len(revEdges)-int(lo.sum()))
+    for v in range(n):
+        f.add_node(('portal',v),demand=int(lo[v]))
+        if free[v] > 0:
+            f.add_edge(('portal',v),'sink',capacity=int(free[v]),weight=0)
+        if paid[v] > 0:
+            f.add_edge(('portal',v),('paid',v),capacity=int(paid[v]),weight=1)
+            f.add_edge(('paid',v),'sink',capacity=int(paid[v]),weight=0)
+    for k in range(len(revEdges)):
+        p,q = revEdges[k]
+        f.add_node(('edge',k),demand=-1)
+        f.add_edge(('edge',k),('portal',p),capacity=1,weight=0)
+        f.add_edge(('edge',k),('portal',q),capacity=1,weight=0)
+
+    return f
+
+def orientEdges(a,keys=None,mkweight=2,score=keyScore):
+    '''
+    Chooses the direction of every reversible edge of a to minimize TK + mkweight*MK (see keyScore)
+    while no portal gets more than 8 outgoing links
+    keys defaults to portalKeys(a)
+    score(indeg,keys,mkweight) -> (weighted,TK,MK) rates the orientations (see keyScore)
+
+    For a fixed bound M on MK, the smallest TK is a min-cost flow problem (see orientationFlow)
+    M is scanned upward from the smallest value that could possibly be met
+    The orientation a already has is feasible, so its MK is the largest M that needs checking
+    With another score, the orientation it weighs least among those is kept
+    Edges are only flipped if that beats the orientation a already has
     '''
     n = a.order()
-    degrees  = np.empty([n,2],dtype=int)
-    keylacks = np.empty(n,dtype=int) # negative if there's a surplus
-
-    # column 0 is in-degree, col 1 is out-degree
-    for i in range(n):
-        degrees[i,0] = a.in_degree(i)
-        degrees[i,1] = a.out_degree(i)
-        keylacks[i] = degrees[i,0]-a.node[i]['keys']
-
-    # We can never make more than 8 outogoing links. Reducing these is first priority
-    manyout = (degrees[:,1]>8).nonzero()[0]
-    for p in manyout:
-        print ("Found a portal with more than 8 outgoing links: %s"%p)
-        qs = list(a.edge[p].iterkeys())
-        for q in qs:
-            if a.edge[p][q]['reversible'] and canFlip(degrees,keylacks,p,q):
-                flip(a,p,q,degrees,keylacks)
-            if degrees[p,1] <= 8:
-                break
+    if keys is None:
+        keys = portalKeys(a)
+
+    fixedIn  = np.zeros(n,dtype=int)
+    fixedOut = np.zeros(n,dtype=int)
+    revEdges = []
+    for p,q,data in a.edges_iter(data=True):
+        if data['reversible']:
+            revEdges.append((p,q))
         else:
-            # This runs if the for loop exits without the break
-            print ('Could not reduce OUT-degree sufficiently for %s'%p)
-
-    # It is difficult to gather more keys. Reducing key-gathering is next priority
-    # We'll process the ones with the greatest need first
-    needkeys = (keylacks>0).nonzero()[0]
-    needkeys = needkeys[np.argsort(keylacks[needkeys])][::-1]
-    for q in needkeys:
-        for p,q2 in a.in_edges(q):
-            if a.edge[p][q]['reversible'] and canFlip(degrees,keylacks,p,q):
-                flip(a,p,q,degrees,keylacks)
-            if keylacks[q] <= 0:
-                break
-#        else:
-            # This runs if the for loop exits without the break
-#            print 'Could not reduce IN-degree sufficiently for %s'%q
+            fixedOut[p] += 1
+            fixedIn [q] += 1
+
+    if len(revEdges) == 0:
+        return
 
+    revDeg = np.zeros(n,dtype=int)
+    for p,q in revEdges:
+        revDeg[p] += 1
+        revDeg[q] += 1
+
+    # Each portal must be the destination of enough reversible edges to keep its out-degree <= 8
+    lo = np.maximum(fixedOut+revDeg-8,0)
+
+    indeg,outdeg = degrees(a)
+    bestweight,curTK,curMK = score(indeg,keys,mkweight)
+    # Every orientation lacks at least the keys that lo alone lacks
+    baseTK = int(np.maximum(fixedIn+lo-keys,0).sum())
+
+    bestflow = None
+    # A score may give MK as a float
+    for M in range(max(np.max(fixedIn+lo-keys),0),int(np.ceil(curMK))+1):
+        # Every plan with MK >= M weighs at least baseTK + mkweight*M (by keyScore)
+        if score is keyScore and baseTK+mkweight*M >= bestweight:
+            break
+
+        f = orientationFlow(fixedIn,lo,keys,M,revEdges)
+        if f is None:
+            continue
+        try:
+            flow = nx.min_cost_flow(f)
+        except nx.NetworkXUnfeasible:
+            continue
+
+        intoRev = np.zeros(n,dtype=int)
+        for k in range(len(revEdges)):
+            for p in revEdges[k]:
+                intoRev[p] += flow[('edge',k)][('portal',p)]
+        weight,TK,MK = score(fixedIn+intoRev,keys,mkweight)
+
+        if weight < bestweight:
+            bestweight = weight
+            bestflow   = flow
+
+    if bestflow is None:
+        return
+
+    for k in range(len(revEdges)):
+        p,q = revEdges[k]
+        if bestflow[('edge',k)][('portal',p)] > 0:
+            # This edge should point into p
+            flip(a,p,q)
 
 def removeSince(a,m,t):
     # Remove all but the first m edges from a (and .edge_stck)
@@ -101,78 +182,190 @@ def removeSince(a,m,t):
         a.triangulation.pop()
 
 
-def triangulate(a,perim):
+class SearchFrame:
+    '''
+    One level of the triangulation search
+        perim is the perimeter polygon being triangulated
+        stackLen,triLen record a.edgeStack and a.triangulation on entry (for rolling back)
+        candidates iterates over the perimeter indices still to be tried as the third vertex
+        t0 is the first generation Triangle currently in place (None if none is)
+        sides is the number of side polygons of t0 that have been triangulated
+    '''
+    def __init__(self,a,perim,rng=np.random):
+        self.perim = perim
+        self.stackLen = len(a.edgeStack)
+        self.triLen = len(a.triangulation)
+        self.candidates = iter(rng.permutation(range(2,len(perim))))
+        self.i = None
+        self.t0 = None
+        self.sides = 0
+
+    def sidePerim(self):
+        # The perimeter polygon to triangulate next, or None if both sides are done
+        pn = len(self.perim)
+        if self.sides == 0:
+            return self.perim[range(1,self.i   +1   )] # 1 through i
+        if self.sides == 1:
+            return self.perim[range(0,self.i-pn-1,-1)] # i through 0
+        return None
+
+def hasSide(a,p,q):
+    return a.has_edge(p,q) or a.has_edge(q,p)
+
+def firstGenFinals(a,verts,nContents):
+    '''
+    Cheap checks for a first generation Triangle on verts with nContents portals inside,
+    made before it is split or anything is added to a
+    Returns the vertices that could be its final vertex (none if building it is hopeless)
+
+    Lower bounds on the outgoing links each vertex will have are compared with the budget of 8
+        a missing side whose other end already has 8 outgoing links has to go out of this end
+        the final vertex links out (not reversibly) to the portal the Triangle is split on
+    and a final vertex must not have both of its sides already (see TriTree.checkFinal)
+    '''
+    outdeg = [a.out_degree(v) for v in verts]
+    need = list(outdeg)
+    for i in range(3):
+        for j in range(3):
+            if i != j and outdeg[j] >= 8 and not hasSide(a,verts[i],verts[j]):
+                need[i] += 1
+    if max(need) > 8:
+        return []
+
+    finals = []
+    for i in range(3):
+        if hasSide(a,verts[i],verts[i-1]) and hasSide(a,verts[i],verts[i-2]):
+            continue
+        if nContents > 0 and need[i] >= 8:
+            continue
+        finals.append(verts[i])
+    return finals
+
+def buildFirstGen(a,perim,i,startStackLen,startTriLen,choose=chooseRandom,rng=np.random,tries=TRIES_PER_TRI):
     '''
-    Recursively tries every triangulation in search a feasible one
-        Each layer
+    Randomly builds the Triangle perim[[0,1,i]] up to tries times
+    choose is the split policy (see Triangle.SPLIT_POLICIES)
+    rng makes the random choices (np.random or a np.random.RandomState)
+    Returns the Triangle if one of the builds succeeded, otherwise None
+    Hopeless Triangles (see firstGenFinals) are given up on before they are split,
+    and hopeless splits (see TriTree.forcedOut) before they are built
+    A pruned split has drawn the same random numbers as the failed build it replaces,
+    but a Triangle given up on skips the draws its builds would have made
+    '''
+    contents = None
+    for j in range(tries):
+        t0 = Triangle(perim[[0,1,i]],a,True,rng)
+        # The contents are the same every try, so only the first searches every portal
+        t0.findContents(contents)
+        if contents is None:
+            contents = t0.contents
+            finals = firstGenFinals(a,t0.verts,len(contents))
+            if len(finals) == 0:
+                return None
+        if t0.verts[0] not in finals:
+            # TriTree.add only drew which vertex is final, so one of the allowed ones is drawn instead
+            t0.setFinal(finals[rng.randint(len(finals))])
+
+        t0.splitAll(choose)
+        # Splits that are sure to give a portal more than 8 outgoing links are not built
+        if any(a.out_degree(p)+k > 8 for p,k in t0.tree.forcedOut().items()):
+            continue
+        try:
+            t0.buildGraph()
+        except Deadend as d:
+            # remove the links formed since beginning of loop
+            removeSince(a,startStackLen,startTriLen)
+        else:
+            return t0
+    return None
+
+def triangulate(a,perim,choose=chooseRandom,rng=np.random,tries=TRIES_PER_TRI,cancel=None):
+    '''
+    Tries every triangulation in search a feasible one
+        Each level
             makes a Triangle out of three perimeter portals
             for every feasible way of max-fielding that Triangle
                 try triangulating the two perimeter-polygons to the sides of the Triangle
 
+    The levels are kept on an explicit stack of SearchFrames, so long perimeters do not hit the recursion limit
+    choose, rng and tries are passed on to buildFirstGen
+    cancel (a cancel.CancelToken) is checked at every step, and raises cancel.Cancelled
+    leaving a partly built
+
     Returns True if a feasible triangulation has been made in graph a
     '''
-    pn = len(perim)
-    if pn < 3:
+    if len(perim) < 3:
         return True
 
-    try:
-        startStackLen = len(a.edgeStack)
-    except AttributeError:
-        startStackLen = 0
+    if not hasattr(a,'edgeStack'):
         a.edgeStack = []
-    try:
-        startTriLen = len(a.triangulation)
-    except AttributeError:
-        startTriLen = 0
+    if not hasattr(a,'triangulation'):
         a.triangulation = []
 
-    # Try all triangles using perim[0:2] and another perim node
-    for i in np.random.permutation(range(2,pn)):
-
-        for j in range(TRIES_PER_TRI):
-            t0 = Triangle(perim[[0,1,i]],a,True)
-            t0.findContents()
-            t0.randSplit()
-            try:
-                t0.buildGraph()
-            except Deadend as d:
-                # remove the links formed since beginning of loop
-                removeSince(a,startStackLen,startTriLen)
-            else:
-                # This build was successful. Break from the loop
-                break
-        else:
-            # The loop ended "normally" so this triangle failed
-            continue
+    stack = [SearchFrame(a,perim,rng)]
+    # Outcome of the side polygon that was just finished (None if there is no news)
+    done = None
 
-        if not triangulate(a,perim[range(1,i   +1   )]): # 1 through i
-            # remove the links formed since beginning of loop
-            removeSince(a,startStackLen,startTriLen)
-            continue
+    while len(stack) > 0:
+        if cancel is not None:
+            cancel.check()
+        frame = stack[-1]
 
-        if not triangulate(a,perim[range(0,i-pn-1,-1)]): # i through 0
-           # remove the links formed since beginning of loop
-           removeSince(a,startStackLen,startTriLen)
-           continue
+        if done is not None:
+            if done:
+                frame.sides += 1
+            else:
+                # remove the links formed since beginning of this level
+                removeSince(a,frame.stackLen,frame.triLen)
+                frame.t0 = None
+            done = None
 
-        # This will be a list of the first generation triangles
-        a.triangulation.append(t0)
+        if frame.t0 is None:
+            # Try all triangles using perim[0:2] and another perim node
+            for i in frame.candidates:
+                frame.t0 = buildFirstGen(a,frame.perim,i,frame.stackLen,frame.triLen,choose,rng,tries)
+                if frame.t0 is not None:
+                    frame.i = i
+                    frame.sides = 0
+                    break
+            else:
+                # Every candidate failed, so this level could not find a solution
+                stack.pop()
+                done = False
+                continue
 
-        # This triangle and the ones to its sides succeeded
-        return True
+        side = frame.sidePerim()
+        if side is None:
+            # This triangle and the ones to its sides succeeded
+            # This will be a list of the first generation triangles
+            a.triangulation.append(frame.t0)
+            stack.pop()
+            done = True
+        elif len(side) < 3:
+            done = True
+        else:
+            stack.append(SearchFrame(a,side,rng))
 
-    # Could not find a solution
-    return False
+    return done
     
-def maxFields(a):
+def maxFields(a,keys=None,mkweight=2,choose=chooseRandom,rng=np.random,tries=TRIES_PER_TRI,cancel=None,\
+              score=keyScore):
+    '''
+    Finds a feasible max-field plan in a, oriented to minimize TK + mkweight*MK (see keyScore)
+    or whatever score(indeg,keys,mkweight) -> (weighted,TK,MK) weighs instead
+    Triangles are split on the portals picked by the split policy choose (see Triangle.SPLIT_POLICIES)
+    rng makes the random choices and tries limits the builds of each first generation triangle
+    cancel is passed on to triangulate
+    Returns False if no plan was found
+    '''
     n = a.order()
 
     pts = np.array([ a.node[i]['xy'] for i in range(n) ])
 
     perim = np.array(geometry.getPerim(pts))
-    if not triangulate(a,perim):
+    if not triangulate(a,perim,choose,rng,tries,cancel):
         return False
-    flipSome(a)
+    orientEdges(a,keys,mkweight,score)
 
     return True
 
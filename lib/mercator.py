@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - mercator.py
+
+Web Mercator projection, as used by map tiles (and the Google static maps API)
+
+At zoom level z the world is a square of TILE*2**z pixels, x growing east from
+longitude -180 and y growing south from latitude 85.05. Everything here works
+on whole arrays of points.
+"""
+import numpy as np
+
+# Pixels across the world at zoom 0
+TILE = 256.
+# Zoom levels the static maps API serves
+MAX_ZOOM = 19
+
+def project(geo):
+    '''
+    geo is an n x 2 array of latitude,longitude (radians)
+    Returns the n x 2 array of x,y world coordinates in pixels at zoom 0
+    '''
+    geo = np.asarray(geo,dtype=float).reshape([-1,2])
+    x = TILE/(2*np.pi) * (geo[:,1] + np.pi)
+    y = TILE/(2*np.pi) * (np.pi - np.log(np.tan(np.pi/4. + geo[:,0]/2.)))
+    return np.column_stack([x,y])
+
+def unproject(xy):
+    '''
+    Inverse of project: returns the latitude,longitude (radians) of zoom 0 world coordinates
+    '''
+    xy = np.asarray(xy,dtype=float).reshape([-1,2])
+    lng = xy[:,0]*(2*np.pi)/TILE - np.pi
+    lat = 2.*np.arctan(np.exp(np.pi - xy[:,1]*(2*np.pi)/TILE)) - np.pi/2.
+    return np.column_stack([lat,lng])
+
+def fitZoom(extent,size=TILE):
+    '''
+    Returns the largest zoom level (0 through MAX_ZOOM) at which extent
+    (pixels at zoom 0) is less than size pixels
+    0 if it does not fit even at zoom 0
+    '''
+    if extent <= 0:
+        return MAX_ZOOM
+    zoom = int(np.floor(np.log2(size/extent)))
+    # log2 may round across a whole number, and a perfect fit is not less than size
+    if extent*2.**(zoom+1) < size:
+        zoom += 1
+    elif extent*2.**zoom >= size:
+        zoom -= 1
+    return int(np.clip(zoom,0,MAX_ZOOM))
+
+def mapView(geo,margin=10.):
+    '''
+    Fits the points geo (n x 2 latitude,longitude in radians) on a static map
+
+    Returns (xy,zoom,center,size)
+        xy      n x 2 pixel coordinates of the points on the map,
+                from the westmost and northmost point, before the margin is added
+        zoom    the map's zoom level
+        center  the latitude,longitude (degrees) of the map's center
+        size    the map's width,height in pixels (the points with margin on every side,
+                not rounded: the static maps API wants them as whole numbers)
+    The axis limits to draw on the map are [-margin,width-margin,height-margin,-margin]
+    '''
+    world = project(geo)
+    lo = world.min(0)
+    extent = world.max(0) - lo
+
+    # The points span less than half the map at zoom, so a map at zoom+1 has them
+    # within TILE pixels
+    zoom = fitZoom(extent.max())+1
+    xy = (world-lo)*2.**zoom
+
+    size = xy.max(0) + 2*margin
+    center = unproject(lo + (size/2.-margin)/2.**zoom)[0]
+    return xy,zoom,np.rad2deg(center),size
@@ -140,20 +140,23 @@ class OTSPstate:
         return self.value
 
 
-def getVisits(dists,order,nagents):
+def getVisits(dists,order,nagents,maxBranches=MAX_BRANCHES,progress=None,cancel=None):
     '''
     dists:   a distance matrix
     order:   the order in which nodes must be visited
              duplicates allowed
     nagents: the number of agents available to make the visits
+    maxBranches: the number of branches kept at each level of the branch-and-bound
+    progress,cancel: passed on to branch_bound.branch_bound
+             (there is a level for each visit after the first)
              
     returns visits,time
               visits[i] = j means the ith visit should be performed by agent j
               time[i] is the number of meters a person could have walked walk since the start when visit i is made 
     '''
     root = OTSPstate(dists,order,nagents)
-    LO = MAX_BRANCHES // nagents
-    state,value = branch_bound.branch_bound(root, LO , LO*nagents)
+    LO = maxBranches // nagents
+    state,value = branch_bound.branch_bound(root, LO , LO*nagents, progress, cancel, len(order)-1)
 
     return state.visit2agent,state.time
 
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - planFile.py
+
+Saving and loading finished plans
+
+A plan is stored as an uncompressed numpy .npz archive of plain arrays
+(no pickled objects), so it loads quickly, lazily and independently of
+the networkx version that made it.
+
+Arrays in a version 1 plan file
+    format, version     identify the file
+    names, keys         portal names and the number of keys available
+    geo, xyz, xy        portal coordinates (radians, unit sphere, gnomonic)
+    edges               m x 2, edges[i] = (p,q) is the ith link to be made
+    reversible          whether edges[i] could have been made the other way
+    field_edges         for each field, the index of the link that completes it
+    field_verts         for each field, its three portals
+    tri_roots           index of each first generation triangle in the tri_ arrays
+    tri_verts, tri_children, tri_parent, tri_center, tri_depth, tri_exterior
+                        the triangulation trees (see Triangle.TriTree), concatenated
+                        child and parent indices count from the tree's root
+"""
+import numpy as np
+import networkx as nx
+
+from .Triangle import treeFromArrays
+
+FORMAT  = 'maxfield-plan'
+VERSION = 1
+
+def toArrays(a):
+    '''
+    Returns the dict of arrays (see above) that save writes for the plan in graph a
+    a should be finished: edges have their 'order' and 'fields' and a.triangulation is set
+    '''
+    n = a.order()
+    m = a.size()
+
+    edges      = np.empty([m,2],dtype=int)
+    reversible = np.empty(m,dtype=bool)
+    field_edges = []
+    field_verts = []
+    for p,q,data in a.edges_iter(data=True):
+        i = data['order']
+        edges[i] = p,q
+        reversible[i] = data['reversible']
+        for tri in data['fields']:
+            field_edges.append(i)
+            field_verts.append(tri)
+
+    # Fields are listed in link order (keeping each link's own order of fields)
+    fieldorder = np.argsort(field_edges,kind='mergesort')
+    field_edges = np.array(field_edges,dtype=int)[fieldorder]
+    field_verts = np.array(field_verts,dtype=int).reshape([-1,3])[fieldorder]
+
+    trees = [t.tree for t in getattr(a,'triangulation',[])]
+    sizes = np.array([tree.size for tree in trees],dtype=int)
+    tri_roots = np.cumsum(sizes)-sizes
+
+    def stack(name,shape):
+        if len(trees) == 0:
+            return np.empty(shape,dtype=int)
+        return np.concatenate([getattr(tree,name)[:tree.size] for tree in trees])
+
+    arrays = {
+        'format'       : np.array(FORMAT),
+        'version'      : np.array(VERSION),
+        'names'        : np.array([a.node[i]['name'] for i in range(n)],dtype=str),
+        'keys'         : np.array([a.node[i]['keys'] for i in range(n)],dtype=int),
+        'geo'          : np.array([a.node[i]['geo' ] for i in range(n)],dtype=float),
+        'xyz'          : np.array([a.node[i]['xyz' ] for i in range(n)],dtype=float),
+        'xy'           : np.array([a.node[i]['xy'  ] for i in range(n)],dtype=float),
+        'edges'        : edges,
+        'reversible'   : reversible,
+        'field_edges'  : field_edges,
+        'field_verts'  : field_verts,
+        'tri_roots'    : tri_roots,
+        'tri_verts'    : stack('verts',[0,3]),
+        'tri_children' : stack('children',[0,3]),
+        'tri_parent'   : stack('parent',[0]),
+        'tri_center'   : stack('center',[0]),
+        'tri_depth'    : stack('depth',[0]),
+        'tri_exterior' : stack('exterior',[0]).astype(bool),
+    }
+    return arrays
+
+def save(a,filename,extra=None):
+    '''
+    Writes the plan in graph a to filename (see toArrays)
+    extra is a dict of more arrays to store alongside (load ignores them)
+    '''
+    arrays = toArrays(a)
+    if extra is not None:
+        for name in extra:
+            if name in arrays:
+                raise ValueError('%s is already part of a plan file'%name)
+        arrays.update(extra)
+
+    with open(filename,'wb') as fout:
+        np.savez(fout,**arrays)
+
+def load(filename):
+    '''
+    Reads a plan written by save
+    Returns a graph like the one that was saved, with a.triangulation restored
+    Raises ValueError if filename is not a plan file this version can read
+    '''
+    with np.load(filename,allow_pickle=False) as plan:
+        if 'format' not in plan.files or str(plan['format']) != FORMAT:
+            raise ValueError('%s is not a maxfield plan file'%filename)
+        version = int(plan['version'])
+        if version > VERSION:
+            raise ValueError('%s is a version %s plan file, but only version %s and earlier can be read'%\
+                             (filename,version,VERSION))
+
+        names = plan['names']
+        keys  = plan['keys']
+        geo   = plan['geo']
+        xyz   = plan['xyz']
+        xy    = plan['xy']
+
+        a = nx.DiGraph()
+        for i in range(len(names)):
+            a.add_node(i,name=str(names[i]),keys=int(keys[i]),\
+                       geo=geo[i],xyz=xyz[i],xy=xy[i])
+
+        edges = plan['edges'].tolist()
+        reversible = plan['reversible'].tolist()
+        for i in range(len(edges)):
+            p,q = edges[i]
+            a.add_edge(p,q,{'order':i,'reversible':reversible[i],'fields':[]})
+
+        for i,tri in zip(plan['field_edges'].tolist(),plan['field_verts'].tolist()):
+            p,q = edges[i]
+            a.edge[p][q]['fields'].append(tri)
+
+        roots = plan['tri_roots'].tolist()
+        arrays = [ plan['tri_'+name] for name in\
+                   ('verts','children','parent','center','depth','exterior') ]
+        ends = roots[1:] + [len(arrays[-1])]
+
+        a.triangulation = []
+        for start,end in zip(roots,ends):
+            # Indices within a tree already count from its root
+            a.triangulation.append(treeFromArrays(a,*[ x[start:end] for x in arrays ]))
+
+    return a
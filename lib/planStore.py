@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - planStore.py
+
+A directory of the best plans found so far, so that unchanged portal lists
+do not have to be solved again
+
+Each plan is kept under a fingerprint of everything that decides which plan
+is best: the portal coordinates (in order), their key counts and the solver
+settings. For a fingerprint FP the store holds
+    FP.npz      the plan (see planFile), with what is known about it (its
+                score, TK, MK, ...) as JSON in the extra array INFO_ARRAY
+One file, renamed into place at once, so a plan and its info always match
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+from . import planFile
+
+# The name of the array holding a stored plan's info
+INFO_ARRAY = 'store_info'
+
+def fingerprint(locs,keys,params):
+    '''
+    locs:   n x 2 array of portal latitude,longitude in microdegrees
+    keys:   number of keys available for each portal
+    params: dict of the solver settings that change which plan is best
+
+    Returns a hex string identifying the problem
+    '''
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(np.round(locs),dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(keys,dtype=np.int64).tobytes())
+    h.update(json.dumps(params,sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+def path(directory,fp):
+    return os.path.join(directory,fp)+'.npz'
+
+def load(directory,fp):
+    '''
+    Returns (a,info) for the stored plan with fingerprint fp
+    or None if there is none (or it cannot be read)
+    '''
+    planpath = path(directory,fp)
+    if not os.path.exists(planpath):
+        return None
+    try:
+        with np.load(planpath,allow_pickle=False) as plan:
+            if INFO_ARRAY not in plan.files:
+                raise ValueError('it has no info')
+            info = json.loads(str(plan[INFO_ARRAY]))
+        a = planFile.load(planpath)
+    except (IOError,ValueError) as err:
+        print ('Ignoring unreadable stored plan %s: %s'%(fp,err))
+        return None
+    return a,info
+
+def save(directory,fp,a,info):
+    '''
+    Stores plan a (and the dict info) under fingerprint fp, replacing what was there
+    The file is written under a temporary name and renamed into place,
+    so readers never see a half written plan
+    '''
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    planpath = path(directory,fp)
+
+    planFile.save(a,planpath+'.tmp',{INFO_ARRAY:np.array(json.dumps(info,sort_keys=True))})
+    os.replace(planpath+'.tmp',planpath)
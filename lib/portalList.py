@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - portalList.py
+
+Reading portal lists
+
+A portal list is a semi-colon delimited file with one portal per line
+    name;intel_link;keys
+keys is optional and lines starting with # are ignored
+"""
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+from . import geometry
+
+try:
+    basestring = basestring
+except NameError:
+    # Python 3
+    basestring = (str,bytes)
+
+def read(filename):
+    '''
+    Returns a list of (name,lat,lng,keys) for the portals in filename
+        lat,lng are in microdegrees (from the pll= part of the intel link)
+        keys is 0 if it is missing or not a number
+    Lines without both a name and a link are skipped
+    Raises ValueError if a portal has a formatting problem
+    '''
+    table = pd.read_table(filename,sep=';',
+                          comment='#',index_col=False,
+                          names=['name','link','keys'],dtype=str)
+    portals = []
+    for name,link,keys in np.array(table):
+        if not (isinstance(name, basestring) and isinstance(link, basestring)):
+            continue
+        coords = link.split('pll=')
+        if len(coords) < 2:
+            raise ValueError("Portal {0} has a formatting problem.".format(name))
+        coord_parts = coords[1].split(',')
+        try:
+            lat = int(float(coord_parts[0]) * 1.e6)
+            lon = int(float(coord_parts[1]) * 1.e6)
+        except (IndexError,ValueError):
+            raise ValueError("Portal {0} has a formatting problem.".format(name))
+        try:
+            keys = int(keys)
+        except (TypeError,ValueError):
+            keys = 0
+        portals.append((name,lat,lon,keys))
+    return portals
+
+def portalGraph(portals):
+    '''
+    portals is a list like read returns
+    Returns (a,e6locs)
+        a is a graph with a node for each portal, having its 'name', 'keys'
+            and coordinates 'geo' (radians), 'xyz' (unit sphere) and 'xy' (gnomonic projection)
+        e6locs is the n x 2 array of latitude,longitude in microdegrees
+    '''
+    a = nx.DiGraph() # network tool
+    for num,(name,lat,lon,keys) in enumerate(portals):
+        a.add_node(num)
+        a.node[num]['name'] = name
+        a.node[num]['keys'] = keys
+
+    e6locs = np.array([ [lat,lon] for name,lat,lon,keys in portals ],dtype=float).reshape([-1,2])
+
+    # Convert coords to radians, then to cartesian, then to
+    # gnomonic projection
+    locs = geometry.e6LLtoRads(e6locs)
+    xyz  = geometry.radstoxyz(locs)
+    xy   = geometry.gnomonicProj(locs,xyz)
+
+    for i in range(a.order()):
+        a.node[i]['geo'] = locs[i]
+        a.node[i]['xyz'] = xyz[i]
+        a.node[i]['xy' ] = xy[i]
+
+    return a,e6locs
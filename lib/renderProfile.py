@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - renderProfile.py
+
+How large and how detailed the images PlanPrinter draws are
+
+A profile has
+    dpi         resolution of the PNGs (None: matplotlib's default)
+    size        width,height of the figures in inches (None: matplotlib's default)
+    scaled      whether markers, lines and fonts are sized for how close the
+                portals are on the figure (see sizeScale) rather than fixed
+    labels      whether linkMap.png numbers the links
+    dashes      whether the frames show every link of the plan dotted
+"""
+import numpy as np
+
+PROFILES = {
+    # As maps have always been drawn
+    'default' : {'dpi':None,'size':None,'scaled':False,'labels':True,'dashes':True},
+    # Small and quick, e.g. for a chat bot
+    'preview' : {'dpi':50,'size':None,'scaled':True,'labels':False,'dashes':False},
+    # Letter paper, for briefings
+    'print'   : {'dpi':200,'size':(8.5,11),'scaled':True,'labels':True,'dashes':True},
+}
+
+# Neighbouring portals this far apart (points) get the default sizes
+NEIGHBOUR_POINTS = 24.
+# Which nearest neighbour distance counts (a percentile): crowded corners matter more than the median
+CROWDED_PERCENTILE = 25
+# Bounds on the scaling of the sizes
+MIN_SCALE = 0.3
+MAX_SCALE = 1.25
+# The fraction of the figure matplotlib's default axes take up (width,height)
+AXES_FRACTION = (0.775,0.77)
+# Used when a profile does not give a size
+DEFAULT_SIZE = (6.4,4.8)
+
+def get(name):
+    '''
+    Returns the profile called name
+    Raises ValueError if there is none
+    '''
+    if name not in PROFILES:
+        raise ValueError("Unknown render profile {0} (choose from {1})".format(name,','.join(sorted(PROFILES))))
+    return PROFILES[name]
+
+def sizeScale(xy,size=None):
+    '''
+    xy are the portals' coordinates as drawn (stretched to fill the axes)
+    Returns how much to scale markers, lines and fonts on a figure of size inches
+    so that neighbouring portals do not crowd each other: 1 if the distance from a
+    portal to its nearest neighbour is NEIGHBOUR_POINTS (at CROWDED_PERCENTILE of
+    the portals), in proportion otherwise
+    '''
+    xy = np.asarray(xy,dtype=float).reshape([-1,2])
+    if len(xy) < 2:
+        return MAX_SCALE
+    if size is None:
+        size = DEFAULT_SIZE
+
+    extent = xy.max(0)-xy.min(0)
+    extent[extent == 0] = 1.
+    pts = (xy-xy.min(0))/extent * np.array(size)*AXES_FRACTION*72.
+
+    d2 = ((pts[:,np.newaxis,:]-pts[np.newaxis,:,:])**2).sum(2)
+    np.fill_diagonal(d2,np.inf)
+    nearest = np.sqrt(d2.min(1))
+    return float(np.clip(np.percentile(nearest,CROWDED_PERCENTILE)/NEIGHBOUR_POINTS,MIN_SCALE,MAX_SCALE))
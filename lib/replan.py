@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - replan.py
+
+Re-solving a finished plan after a few portals were added, removed or moved
+
+Every first generation triangle of a plan has perimeter portals as its
+vertices. So as long as the perimeter is unchanged, the first generation
+triangles still cover the new portals and only their contents can change.
+Triangles whose contents are unchanged keep their whole TriTree; the others
+are split again at random. If an affected triangle cannot be built, its
+neighbours (first generation triangles sharing a side with it) are freed too.
+"""
+import copy
+
+from . import geometry
+np = geometry.np
+from . import maxfield
+from .Triangle import Triangle,Deadend,treeFromArrays,chooseRandom
+
+def matchPortals(base,a):
+    '''
+    Returns newIndex where newIndex[i] is the portal of a at the location of portal i of base
+    (-1 if there is none, i.e. portal i was removed or moved)
+    '''
+    def microdegrees(g):
+        geo = np.array([g.node[i]['geo'] for i in range(g.order())]).reshape([-1,2])
+        return [tuple(p) for p in np.round(geo/geometry.radPERe6degree).astype(np.int64)]
+
+    newAt = {}
+    for j,loc in enumerate(microdegrees(a)):
+        newAt.setdefault(loc,[]).append(j)
+
+    newIndex = np.full(base.order(),-1,dtype=int)
+    for i,loc in enumerate(microdegrees(base)):
+        if len(newAt.get(loc,[])) > 0:
+            newIndex[i] = newAt[loc].pop(0)
+    return newIndex
+
+def buildOrder(base):
+    '''
+    Returns the first generation Triangles of base in the order they were built
+
+    Building a first generation tree ends with an edge completing its own triangle,
+    and that edge keeps its order relative to other field-completing edges (see agentOrder.improveEdgeOrder)
+    '''
+    def lastSide(t):
+        v = t.verts
+        orders = []
+        for i in range(3):
+            p,q = v[i-1],v[i]
+            if not base.has_edge(p,q):
+                p,q = q,p
+            orders.append(base.edge[p][q]['order'])
+        return max(orders)
+
+    return sorted(base.triangulation,key=lastSide)
+
+class Replan:
+    '''
+    What can be kept of a finished plan for a new portal list (see prepare)
+        roots[k]    the vertices of the kth first generation triangle (in build order)
+        trees[k]    its TriTree arrays with portals renumbered for the new list
+        affected[k] True if its contents changed, so it must be split again
+        neighbours[k] the first generation triangles sharing a side with it
+    '''
+    def __init__(self,roots,trees,affected):
+        self.roots = roots
+        self.trees = trees
+        self.affected = np.array(affected,dtype=bool)
+
+        sides = [ set([frozenset(root[i-1:i+1] if i else [root[2],root[0]]) for i in range(3)])\
+                  for root in roots ]
+        self.neighbours = [ [l for l in range(len(roots)) if l != k and sides[k] & sides[l]]\
+                            for k in range(len(roots)) ]
+
+def prepare(base,a):
+    '''
+    base is a finished plan, a is a graph of the new portals (with 'geo', 'xyz' and 'xy', but no edges)
+    Returns a Replan, or None if the perimeter changed (then a full solve is needed)
+    '''
+    newIndex = matchPortals(base,a)
+    gen1 = buildOrder(base)
+
+    # The perimeter portals are exactly the first generation vertices
+    oldPerim = set()
+    for t in gen1:
+        oldPerim.update(newIndex[t.verts].tolist())
+    xy = np.array([ a.node[i]['xy'] for i in range(a.order()) ])
+    if -1 in oldPerim or oldPerim != set(geometry.getPerim(xy)):
+        return None
+
+    roots    = []
+    trees    = []
+    affected = []
+    for t in gen1:
+        tree = t.tree
+        size = tree.size
+
+        verts  = newIndex[tree.verts[:size]]
+        center = np.where(tree.center[:size] >= 0,newIndex[tree.center[:size]],-1)
+        oldContents = center[tree.center[:size] >= 0]
+
+        probe = Triangle(verts[0],a)
+        probe.findContents()
+        changed = -1 in oldContents or set(oldContents.tolist()) != set(probe.contents)
+
+        roots.append(verts[0].tolist())
+        trees.append( (verts,tree.children[:size],tree.parent[:size],center,\
+                       tree.depth[:size],tree.exterior[:size]) )
+        affected.append(changed)
+
+    return Replan(roots,trees,affected)
+
+def perturb(plan,rng=np.random):
+    '''
+    Returns a copy of plan (from prepare) with one more first generation triangle, picked by rng,
+    to be split again. With a plan of the same portals this samples plans near it
+    '''
+    near = copy.copy(plan)
+    near.affected = plan.affected.copy()
+    near.affected[rng.randint(len(near.affected))] = True
+    return near
+
+def buildFirstGens(a,plan,affected,choose=chooseRandom,rng=np.random,tries=maxfield.TRIES_PER_TRI):
+    '''
+    Builds every first generation triangle of plan in a (which should have no edges)
+        kept triangles reuse their trees
+        affected triangles are split again by choose up to tries times
+    Returns None on success, or the index of the first triangle that could not be built
+    '''
+    a.edgeStack = []
+    a.triangulation = []
+    for k in range(len(plan.roots)):
+        if not affected[k]:
+            t = treeFromArrays(a,*plan.trees[k])
+            try:
+                t.buildGraph()
+            except Deadend:
+                return k
+        else:
+            t = maxfield.buildFirstGen(a,np.array(plan.roots[k]),2,len(a.edgeStack),len(a.triangulation),\
+                                       choose,rng,tries)
+            if t is None:
+                return k
+        a.triangulation.append(t)
+
+    return None
+
+def refield(a,plan,keys=None,mkweight=2,choose=chooseRandom,rng=np.random,tries=maxfield.TRIES_PER_TRI,cancel=None,\
+            score=maxfield.keyScore):
+    '''
+    Like maxfield.maxFields, but keeps what plan (from prepare) says can be kept
+    cancel (a cancel.CancelToken) is checked before each attempt
+    Returns False, leaving a with no edges or triangulation, if no plan was found even with every triangle freed
+    '''
+    affected = plan.affected.copy()
+    while True:
+        if cancel is not None:
+            cancel.check()
+        failed = buildFirstGens(a,plan,affected,choose,rng,tries)
+        if failed is None:
+            maxfield.orientEdges(a,keys,mkweight,score)
+            return True
+
+        a.remove_edges_from(a.edges())
+        if not affected[failed]:
+            # Its neighbours changed, so it has to be split again too
+            affected[failed] = True
+            continue
+
+        # Free the neighbours of everything affected
+        widened = affected.copy()
+        for k in np.nonzero(affected)[0]:
+            widened[plan.neighbours[k]] = True
+        if np.all(widened == affected):
+            a.edgeStack = []
+            a.triangulation = []
+            return False
+        affected = widened
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - solver.py
+
+Sampling max-field plans and keeping the best one, for use as a library
+
+A Solver keeps its settings, its random number generator and its progress
+reporting to itself and only works on copies of the portal graph it is given,
+so any number of them can solve plans at once (in threads or processes).
+Nothing is printed: progress goes to the Solver's callback and to the
+'lib.solver' logger. A solve can be stopped from another thread or process
+with a cancel.CancelToken, and then returns the best plan found so far.
+With a checkpoint file, the search is saved every checkpointSeconds (and when
+it is cancelled) and a later solve can resume it (see checkpoint.py).
+
+    solver = Solver(mkweight=2,samples=50,seed=1)
+    result = solver.solve(a)
+    result.plan     # the best plan found
+"""
+import time
+import logging
+import numpy as np
+
+from . import geometry,maxfield,agentOrder,replan,checkpoint
+from .Triangle import chooseRandom,splitPolicy,SPLIT_POLICIES
+from .cancel import Cancelled
+
+log = logging.getLogger(__name__)
+
+# Seconds between checkpoints of a search
+CHECKPOINT_SECONDS = 60
+
+def finishPlan(a):
+    '''
+    Attaches to each edge a list of fields that it completes
+    and moves links that complete nothing as early as possible
+    '''
+    for t in a.triangulation:
+        t.markEdgesWithFields()
+
+    agentOrder.improveEdgeOrder(a)
+
+def splitName(choose):
+    # A name for split policy choose in checkpoint.problemKey
+    for name,policy in SPLIT_POLICIES.items():
+        if policy is choose:
+            return name
+    return choose.__name__
+
+def updateFront(front,candidate):
+    '''
+    front is a list of non-dominated (keyweight,minutes,...) tuples
+    Adds candidate unless a member of front is at least as good in both
+    Members that candidate is at least as good as in both are removed
+    Returns True if candidate was added
+    '''
+    for f in front:
+        if f[0] <= candidate[0] and f[1] <= candidate[1]:
+            return False
+    front[:] = [f for f in front if not (candidate[0] <= f[0] and candidate[1] <= f[1])]
+    front.append(candidate)
+    return True
+
+class Sample:
+    '''
+    One scored plan
+        plan            the graph
+        score           weighted + timeweight*minutes
+        weighted,TK,MK  its key score (see Solver's score)
+        minutes         its estimated length (None without a time weight)
+        sinceImprove    samples made since the best plan last improved
+    '''
+    def __init__(self,plan,weighted,TK,MK,minutes,score):
+        self.plan     = plan
+        self.weighted = weighted
+        self.TK       = TK
+        self.MK       = MK
+        self.minutes  = minutes
+        self.score    = score
+        self.sinceImprove = 0
+
+class Result:
+    '''
+    What Solver.solve found
+        best        the best Sample (None if no plan was found)
+        plan        best.plan, finished (see finishPlan)
+        improved    False if nothing beat the plan the solve started from
+        cancelled   True if the solve was cancelled before it was done
+        front       with a time weight, the (weighted,minutes,TK,MK,plan) tuples not beaten
+                    on both key score and minutes (see updateFront), otherwise empty
+        allTK,allMK,allWeights  the key scores of every sampled plan
+        samples,failures        the number of plans sampled, and of samples that found none
+    '''
+    def __init__(self):
+        self.best     = None
+        self.plan     = None
+        self.improved = False
+        self.cancelled = False
+        self.front    = []
+        self.allTK      = []
+        self.allMK      = []
+        self.allWeights = []
+        self.samples  = 0
+        self.failures = 0
+
+class Solver:
+    '''
+    Settings for sampling plans
+        mkweight,timeweight   a plan's score is TK + mkweight*MK + timeweight*minutes
+        nagents               the number of agents the minutes are estimated for
+        samples               how many samples to make after the last improvement
+        choose                the split policy (see Triangle.SPLIT_POLICIES), or a spec for Triangle.splitPolicy
+                              (a checkpoint only knows a function that is not one of SPLIT_POLICIES by its name)
+        tries                 builds of each first generation triangle (see maxfield.buildFirstGen)
+        score                 score(indeg,keys,mkweight) -> (weighted,TK,MK) rates the keys a plan
+                              lacks (see maxfield.keyScore); it is also used to orient the links
+        seed                  seeds the Solver's own np.random.RandomState (None for a random seed)
+        walkspeed,commtime,linktime   for the time estimate (see agentOrder.planTimes)
+        progress              progress(event,sample,result) is called with event
+                                  'start'        sample is the plan the solve started from
+                                  'resume'       sample is the best plan of the checkpoint resumed
+                                  'improvement'  sample beat the best so far
+                                  'sample'       sample did not
+                                  'failure'      a sample found no plan (sample is None)
+                                  'perfect'      sample lacks no keys, so sampling stops
+                                  'cancelled'    cancel was cancelled (sample is None)
+                              and result, the Result so far (result.samples made, result.best)
+        cancel                a cancel.CancelToken checked between and during samples
+        checkpoint            a file to save the search in every checkpointSeconds
+                              (None for no checkpoints)
+    '''
+    def __init__(self,mkweight=2,timeweight=0,nagents=1,samples=50,choose=chooseRandom,\
+                 tries=maxfield.TRIES_PER_TRI,seed=None,walkspeed=agentOrder.WALKSPEED,\
+                 commtime=agentOrder.COMMTIME,linktime=agentOrder.LINKTIME,progress=None,cancel=None,\
+                 checkpoint=None,checkpointSeconds=CHECKPOINT_SECONDS,score=maxfield.keyScore):
+        self.mkweight   = mkweight
+        self.timeweight = timeweight
+        self.nagents    = nagents
+        self.samples    = samples
+        if isinstance(choose,str):
+            self.split  = choose
+            self.choose = splitPolicy(choose)
+        else:
+            self.split  = splitName(choose)
+            self.choose = choose
+        self.tries      = tries
+        self.score      = score
+        self.rng        = np.random.RandomState(seed)
+        self.walkspeed  = walkspeed
+        self.commtime   = commtime
+        self.linktime   = linktime
+        self.progress   = progress
+        self.cancel     = cancel
+        self.checkpoint = checkpoint
+        self.checkpointSeconds = checkpointSeconds
+
+    def report(self,event,sample,result):
+        if sample is None:
+            log.debug(event)
+        else:
+            log.debug('%s: TK %s MK %s weighted %s score %s',event,sample.TK,sample.MK,\
+                      sample.weighted,sample.score)
+        if self.progress is not None:
+            self.progress(event,sample,result)
+
+    def saveCheckpoint(self,problem,result,sinceImprove):
+        if result.best is None:
+            return
+        checkpoint.save(self.checkpoint,checkpoint.Checkpoint(problem,result.best.plan,\
+            result.samples,result.failures,sinceImprove,result.allTK,result.allMK,result.allWeights,\
+            self.rng.get_state()))
+        log.debug('checkpoint after %s samples',result.samples)
+
+    def evaluate(self,b,keys,dists):
+        # Scores plan b (b should be finished if there is a time weight)
+        indeg,outdeg = maxfield.degrees(b)
+        weighted,TK,MK = self.score(indeg,keys,self.mkweight)
+        if self.timeweight > 0:
+            minutes = agentOrder.estimateTime(b,self.nagents,dists,\
+                          self.walkspeed,self.commtime,self.linktime)/60.
+            return Sample(b,weighted,TK,MK,minutes,weighted+self.timeweight*minutes)
+        return Sample(b,weighted,TK,MK,None,weighted)
+
+    def sample(self,a,keys,replanned=None):
+        '''
+        Returns a copy of a with a new plan (not finished), or None if none was found
+        With replanned (see replan.prepare) only what it says was affected is solved again
+        '''
+        b = a.copy()
+        if replanned is not None:
+            # Falls back to a full solve if even freeing every triangle fails
+            if replan.refield(b,replanned,keys,self.mkweight,self.choose,self.rng,self.tries,self.cancel,\
+                              self.score):
+                return b
+        if maxfield.maxFields(b,keys,self.mkweight,self.choose,self.rng,self.tries,self.cancel,\
+                              self.score):
+            return b
+        return None
+
+    def solve(self,a,keys=None,start=None,replanned=None,resume=None,warm=False):
+        '''
+        a is a graph of portals with no edges (it is not changed)
+        keys defaults to maxfield.portalKeys(a)
+        start is a finished plan of the same portals that samples must beat
+        replanned (see replan.prepare) limits each sample to what changed since an earlier plan
+        warm builds samples from the best plan so far (start, to begin with) instead: each keeps
+            all its first generation triangles but one, picked at random (see replan.perturb)
+        resume is a checkpoint.Checkpoint of an earlier solve of the same problem to carry on
+            (its counts, scores and random state are taken over; start is then ignored)
+            Raises ValueError if it is for other portals, keys or settings
+
+        Samples until self.samples in a row have not improved, or a plan lacks no keys,
+        or self.cancel is cancelled
+        Returns a Result
+        '''
+        if keys is None:
+            keys = maxfield.portalKeys(a)
+
+        dists = None
+        if self.timeweight > 0:
+            geo = np.array([ a.node[i]['geo'] for i in range(a.order()) ])
+            dists = geometry.sphereDist(geo,geo)
+
+        problem = None
+        if self.checkpoint is not None or resume is not None:
+            problem = checkpoint.problemKey(a,keys,self.mkweight,self.timeweight,self.nagents,\
+                                            self.split,self.tries)
+
+        result = Result()
+        sinceImprove = 0
+        if resume is not None:
+            if resume.problem != problem:
+                raise ValueError('The checkpoint is for other portals, keys or settings')
+            start = resume.plan
+            result.samples    = resume.samples
+            result.failures   = resume.failures
+            result.allTK      = list(resume.allTK)
+            result.allMK      = list(resume.allMK)
+            result.allWeights = list(resume.allWeights)
+            # It is this search's own best, not a plan to beat
+            result.improved   = True
+            sinceImprove = resume.sinceImprove
+            self.rng.set_state(resume.rngState)
+
+        if start is not None:
+            result.best = self.evaluate(start,keys,dists)
+            result.best.sinceImprove = sinceImprove
+            if self.timeweight > 0:
+                updateFront(result.front,(result.best.weighted,result.best.minutes,\
+                                          result.best.TK,result.best.MK,start))
+            self.report('start' if resume is None else 'resume',result.best,result)
+
+        # What samples keep of the best plan when warm
+        near = None
+        if warm and result.best is not None:
+            near = replan.prepare(result.best.plan,a)
+
+        lastSaved = time.time()
+        while sinceImprove < self.samples:
+            if self.checkpoint is not None and time.time()-lastSaved >= self.checkpointSeconds:
+                self.saveCheckpoint(problem,result,sinceImprove)
+                lastSaved = time.time()
+            rngState = self.rng.get_state()
+            try:
+                if self.cancel is not None:
+                    self.cancel.check()
+                b = self.sample(a,keys,replanned if near is None else replan.perturb(near,self.rng))
+            except Cancelled:
+                # The cancelled sample is dropped, so a resumed search makes it again from the start
+                self.rng.set_state(rngState)
+                result.cancelled = True
+                if self.checkpoint is not None:
+                    self.saveCheckpoint(problem,result,sinceImprove)
+                self.report('cancelled',None,result)
+                break
+            sinceImprove += 1
+            result.samples += 1
+
+            if b is None:
+                result.failures += 1
+                self.report('failure',None,result)
+                continue
+
+            if self.timeweight > 0:
+                # The link order must be final for the time estimate
+                finishPlan(b)
+            sample = self.evaluate(b,keys,dists)
+            better = result.best is None or sample.score < result.best.score
+            if better and self.timeweight == 0:
+                # The best plan is kept finished, ready to be checkpointed or returned
+                finishPlan(b)
+            if self.timeweight > 0:
+                updateFront(result.front,(sample.weighted,sample.minutes,sample.TK,sample.MK,b))
+
+            result.allTK.append(sample.TK)
+            result.allMK.append(sample.MK)
+            result.allWeights.append(sample.weighted)
+
+            if better:
+                sinceImprove = 0
+                result.best = sample
+                result.improved = True
+                sample.sinceImprove = sinceImprove
+                if warm:
+                    near = replan.prepare(b,a)
+                self.report('improvement',sample,result)
+            else:
+                sample.sinceImprove = sinceImprove
+                self.report('sample',sample,result)
+
+            # With time scoring, perfect keys may still be beaten by a faster plan
+            if sample.weighted <= 0 and self.timeweight == 0:
+                self.report('perfect',sample,result)
+                break
+
+        if result.best is not None:
+            result.plan = result.best.plan
+        return result
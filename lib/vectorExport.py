@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - vectorExport.py
+
+Writing a plan as GeoJSON or SVG, straight from its arrays (see planFile)
+without matplotlib. Either file has everything the PNG maps show, so a
+viewer can draw the portal map, link map, link order and triangulation
+depths itself:
+
+GeoJSON, a FeatureCollection of
+    portals     Points with 'index', 'label' (numbered north to south, as on
+                the maps and key lists), 'name' and 'keys'
+    links       LineStrings from origin to destination with 'order' (the step
+                it is made at), 'origin', 'destination', 'reversible', 'depth'
+                (as in the depth_*.png frames) and 'fields' (the portal
+                triples of the fields it completes)
+    fields      Polygons with 'order' (the step of the link completing them)
+and the plan's totals under "maxfield"
+
+SVG, with the same data in data-* attributes of each circle, line and polygon
+"""
+import json
+import numpy as np
+from xml.sax.saxutils import escape
+
+# AP as makePlan reports it
+PORTAL_AP = 125*8 + 500 + 250
+LINK_AP   = 313
+FIELD_AP  = 1250
+
+def load(filename):
+    '''
+    Returns the arrays of the plan file filename as a dict (see planFile)
+    '''
+    with np.load(filename,allow_pickle=False) as plan:
+        return dict((name,plan[name]) for name in plan.files)
+
+def northSouthLabels(xy):
+    # label[i] is portal i's number on the maps (0 is the northmost)
+    order = np.argsort(xy,axis=0)[::-1,1]
+    label = np.empty(len(order),dtype=int)
+    label[order] = np.arange(len(order))
+    return label
+
+def linkDepths(arrays):
+    '''
+    Returns depth[i], the triangulation depth of link i
+        0 for sides of first generation triangles
+        d for links to the portal a triangle at depth d-1 is split on
+    '''
+    edges = arrays['edges']
+    index = {}
+    for i,(p,q) in enumerate(edges.tolist()):
+        index[(p,q)] = index[(q,p)] = i
+
+    depth = np.full(len(edges),-1,dtype=int)
+    def mark(pairs,d):
+        for (p,q),k in zip(pairs,d):
+            i = index.get((p,q))
+            if i is not None and (depth[i] < 0 or k < depth[i]):
+                depth[i] = k
+
+    verts  = arrays['tri_verts']
+    center = arrays['tri_center']
+    tdepth = arrays['tri_depth']
+
+    roots = verts[tdepth == 0]
+    for a,b in ((0,2),(1,0),(2,1)):
+        mark(roots[:,[a,b]].tolist(),np.zeros(len(roots),dtype=int))
+
+    split = center >= 0
+    for k in range(3):
+        mark(np.column_stack([verts[split,k],center[split]]).tolist(),tdepth[split]+1)
+    return depth
+
+def totals(arrays):
+    n = len(arrays['names'])
+    m = len(arrays['edges'])
+    f = len(arrays['field_edges'])
+    return {'portals':n,'links':m,'fields':f,'AP':PORTAL_AP*n + LINK_AP*m + FIELD_AP*f}
+
+def geoJSON(arrays):
+    '''
+    Returns the plan as a GeoJSON FeatureCollection (a dict, see above)
+    '''
+    lnglat = np.round(np.rad2deg(arrays['geo'][:,::-1]),6).tolist()
+    labels = northSouthLabels(arrays['xy'])
+    edges  = arrays['edges'].tolist()
+    depths = linkDepths(arrays)
+
+    fields = [ [] for e in edges ]
+    for i,tri in zip(arrays['field_edges'].tolist(),arrays['field_verts'].tolist()):
+        fields[i].append(tri)
+
+    features = []
+    for i,name in enumerate(arrays['names'].tolist()):
+        features.append({'type':'Feature',
+                         'geometry':{'type':'Point','coordinates':lnglat[i]},
+                         'properties':{'kind':'portal','index':i,'label':int(labels[i]),
+                                       'name':name,'keys':int(arrays['keys'][i])}})
+    for i,(p,q) in enumerate(edges):
+        features.append({'type':'Feature',
+                         'geometry':{'type':'LineString','coordinates':[lnglat[p],lnglat[q]]},
+                         'properties':{'kind':'link','order':i,'origin':p,'destination':q,
+                                       'reversible':bool(arrays['reversible'][i]),
+                                       'depth':int(depths[i]),'fields':fields[i]}})
+    for i,tri in zip(arrays['field_edges'].tolist(),arrays['field_verts'].tolist()):
+        ring = [ lnglat[v] for v in tri+[tri[0]] ]
+        features.append({'type':'Feature',
+                         'geometry':{'type':'Polygon','coordinates':[ring]},
+                         'properties':{'kind':'field','order':i,'portals':tri}})
+
+    return {'type':'FeatureCollection','maxfield':totals(arrays),'features':features}
+
+def writeGeoJSON(arrays,filename):
+    with open(filename,'w') as fout:
+        json.dump(geoJSON(arrays),fout,separators=(',',':'))
+
+def svg(arrays,width=800,margin=20):
+    '''
+    Returns the plan drawn as an SVG document (a string) of the given width in pixels
+    Portals are placed by their gnomonic 'xy', like on the PNG maps
+    '''
+    xy = np.asarray(arrays['xy'],dtype=float).reshape([-1,2])
+    lo = xy.min(0)
+    extent = xy.max(0)-lo
+    scale = (width-2*margin)/max(extent.max(),1e-12)
+    # SVG y grows downwards
+    px = np.column_stack([ margin+(xy[:,0]-lo[0])*scale , margin+(lo[1]+extent[1]-xy[:,1])*scale ])
+    height = int(np.ceil(extent[1]*scale+2*margin))
+
+    labels = northSouthLabels(xy)
+    edges  = arrays['edges'].tolist()
+    depths = linkDepths(arrays)
+    names  = arrays['names'].tolist()
+
+    def point(i):
+        return '%.1f,%.1f'%tuple(px[i])
+
+    out = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d" data-portals="%d" data-links="%d" data-fields="%d" data-ap="%d">'%\
+           ((width,height,width,height)+tuple(totals(arrays)[k] for k in ('portals','links','fields','AP'))),
+           '<style>.field{fill:#2ABBFF;fill-opacity:.3}.link{stroke:#000;stroke-width:1}'
+           '.portal{fill:#2ABBFF}.label{font:bold 10px sans-serif;text-anchor:middle;dominant-baseline:central}</style>',
+           '<g class="fields">']
+    for i,tri in zip(arrays['field_edges'].tolist(),arrays['field_verts'].tolist()):
+        out.append('<polygon class="field" data-order="%d" points="%s"/>'%(i,' '.join(point(v) for v in tri)))
+    out.append('</g><g class="links">')
+    for i,(p,q) in enumerate(edges):
+        out.append('<line class="link" data-order="%d" data-origin="%d" data-destination="%d" data-depth="%d" x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f"/>'%\
+                   ((i,p,q,depths[i])+tuple(px[p])+tuple(px[q])))
+    out.append('</g><g class="portals">')
+    for i in range(len(px)):
+        out.append('<g data-index="%d" data-label="%d" data-keys="%d"><title>%s</title><circle class="portal" cx="%.1f" cy="%.1f" r="7"/><text class="label" x="%.1f" y="%.1f">%d</text></g>'%\
+                   ((i,labels[i],arrays['keys'][i],escape(names[i]))+tuple(px[i])+tuple(px[i])+(labels[i],)))
+    out.append('</g></svg>')
+    return '\n'.join(out)+'\n'
+
+def writeSVG(arrays,filename,width=800):
+    with open(filename,'w') as fout:
+        fout.write(svg(arrays,width))
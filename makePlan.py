@@ -3,14 +3,20 @@
 """
 Ingress Maxfield - makePlan.py
 
-usage: makePlan.py [-h] [-v] [-n NUM_AGENTS] [-s SAMPLES]
+usage: makePlan.py [-h] [-v] [-n NUM_AGENTS] [-s SAMPLES] [-w MK_WEIGHT]
+                   [-t TIME_WEIGHT] [--store] [--store_dir STORE_DIR]
+                   [--improve] [--base BASE] [--keys KEYS]
+                   [--split SPLIT] [--solve_only]
+                   [--checkpoint_every SECONDS] [--resume] [--vector]
+                   [--outputs OUTPUTS] [-j JOBS] [--profile PROFILE]
                    input_file
 
 Ingress Maxfield - Maximize the number of links and fields, and thus AP, for a
 collection of portals in the game Ingress.
 
 positional arguments:
-  input_file            Input semi-colon delimited portal file
+  input_file            Input semi-colon delimited portal file, or a .npz plan
+                        saved by an earlier run
 
 optional arguments:
   -h, --help            show this help message and exit
@@ -21,6 +27,73 @@ optional arguments:
                         Number of iterations to perform. More iterations may
                         improve results, but will take longer to process.
                         Default: 50
+  -w MK_WEIGHT, --mk_weight MK_WEIGHT
+                        Weight of the largest number of keys lacked for a
+                        single portal (MK) against the total number of keys
+                        lacked (TK) when choosing a plan. Default: 2
+  -t TIME_WEIGHT, --time_weight TIME_WEIGHT
+                        Also score plans by their estimated time, in minutes,
+                        for NUM_AGENTS agents. A plan's score is then
+                        TK + MK_WEIGHT*MK + TIME_WEIGHT*minutes, and the other
+                        plans on the key/time Pareto front are saved too.
+                        0 ignores time. Default: 0
+  --store               Keep the best plan for each portal list (by
+                        coordinates, keys and solver settings) in the plan
+                        store and reuse it instead of solving again.
+                        Default: False
+  --store_dir STORE_DIR
+                        Directory of the plan store.
+                        Default: ~/Ingress/Fielding/planStore
+  --improve             With --store, keep improving the stored plan: samples
+                        re-split one of its first generation triangles at a
+                        time, building on each improvement. Default: False
+  --base BASE           A .npz plan for an earlier version of the portal list.
+                        If only interior portals were added, removed or moved,
+                        first generation triangles whose contents did not
+                        change are kept and only the others are solved again.
+                        Default: None
+  --keys KEYS           With a .npz plan as input_file, take the number of keys
+                        for each portal from the portal list KEYS, re-orient
+                        the links for them and rewrite only the files that
+                        change (no new solve). Default: None
+  --split SPLIT         How to pick the portal each triangle is split on:
+                        random, near (closest to the final vertex), balanced
+                        (fewest portals in the fullest part) or keys (more
+                        likely the more keys it has), or a weighted mix like
+                        balanced:2,random:1. Default: random
+  --solve_only          Only solve and save the plan (.npz). No maps or agent
+                        files are made and matplotlib is never loaded.
+                        Default: False
+  --checkpoint_every SECONDS
+                        Save the search (best plan, scores and random state)
+                        to <input name>_checkpoint.npz in the output
+                        directory this often, and on Ctrl-C. It is removed
+                        once the search is done. 0 for no checkpoints.
+                        Default: 60
+  --resume              Carry on the search saved in the checkpoint, if there
+                        is one, instead of starting again. Default: False
+  --vector              Also write the plan as <input name>.geojson and
+                        <input name>.svg (portals, links in order with their
+                        depths, and fields), made without matplotlib.
+                        Default: False
+  --outputs OUTPUTS     Comma separated list of the files to make: keys (key
+                        lists and keyPrep.txt), links (link schedules), maps
+                        (portal and link maps), frames (the links one by
+                        one), depths (the triangulation depth by depth) and
+                        optimization (optimization.png). Only what is asked
+                        for is worked out: without keys and links the links
+                        are not split among the agents.
+                        Default: keys,links,maps,frames,depths,optimization
+  -j JOBS, --jobs JOBS  Number of processes drawing the maps, the frames and
+                        the depth images at the same time, while the key and
+                        link lists are written. 1 makes everything one after
+                        another. Default: number of CPUs
+  --profile PROFILE     Size and detail of the images: default, preview
+                        (low resolution, no link numbers on the link map and
+                        no dotted links on the frames, quick to draw) or
+                        print (letter paper at 200 dpi). preview and print
+                        size portals, lines and labels for how close the
+                        portals are. Default: default
 
 Original version by jpeterbaker
 22 July 2014 - tvw updates csv file format
@@ -34,13 +107,9 @@ Original version by jpeterbaker
 import sys
 import os
 import argparse
-import networkx as nx
-import numpy as np
-import pandas as pd
-from lib import maxfield,PlanPrinterMap,geometry,agentOrder
-import pickle
-
-import matplotlib.pyplot as plt
+# numpy, pandas, networkx, matplotlib and the lib modules are imported by the
+# stages that need them, so --version, re-printing a saved plan and solve-only
+# runs start quickly
 
 
 try:
@@ -62,6 +131,63 @@ else:
 _V_ = '3.0'
 # max portals allowed
 _MAX_PORTALS_ = 1000
+# Files makePlan can make (see --outputs); all but optimization are PlanPrinterMap.OUTPUTS
+OUTPUTS = ['keys','links','maps','frames','depths','optimization']
+
+def parseOutputs(text):
+    '''
+    Returns the set of outputs named in text (comma separated, see OUTPUTS)
+    Raises ValueError for a name not in OUTPUTS
+    '''
+    outputs = set( name.strip() for name in text.split(',') if name.strip() )
+    unknown = outputs - set(OUTPUTS)
+    if unknown:
+        raise ValueError("Unknown outputs {0} (choose from {1})".format(','.join(sorted(unknown)),','.join(OUTPUTS)))
+    return outputs
+
+def plotOptimization(allTK,allMK,allWeights,filename):
+    # Scatter plot of the key requirements of every sampled plan
+    # (on an Agg canvas of its own, like lib/PlanPrinterMap.py)
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    points = ax.scatter(allTK,allMK,c=allWeights,marker='o')
+    ax.set_xlim(min(allTK)-1,max(allTK)+1)
+    ax.set_ylim(min(allMK)-1,max(allMK)+1)
+    ax.set_xlabel('Total keys required')
+    ax.set_ylabel('Max keys required for a single portal')
+    cbar = fig.colorbar(points,ax=ax)
+    cbar.set_label('Optimization Weighting (lower=better)')
+    fig.savefig(filename)
+    fig.clf()
+
+def readKeys(filename,a):
+    '''
+    Reads the key column of a portal list (name;intel_link;keys)
+    Returns keys[i] for portal i of plan a, matching portals by location
+    Exits if a portal of a is not in the list
+    '''
+    import numpy as np
+    from lib import geometry,portalList
+
+    try:
+        portals = portalList.read(filename)
+    except ValueError as err:
+        sys.exit("Error! {0}".format(err))
+    keysAt = dict( ((lat,lon),keys) for name,lat,lon,keys in portals )
+
+    geo = np.array([a.node[i]['geo'] for i in range(a.order())])
+    locs = np.round(geo/geometry.radPERe6degree).astype(np.int64)
+    keys = []
+    for i in range(a.order()):
+        loc = tuple(locs[i])
+        if loc not in keysAt:
+            sys.exit("Error: portal {0} of the plan is not in {1}".format(a.node[i]['name'],filename))
+        keys.append(keysAt[loc])
+    return keys
 
 def main():
     description=("Ingress Maxfield - Maximize the number of links "
@@ -82,8 +208,79 @@ def main():
                         "perform. More iterations may improve "
                         "results, but will take longer to process. "
                         "Default: 50")
+    parser.add_argument('-w','--mk_weight',type=float,default=2,
+                        help="Weight of the largest number of keys lacked "
+                        "for a single portal (MK) against the total number "
+                        "of keys lacked (TK) when choosing a plan. "
+                        "Default: 2")
+    parser.add_argument('-t','--time_weight',type=float,default=0,
+                        help="Also score plans by their estimated time, in "
+                        "minutes, for NUM_AGENTS agents. A plan's score is "
+                        "then TK + MK_WEIGHT*MK + TIME_WEIGHT*minutes, and "
+                        "the other plans on the key/time Pareto front are "
+                        "saved too. 0 ignores time. Default: 0")
+    parser.add_argument('--store',action='store_true',
+                        help="Keep the best plan for each portal list (by "
+                        "coordinates, keys and solver settings) in the plan "
+                        "store and reuse it instead of solving again. "
+                        "Default: False")
+    parser.add_argument('--store_dir',
+                        default=os.path.expanduser('~')+"/Ingress/Fielding/planStore",
+                        help="Directory of the plan store. "
+                        "Default: ~/Ingress/Fielding/planStore")
+    parser.add_argument('--improve',action='store_true',
+                        help="With --store, keep improving the stored plan: "
+                        "samples re-split one of its first generation "
+                        "triangles at a time, building on each improvement. "
+                        "Default: False")
+    parser.add_argument('--base',default=None,
+                        help="A .npz plan for an earlier version of the "
+                        "portal list. If only interior portals were added, "
+                        "removed or moved, first generation triangles whose "
+                        "contents did not change are kept and only the "
+                        "others are solved again. Default: None")
+    parser.add_argument('--keys',default=None,
+                        help="With a .npz plan as input_file, take the "
+                        "number of keys for each portal from the portal list "
+                        "KEYS, re-orient the links for them and rewrite only "
+                        "the files that change (no new solve). Default: None")
+    parser.add_argument('--split',default='random',
+                        help="How to pick the portal each triangle is split "
+                        "on: random, near (closest to the final vertex), "
+                        "balanced (fewest portals in the fullest part) or "
+                        "keys (more likely the more keys it has), or a "
+                        "weighted mix like balanced:2,random:1. "
+                        "Default: random")
+    parser.add_argument('--solve_only',action='store_true',
+                        help="Only solve and save the plan (.npz). No "
+                        "maps or agent files are made and matplotlib is "
+                        "never loaded. Default: False")
+    parser.add_argument('--checkpoint_every',type=float,default=60,
+                        metavar='SECONDS',
+                        help="Save the search to <input name>_checkpoint.npz "
+                        "in the output directory this often, and on Ctrl-C. "
+                        "0 for no checkpoints. Default: 60")
+    parser.add_argument('--resume',action='store_true',
+                        help="Carry on the search saved in the checkpoint, "
+                        "if there is one. Default: False")
+    parser.add_argument('--vector',action='store_true',
+                        help="Also write the plan as <input name>.geojson "
+                        "and .svg, made without matplotlib. Default: False")
+    parser.add_argument('--outputs',default=','.join(OUTPUTS),
+                        help="Comma separated list of the files to make, "
+                        "from {0}. Nothing else is worked out. "
+                        "Default: all of them".format(','.join(OUTPUTS)))
+    parser.add_argument('-j','--jobs',type=int,default=os.cpu_count(),
+                        help="Number of processes drawing the maps, frames "
+                        "and depth images at the same time. "
+                        "Default: number of CPUs")
+    parser.add_argument('--profile',default='default',
+                        help="Size and detail of the images: default, "
+                        "preview (small and quick) or print (letter paper). "
+                        "Default: default")
     parser.add_argument('input_file',
-                        help="Input semi-colon delimited portal file")
+                        help="Input semi-colon delimited portal file, "
+                        "or a .npz plan saved by an earlier run")
     args = vars(parser.parse_args())
 
     # Number of iterations to complete since last improvement
@@ -107,188 +304,288 @@ def main():
         os.makedirs(output_directory)
     output_file = (os.path.split(args['input_file'])[1][:-4])
     print(output_file)
-    if output_file[-4:] != '.pkl':
-        output_file += ".pkl"
+    if output_file[-4:] != '.npz':
+        output_file += ".npz"
 
     nagents = args["num_agents"]
     if nagents < 0:
         sys.exit("Number of agents should be positive")
 
+    MK_WEIGHT = args["mk_weight"]
+    if MK_WEIGHT < 0:
+        sys.exit("MK weight should be positive")
+
+    TIME_WEIGHT = args["time_weight"]
+    if TIME_WEIGHT < 0:
+        sys.exit("Time weight should be positive")
+
+    STORE = args["store_dir"] if args["store"] else None
+    if args['improve'] and STORE is None:
+        sys.exit("Error: --improve needs --store")
+
     EXTRA_SAMPLES = args["samples"]
     if EXTRA_SAMPLES < 0:
         sys.exit("Number of extra samples should be positive")
     elif EXTRA_SAMPLES > 100:
         sys.exit("Extra samples may not be more than 100")
 
-    if input_file[-3:] != 'pkl':
+    if args['solve_only'] and input_file[-3:] in ('pkl','npz'):
+        sys.exit("Error: --solve_only needs a portal list, not a saved plan")
+    if args['base'] is not None and input_file[-3:] in ('pkl','npz'):
+        sys.exit("Error: --base needs a portal list, not a saved plan")
+    if args['resume'] and input_file[-3:] in ('pkl','npz'):
+        sys.exit("Error: --resume needs a portal list, not a saved plan")
+    if args['checkpoint_every'] < 0:
+        sys.exit("Checkpoint interval should be positive")
+    if args['keys'] is not None and input_file[-3:] != 'npz':
+        sys.exit("Error: --keys needs a .npz plan as input_file")
+    try:
+        outputs = parseOutputs(args['outputs'])
+    except ValueError as err:
+        sys.exit("Error: {0}".format(err))
+    if args['jobs'] < 1:
+        sys.exit("Number of jobs should be positive")
+    from lib import renderProfile
+    try:
+        renderProfile.get(args['profile'])
+    except ValueError as err:
+        sys.exit("Error: {0}".format(err))
+
+    if input_file[-3:] not in ('pkl','npz'):
+        import numpy as np
+        from lib import maxfield,planFile,planStore,portalList
+        from lib.Triangle import splitPolicy
+        from lib.solver import Solver
+        try:
+            splitPolicy(args['split'])
+        except ValueError as err:
+            sys.exit("Error: {0}".format(err))
+
         # If the input file is a portal list, let's set things up
-        a = nx.DiGraph() # network tool
-        locs = [] # portal coordinates
         # each line should be name;intel_link;keys
-        portals = pd.read_table(input_file,sep=';',
-                                comment='#',index_col=False,
-                                names=['name','link','keys'],dtype=str)
-        portals = np.array(portals)
-        portals = np.array([portal for portal in portals if (isinstance(portal[0], basestring) and isinstance(portal[1], basestring))])
+        try:
+            portals = portalList.read(input_file)
+        except ValueError as err:
+            sys.exit("Error! {0}".format(err))
         print ("Found {0} portals in portal list.".format(len(portals)))
         if len(portals) < 3:
             sys.exit("Error: Must have more than 2 portals!")
         if len(portals) > _MAX_PORTALS_:
             sys.exit("Error: Portal limit is {0}".\
                      format(_MAX_PORTALS_))
-        for num,portal in enumerate(portals):
-            if len(portal) < 3:
-                print ("Error! Portal ",portal[0]," has a formatting problem.")
-                sys.exit()
-            a.add_node(num)
-            a.node[num]['name'] = portal[0]
-            coords = (portal[1].split('pll='))
-            if len(coords) < 2:
-                print ("Error! Portal ",portal[0]," has a formatting problem.")
-                sys.exit()
-            coord_parts = coords[1].split(',')
-            lat = int(float(coord_parts[0]) * 1.e6)
-            lon = int(float(coord_parts[1]) * 1.e6)
-            locs.append(np.array([lat,lon],dtype=float))
-            try:
-                keys = int(portal[2])
-                a.node[num]['keys'] = keys
-            except ValueError:
-                a.node[num]['keys'] = 0
 
+        a,e6locs = portalList.portalGraph(portals)
         n = a.order() # number of nodes
-        locs = np.array(locs,dtype=float)
-
-        # Convert coords to radians, then to cartesian, then to
-        # gnomonic projection
-        locs = geometry.e6LLtoRads(locs)
-        xyz  = geometry.radstoxyz(locs)
-        xy   = geometry.gnomonicProj(locs,xyz)
-
-        for i in range(n):
-            a.node[i]['geo'] = locs[i]
-            a.node[i]['xyz'] = xyz[i]
-            a.node[i]['xy' ] = xy[i]
 
         # EXTRA_SAMPLES attempts to get graph with few missing keys
-        # Try to minimuze TK + 2*MK where
+        # Try to minimuze TK + MK_WEIGHT*MK where
         # TK is the total number of missing keys
         # MK is the maximum number of missing keys for any single
         # portal
-        bestgraph = None
-        bestlack = np.inf
-        bestTK = np.inf
-        bestMK = np.inf
-
-        allTK = []
-        allMK = []
-        allWeights = []
-
-        sinceImprove = 0
-
-        while sinceImprove<EXTRA_SAMPLES:
-            b = a.copy()
-
-            sinceImprove += 1
-
-            if not maxfield.maxFields(b):
-                print ('Randomization failure\nThe program may work if you try again. It is more likely to work if you remove some portals.')
-                continue
-
-            TK = 0
-            MK = 0
-            for j in range(n):
-                keylack = max(b.in_degree(j)-b.node[j]['keys'],0)
-                TK += keylack
-                if keylack > MK:
-                    MK = keylack
-            
-            weightedlack = TK+2*MK
-
-            allTK.append(TK)
-            allMK.append(MK)
-            allWeights.append(weightedlack)
-
-            if weightedlack < bestlack:
-                sinceImprove = 0
-                print ('IMPROVEMENT:\n\ttotal: %s\n\tmax:   %s\n\tweighted: %s'%\
-                       (TK,MK,weightedlack))
-                bestgraph = b
-                bestlack  = weightedlack
-                bestTK  = TK
-                bestMK  = MK
+        # (Solver takes any function like maxfield.keyScore as score instead)
+        # With TIME_WEIGHT, TIME_WEIGHT*minutes is added to the score
+        # minutes is a quick (greedy) estimate of the operation's length
+        keys = maxfield.portalKeys(a)
+
+        # With a base plan, samples only re-solve what the changed portals affect
+        replanned = None
+        if args['base'] is not None:
+            from lib import replan
+            try:
+                base = planFile.load(args['base'])
+            except ValueError as err:
+                sys.exit("Error: {0}".format(err))
+            replanned = replan.prepare(base,a)
+            if replanned is None:
+                print ('The perimeter changed since %s, solving from scratch'%args['base'])
             else:
-                print ('this time:\n\ttotal: %s\n\tmax:   %s\n\tweighted: %s'%\
-                       (TK,MK,weightedlack))
-
-            if weightedlack <= 0:
-                print ('KEY PERFECTION')
-                bestlack  = weightedlack
-                bestTK  = TK
-                bestMK  = MK
-                break
-            # if num agent keys is zero, this code isn't true...
-            # if all([ b.node[i]['keys'] <= b.out_degree(i) for i in xrange(n) ]):
-            #     print 'All keys used. Improvement impossible'
-            #     break
-
-            print ('%s tries since improvement'%sinceImprove)
-
-        if bestgraph == None:
-            print ('EXITING RANDOMIZATION LOOP WITHOUT SOLUTION!')
-            print ('')
-            exit()
-
-        print ('Choosing plan requiring %s additional keys, max of %s from single portal'%(bestTK,bestMK))
-
-        plt.clf()
-        plt.scatter(allTK,allMK,c=allWeights,marker='o')
-        plt.xlim(min(allTK)-1,max(allTK)+1)
-        plt.ylim(min(allMK)-1,max(allMK)+1)
-        plt.xlabel('Total keys required')
-        plt.ylabel('Max keys required for a single portal')
-        cbar = plt.colorbar()
-        cbar.set_label('Optimization Weighting (lower=better)')
-        plt.savefig(output_directory+'optimization.png')
-
-        a = bestgraph
-
-        # Attach to each edge a list of fields that it completes
-        # catch no triangulation (bad portal file?)
+                print ('Keeping %s of %s first generation triangles from %s'%\
+                       (np.sum(~replanned.affected),len(replanned.affected),args['base']))
+
+        stored = None
+        if STORE is not None:
+            fingerprint = planStore.fingerprint(e6locs,keys,\
+                {'mk_weight':MK_WEIGHT,'time_weight':TIME_WEIGHT,\
+                 'num_agents':nagents if TIME_WEIGHT > 0 else None})
+            stored = planStore.load(STORE,fingerprint)
+            if stored is not None:
+                stored,info = stored
+                # Names are not part of the fingerprint, so take the current ones
+                for i in range(n):
+                    stored.node[i]['name'] = a.node[i]['name']
+
+        if stored is not None and not args['improve']:
+            print ('Using stored plan requiring %s additional keys, max of %s from single portal'%\
+                   (info['TK'],info['MK']))
+            a = stored
+        else:
+            def report(event,sample,result):
+                if event == 'start':
+                    # Warm start: samples are built from the stored plan, then from each improvement
+                    print ('Starting from stored plan with weighted: %s'%sample.weighted)
+                elif event == 'resume':
+                    print ('Resuming after %s samples from plan with weighted: %s'%\
+                           (result.samples,sample.weighted))
+                elif event == 'failure':
+                    print ('Randomization failure\nThe program may work if you try again. It is more likely to work if you remove some portals.')
+                elif event == 'perfect':
+                    print ('KEY PERFECTION')
+                elif event == 'cancelled':
+                    print ('Interrupted after %s samples'%result.samples)
+                else:
+                    if event == 'improvement':
+                        print ('IMPROVEMENT:\n\ttotal: %s\n\tmax:   %s\n\tweighted: %s'%\
+                               (sample.TK,sample.MK,sample.weighted))
+                    else:
+                        print ('this time:\n\ttotal: %s\n\tmax:   %s\n\tweighted: %s'%\
+                               (sample.TK,sample.MK,sample.weighted))
+                    if TIME_WEIGHT > 0:
+                        print ('\tminutes:  %.1f\n\tscore:    %.1f'%(sample.minutes,sample.score))
+                    if not (sample.weighted <= 0 and TIME_WEIGHT == 0):
+                        print ('%s tries since improvement'%sample.sinceImprove)
+
+            # The first Ctrl-C stops sampling and keeps the best plan so far
+            import signal
+            from lib.cancel import CancelToken
+            token = CancelToken()
+            interrupt = signal.signal(signal.SIGINT,lambda signum,frame: token.cancel())
+
+            # Checkpoints let a killed search be resumed
+            from lib import checkpoint
+            checkpoint_file = output_directory+output_file[:-4]+'_checkpoint.npz'
+            resume = None
+            if args['resume']:
+                if os.path.exists(checkpoint_file):
+                    try:
+                        resume = checkpoint.load(checkpoint_file)
+                    except ValueError as err:
+                        sys.exit("Error: {0}".format(err))
+                else:
+                    print ('No checkpoint at %s, starting a new search'%checkpoint_file)
+
+            solver = Solver(MK_WEIGHT,TIME_WEIGHT,nagents,EXTRA_SAMPLES,args['split'],progress=report,cancel=token,\
+                            checkpoint=checkpoint_file if args['checkpoint_every'] > 0 else None,\
+                            checkpointSeconds=args['checkpoint_every'])
+            try:
+                result = solver.solve(a,keys,stored,replanned,resume,warm=stored is not None)
+            except ValueError as err:
+                sys.exit("Error: {0} ({1})".format(err,checkpoint_file))
+            signal.signal(signal.SIGINT,interrupt)
+
+            if result.cancelled and solver.checkpoint is not None:
+                print ('Search saved to %s (carry on with --resume)'%checkpoint_file)
+            elif os.path.exists(checkpoint_file):
+                os.remove(checkpoint_file)
+
+            if result.best is None:
+                print ('EXITING RANDOMIZATION LOOP WITHOUT SOLUTION!')
+                print ('')
+                exit()
+
+            best = result.best
+            print ('Choosing plan requiring %s additional keys, max of %s from single portal'%(best.TK,best.MK))
+
+            if not args['solve_only'] and 'optimization' in outputs:
+                plotOptimization(result.allTK,result.allMK,result.allWeights,output_directory+'optimization.png')
+
+            a = result.plan
+
+            if TIME_WEIGHT > 0:
+                # Every plan not beaten on both key score and minutes was kept in front
+                front = sorted(result.front,key=lambda f: f[0])
+                print ('Pareto front of key score and estimated minutes (%s agents):'%nagents)
+                for k,(weightedlack,minutes,TK,MK,b) in enumerate(front):
+                    if b is a:
+                        print ('\tweighted: %s\tminutes: %.1f\t(chosen)'%(weightedlack,minutes))
+                        continue
+                    frontfile = output_file[:-4]+'_pareto_%s.npz'%k
+                    planFile.save(b,output_directory+frontfile)
+                    print ('\tweighted: %s\tminutes: %.1f\t%s'%(weightedlack,minutes,frontfile))
+
+            if STORE is not None and result.improved:
+                planStore.save(STORE,fingerprint,a,{'score':best.score,'weighted':best.weighted,\
+                                                   'TK':best.TK,'MK':best.MK})
+
+        planFile.save(a,output_directory+output_file)
+    elif input_file[-3:] == 'npz':
+        from lib import planFile
         try:
-            for t in a.triangulation:
-                t.markEdgesWithFields()
-        except AttributeError:
-            print ("Error: problem with bestgraph... no triangulation...?")
-
-        agentOrder.improveEdgeOrder(a)
-
-        with open(output_directory+output_file,'wb') as fout:
-            pickle.dump(a,fout)
+            a = planFile.load(input_file)
+        except ValueError as err:
+            sys.exit("Error: {0}".format(err))
+
+        # Only the keys changed: re-orient the links, no new solve
+        flipped = None
+        if args['keys'] is not None:
+            from lib import maxfield
+            keys = readKeys(args['keys'],a)
+            for i in range(a.order()):
+                a.node[i]['keys'] = keys[i]
+            keys = maxfield.portalKeys(a)
+
+            indeg,outdeg = maxfield.degrees(a)
+            oldlack = maxfield.keyScore(indeg,keys,MK_WEIGHT)[0]
+
+            before = set(a.edges())
+            maxfield.orientEdges(a,keys,MK_WEIGHT)
+            indeg,outdeg = maxfield.degrees(a)
+            weightedlack,TK,MK = maxfield.keyScore(indeg,keys,MK_WEIGHT)
+
+            flippedEdges = before-set(a.edges())
+            if weightedlack >= oldlack:
+                # Equally good orientations are not worth redrawing the maps for
+                for p,q in flippedEdges:
+                    maxfield.flip(a,q,p)
+                weightedlack,TK,MK = maxfield.keyScore(maxfield.degrees(a)[0],keys,MK_WEIGHT)
+                flippedEdges = set()
+            flipped = len(flippedEdges)
+
+            print ('Re-oriented %s links, plan now requires %s additional keys, max of %s from single portal'%\
+                   (flipped,TK,MK))
+            planFile.save(a,output_directory+output_file)
     else:
-        with open(input_file,'r') as fin:
+        # Plans pickled by earlier versions
+        import pickle
+        with open(input_file,'rb') as fin:
             a = pickle.load(fin)
     #    agentOrder.improveEdgeOrder(a)
     #    with open(output_directory+output_file,'w') as fout:
     #        pickle.dump(a,fout)
 
-    PP = PlanPrinterMap.PlanPrinter(a,output_directory,nagents,color=BLUE,useGoogle=useGoogle,
-                                    api_key=api_key)
-    PP.keyPrep()
-    PP.agentKeys()
-    PP.planMap(useGoogle=useGoogle)
-    PP.agentLinks()
-
-    # These make step-by-step instructional images
-    PP.animate(useGoogle=useGoogle)
-    PP.split3instruct(useGoogle=useGoogle)
-
-    print ("Number of portals: {0}".format(PP.num_portals))
-    print ("Number of links: {0}".format(PP.num_links))
-    print ("Number of fields: {0}".format(PP.num_fields))
-    portal_ap = (125*8 + 500 + 250)*PP.num_portals
-    link_ap = 313 * PP.num_links
-    field_ap = 1250 * PP.num_fields
+    if args['vector']:
+        from lib import planFile,vectorExport
+        arrays = planFile.toArrays(a)
+        vectorExport.writeGeoJSON(arrays,output_directory+output_file[:-4]+'.geojson')
+        vectorExport.writeSVG(arrays,output_directory+output_file[:-4]+'.svg')
+
+    if args['solve_only']:
+        print ("Plan saved to {0}".format(output_directory+output_file))
+        return
+
+    # After --keys only the key and link lists change,
+    # and the link map and frames only if a link changed direction
+    if args['keys'] is not None:
+        outputs.discard('depths')
+        if flipped == 0:
+            outputs -= set(['maps','frames'])
+
+    # optimization.png is made with the solve
+    printed = [ name for name in OUTPUTS if name in outputs and name != 'optimization' ]
+    if printed:
+        from lib import PlanPrinterMap
+        PP = PlanPrinterMap.PlanPrinter(a,output_directory,nagents,color=BLUE,useGoogle=useGoogle,
+                                        api_key=api_key,profile=args['profile'])
+        PP.write(printed,useGoogle=useGoogle,jobs=args['jobs'])
+
+    num_portals = a.order()
+    num_links = a.size()
+    num_fields = sum(len(data['fields']) for p,q,data in a.edges_iter(data=True))
+    print ("Number of portals: {0}".format(num_portals))
+    print ("Number of links: {0}".format(num_links))
+    print ("Number of fields: {0}".format(num_fields))
+    portal_ap = (125*8 + 500 + 250)*num_portals
+    link_ap = 313 * num_links
+    field_ap = 1250 * num_fields
     print ("AP from portals capture: {0}".format(portal_ap))
     print ("AP from link creation: {0}".format(link_ap))
     print ("AP from field creation: {0}".format(field_ap))
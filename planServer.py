@@ -0,0 +1,580 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingress Maxfield - planServer.py
+
+usage: planServer.py [-h] [--host HOST] [-p PORT] [-j JOBS] [-q MAX_QUEUE]
+                     [-g] [-a API_KEY] [-o OUTPUT_ROOT]
+
+Serve plans over HTTP on this machine. Solves and maps run on one pool of
+JOBS worker processes (like batchPlan.py), so bursts of requests are queued
+instead of each starting its own makePlan.py.
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --host HOST           Address to listen on. Default: 127.0.0.1
+  -p PORT, --port PORT  Port to listen on. Default: 8080
+  -j JOBS, --jobs JOBS  Number of worker processes. Default: number of CPUs
+  -q MAX_QUEUE, --max_queue MAX_QUEUE
+                        Most plans waiting or running at once. Submissions
+                        beyond it are refused with 503. Default: 100
+  -g, --google          Make maps with google maps API. Default: False
+  -a API_KEY, --api_key API_KEY
+                        Google API key for Google maps. Default: None
+  -o OUTPUT_ROOT, --output_root OUTPUT_ROOT
+                        Each plan goes in OUTPUT_ROOT/<plan>/ and its maps
+                        in OUTPUT_ROOT/<plan>/<profile>/ (the id of a job
+                        is <plan>-<profile>, or <plan> with solve_only),
+                        and they are served from there again after a restart.
+                        Default: ~/Ingress/Fielding/planServer
+
+Endpoints (all replies are JSON, except files)
+  POST /plans           The body is a portal list (as for makePlan.py). The
+                        query may set num_agents, samples, mk_weight,
+                        time_weight, split, profile (default, preview or
+                        print, see makePlan.py) and solve_only (1 or 0).
+                        Replies with the plan's id and status (202 until done).
+                        Identical requests (same portals, keys and settings)
+                        get the same id: one still running is joined and a
+                        finished one is served from OUTPUT_ROOT. Requests
+                        that differ only in profile or solve_only share one
+                        solve, and each profile is drawn once.
+  GET /plans/ID         Its status: queued (waiting or solving), rendering,
+                        done, failed or cancelled. While it runs, progress
+                        has its stage (solving, ordering or drawing) with
+                        the samples made and best TK and MK so far, or the
+                        agent ordering level out of levels.
+  DELETE /plans/ID      Cancels it. Its worker stops within a fraction of a
+                        second and is free for the next plan.
+  GET /plans/ID/result  Its summary and files once done (202 until then)
+  GET /plans/ID/files/NAME  One of its files
+"""
+
+import sys
+import os
+import io
+import json
+import argparse
+import threading
+import collections
+import signal
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+try:
+    from http.server import BaseHTTPRequestHandler,HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse,parse_qs
+except ImportError:
+    sys.exit("planServer.py needs Python 3")
+
+from batchPlan import settingsError,solveJob,renderJob
+from makePlan import _MAX_PORTALS_,OUTPUTS
+from lib import renderProfile
+
+RUNNING = ('queued','rendering')
+
+PLAN_FILE = 'plan.npz'
+PORTAL_FILE = 'portals.csv'
+SUMMARY_FILE = 'summary.json'
+# The solve's summary, kept with the plan for drawing it in another profile
+SOLVE_FILE = 'solve.json'
+
+# Failed and cancelled jobs remembered for their error (finished ones are on disk)
+MAX_ENDED = 1000
+
+# Query parameters a submission may set, and their types
+QUERY_SETTINGS = {'num_agents':int,'samples':int,'mk_weight':float,
+                  'time_weight':float,'split':str,'profile':str}
+
+def jsonSafe(summary,scores=False):
+    '''
+    Returns summary with numpy numbers as python ones
+    and without the per-sample scores unless scores
+    '''
+    safe = {}
+    for k,v in summary.items():
+        if k in ('allTK','allMK','allWeights'):
+            if not scores:
+                continue
+            v = [x.item() if hasattr(x,'item') else x for x in v]
+        if hasattr(v,'item'):
+            v = v.item()
+        safe[k] = v
+    return safe
+
+class Job:
+    '''
+    One plan the server knows of (for one render profile, unless it is solve only)
+        id          see jobId
+        directory   where its files go (its plan's directory, or the profile's under it)
+        planDirectory   where the plan it is drawn from is
+        status      queued (waiting or solving), rendering, done, failed or cancelled
+        summary     see batchPlan.SUMMARY_FIELDS (once solved)
+        settings    as given to Planner.submit
+        cancel      a Manager Event that stops its render (see batchPlan.renderJob)
+        progress    a Manager dict its worker keeps up to date
+        future      the pool's Future for its render
+        solve       the Solve it waits for (None once solved)
+    '''
+    def __init__(self,id,directory,planDirectory,status='queued',summary=None,settings=None):
+        self.id        = id
+        self.directory = directory
+        self.planDirectory = planDirectory
+        self.status    = status
+        self.summary   = summary
+        self.settings  = settings
+        self.cancel    = None
+        self.progress  = None
+        self.future    = None
+        self.solve     = None
+
+    def describe(self):
+        reply = {'id':self.id,'status':self.status}
+        progress = self.progress
+        if self.status in RUNNING and progress is not None:
+            reply['progress'] = dict(progress)
+        if self.summary is not None and 'error' in self.summary:
+            reply['error'] = self.summary['error']
+        return reply
+
+class Solve:
+    '''
+    A plan being solved, shared by the Jobs for every profile it is drawn in
+        id          planStore.fingerprint of its portals, keys and the settings that change the plan
+        directory   where the plan goes
+        jobs        the Jobs waiting for it
+        cancel, progress, future    as for a Job, for the solve (see batchPlan.solveJob)
+    '''
+    def __init__(self,id,directory):
+        self.id        = id
+        self.directory = directory
+        self.jobs      = []
+        self.cancel    = None
+        self.progress  = None
+        self.future    = None
+
+def jobId(planId,settings):
+    # A solve only job is its plan, one that draws it is the plan in a profile
+    if settings['solve_only']:
+        return planId
+    return planId+'-'+settings['profile']
+
+class Planner:
+    '''
+    The job table and worker pool behind the server
+    Jobs are keyed by id, so a request for a plan being made joins it
+    and one for a plan already made is answered from its directory
+    A plan is solved once for all profiles and for solve only requests (neither is part of
+    its id), and drawn once for each profile
+    Only running jobs and the last MAX_ENDED failed or cancelled ones are kept in the table,
+    finished ones are answered from disk
+    '''
+    def __init__(self,output_root,jobs,max_queue,google=False,api_key=None):
+        self.output_root = output_root
+        self.max_queue   = max_queue
+        self.google      = google
+        self.api_key     = api_key
+        self.workers     = jobs
+        # Workers are spawned rather than forked, so they do not hold on to the server's socket
+        self.context = multiprocessing.get_context('spawn')
+        self.pool = ProcessPoolExecutor(max_workers=jobs,mp_context=self.context)
+        # Cancel events and progress dicts are shared with the workers through the manager
+        self.manager = self.context.Manager()
+        self.lock = threading.Lock()
+        self.jobs = {}
+        # The number of jobs in RUNNING, and the failed or cancelled jobs in the order they ended
+        self.active = 0
+        self.ended = collections.deque()
+        # Solves being made, by plan id
+        self.solves = {}
+
+    def running(self):
+        return self.active
+
+    def directories(self,id):
+        # The directory of job id and of its plan, or None if id is not one jobId makes
+        planId,_,profile = id.partition('-')
+        if len(planId) == 0 or not all(c in '0123456789abcdef' for c in planId):
+            return None
+        planDirectory = os.path.join(self.output_root,planId)+os.sep
+        if profile == '':
+            return planDirectory,planDirectory
+        if profile not in renderProfile.PROFILES:
+            return None
+        return os.path.join(planDirectory,profile)+os.sep,planDirectory
+
+    def cached(self,id):
+        # A Job for a plan finished by an earlier run of the server, or None
+        directories = self.directories(id)
+        if directories is None:
+            return None
+        directory,planDirectory = directories
+        try:
+            with open(directory+SUMMARY_FILE,'r') as fin:
+                summary = json.load(fin)
+        except (IOError,ValueError):
+            return None
+        return Job(id,directory,planDirectory,'done',summary)
+
+    def solvedBefore(self,planDirectory):
+        # The summary of the plan solved in planDirectory by an earlier job, or None
+        if not os.path.exists(planDirectory+PLAN_FILE):
+            return None
+        try:
+            with open(planDirectory+SOLVE_FILE,'r') as fin:
+                return json.load(fin)
+        except (IOError,ValueError):
+            return None
+
+    def submit(self,text,settings):
+        '''
+        text is a portal list, settings a dict with the keys in batchPlan.SETTINGS and 'solve_only'
+        Returns the Job for it (an existing one if the same plan was asked for before)
+        Raises ValueError if the request is bad, and RuntimeError if the queue is full
+        '''
+        from lib import planStore,portalList
+
+        portals = portalList.read(io.StringIO(text))
+        if len(portals) < 3:
+            raise ValueError("Must have more than 2 portals!")
+        if len(portals) > _MAX_PORTALS_:
+            raise ValueError("Portal limit is {0}".format(_MAX_PORTALS_))
+        error = settingsError(settings)
+        if error is not None:
+            raise ValueError(error)
+
+        # Names are in the plan's files, so they are part of the request too
+        params = dict(settings,names=[portal[0] for portal in portals])
+        # None of these change the plan: every profile is drawn from it (with or without google)
+        for k in ('api_key','google','profile','solve_only'):
+            del params[k]
+        planId = planStore.fingerprint([portal[1:3] for portal in portals],
+                                       [portal[3] for portal in portals],params)
+        id = jobId(planId,settings)
+
+        with self.lock:
+            job = self.jobs.get(id)
+            if job is not None and job.status not in ('failed','cancelled'):
+                if job.cancel is not None and job.cancel.is_set():
+                    # Its worker may still be writing to its directory
+                    raise RuntimeError("That plan is being cancelled, try again shortly")
+                return job
+            job = self.cached(id)
+            if job is not None:
+                return job
+            solve = self.solves.get(planId)
+            if solve is not None and solve.cancel.is_set():
+                raise RuntimeError("That plan is being cancelled, try again shortly")
+            if self.running() >= self.max_queue:
+                raise RuntimeError("Too many plans queued, try again later")
+
+            directory,planDirectory = self.directories(id)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+            job = Job(id,directory,planDirectory,settings=settings)
+            job.cancel = self.manager.Event()
+            self.jobs[id] = job
+            self.active += 1
+
+            rendering = None
+            solving   = None
+            summary = self.solvedBefore(planDirectory) if solve is None else None
+            if summary is not None and job.directory == planDirectory:
+                # Solve only, and already solved
+                job.summary = summary
+                self.finish(job)
+            elif summary is not None:
+                rendering = self.render(job,summary)
+            else:
+                if solve is None:
+                    with open(planDirectory+PORTAL_FILE,'w') as fout:
+                        fout.write(text)
+                    solve = solving = Solve(planId,planDirectory)
+                    solve.cancel = self.manager.Event()
+                    solve.progress = self.manager.dict()
+                    solve.future = self.submitTask(solveJob,planDirectory+PORTAL_FILE,planDirectory,PLAN_FILE,
+                                                   settings,solve.cancel,solve.progress)
+                    self.solves[planId] = solve
+                solve.jobs.append(job)
+                job.solve = solve
+                job.progress = solve.progress
+        # Callbacks take the lock, and run at once for a task that is already done
+        if rendering is not None:
+            self.addRendered(job,rendering)
+        if solving is not None:
+            solving.future.add_done_callback(lambda future: self.solved(solving,future))
+        return job
+
+    def submitTask(self,fn,*args):
+        # Called with the lock held
+        try:
+            return self.pool.submit(fn,*args)
+        except BrokenProcessPool:
+            # A worker died and took the pool with it. The jobs that were in it fail
+            # (their futures end with BrokenProcessPool, see taskSummary), new tasks get a new pool
+            print ("A worker died, starting new workers")
+            self.pool.shutdown(wait=False)
+            self.pool = ProcessPoolExecutor(max_workers=self.workers,mp_context=self.context)
+            return self.pool.submit(fn,*args)
+
+    def render(self,job,summary):
+        # Called with the lock held, draws job's plan in its profile and returns the Future
+        job.summary = summary
+        job.solve = None
+        job.status = 'rendering'
+        job.progress = self.manager.dict()
+        job.future = self.submitTask(renderJob,summary,PLAN_FILE,job.settings,job.cancel,job.progress,
+                                     OUTPUTS,job.directory)
+        return job.future
+
+    def taskSummary(self,future,summary):
+        # What a finished task returned, or summary with the reason it returned nothing
+        if future.cancelled():
+            return dict(summary,error='Cancelled')
+        try:
+            return future.result()
+        except Exception as err:
+            # e.g. the worker was killed; the task's own errors are caught in the task
+            return dict(summary,error='{0}: {1}'.format(type(err).__name__,err))
+
+    def solved(self,solve,future):
+        summary = self.taskSummary(future,{})
+        started = []
+        with self.lock:
+            del self.solves[solve.id]
+            if 'error' not in summary:
+                # Kept with the plan, for drawing it in other profiles later
+                with open(solve.directory+SOLVE_FILE+'.tmp','w') as fout:
+                    json.dump(jsonSafe(summary,True),fout,sort_keys=True)
+                os.replace(solve.directory+SOLVE_FILE+'.tmp',solve.directory+SOLVE_FILE)
+            for job in solve.jobs:
+                if 'error' in summary or job.directory == job.planDirectory:
+                    job.summary = summary
+                    job.solve = None
+                    self.finish(job)
+                else:
+                    started.append((job,self.render(job,summary)))
+        for job,future in started:
+            self.addRendered(job,future)
+
+    def addRendered(self,job,future):
+        future.add_done_callback(lambda future: self.rendered(job,future))
+
+    def rendered(self,job,future):
+        summary = self.taskSummary(future,job.summary)
+        with self.lock:
+            job.summary = summary
+            self.finish(job)
+
+    def stop(self,id):
+        '''
+        Cancels the job with this id if it is running
+        Returns the Job (None if there is none)
+        '''
+        with self.lock:
+            job = self.jobs.get(id)
+            if job is None or job.status not in RUNNING:
+                return job
+            solve = job.solve
+            if solve is None:
+                job.cancel.set()
+                future = job.future
+            else:
+                # The plan is still being solved: only stop the solve if no other profile waits for it
+                solve.jobs.remove(job)
+                job.solve = None
+                job.summary = {'error':'Cancelled'}
+                self.finish(job)
+                if len(solve.jobs) > 0:
+                    return job
+                solve.cancel.set()
+                future = solve.future
+        # A task that has not started is dropped at once (its callback needs the lock)
+        future.cancel()
+        return job
+
+    def close(self):
+        # Cancels every running job and stops the workers
+        with self.lock:
+            for job in self.jobs.values():
+                if job.status in RUNNING:
+                    job.cancel.set()
+            for solve in self.solves.values():
+                solve.cancel.set()
+        self.pool.shutdown(wait=True)
+        self.manager.shutdown()
+
+    def finish(self,job):
+        # Called with the lock held
+        job.summary = jsonSafe(job.summary)
+        job.progress = None
+        self.active -= 1
+        if 'error' in job.summary:
+            job.status = 'cancelled' if job.summary['error'] == 'Cancelled' else 'failed'
+            self.ended.append(job)
+            while len(self.ended) > MAX_ENDED:
+                old = self.ended.popleft()
+                if self.jobs.get(old.id) is old:
+                    del self.jobs[old.id]
+            return
+        # Written last, so a plan is only served from disk once all of it is there
+        with open(job.directory+SUMMARY_FILE+'.tmp','w') as fout:
+            json.dump(job.summary,fout,sort_keys=True)
+        os.replace(job.directory+SUMMARY_FILE+'.tmp',job.directory+SUMMARY_FILE)
+        job.status = 'done'
+        # From now on it is answered from disk
+        if self.jobs.get(job.id) is job:
+            del self.jobs[job.id]
+
+    def get(self,id):
+        with self.lock:
+            job = self.jobs.get(id)
+            if job is None:
+                job = self.cached(id)
+            return job
+
+class Handler(BaseHTTPRequestHandler):
+    # self.server.planner is the Planner
+
+    def reply(self,code,body,content_type='application/json'):
+        if content_type == 'application/json':
+            body = json.dumps(body,sort_keys=True).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type',content_type)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/plans':
+            self.reply(404,{'error':'Not found'})
+            return
+
+        query = parse_qs(url.query)
+        settings = {'num_agents':1,'samples':50,'mk_weight':2.,'time_weight':0.,'split':'random','profile':'default',
+                    'google':self.server.planner.google,'api_key':self.server.planner.api_key}
+        try:
+            for k,kind in QUERY_SETTINGS.items():
+                if k in query:
+                    settings[k] = kind(query[k][0])
+            settings['solve_only'] = query.get('solve_only',['0'])[0] not in ('0','false','')
+            length = int(self.headers.get('Content-Length',0))
+            text = self.rfile.read(length).decode('utf-8')
+            job = self.server.planner.submit(text,settings)
+        except ValueError as err:
+            self.reply(400,{'error':str(err)})
+            return
+        except RuntimeError as err:
+            self.reply(503,{'error':str(err)})
+            return
+        self.reply(200 if job.status == 'done' else 202,job.describe())
+
+    def do_DELETE(self):
+        parts = [part for part in urlparse(self.path).path.split('/') if part]
+        if len(parts) != 2 or parts[0] != 'plans':
+            self.reply(404,{'error':'Not found'})
+            return
+        job = self.server.planner.stop(parts[1])
+        if job is None:
+            self.reply(404,{'error':'No plan {0}'.format(parts[1])})
+            return
+        self.reply(200 if job.status in ('done','cancelled','failed') else 202,job.describe())
+
+    def do_GET(self):
+        parts = [part for part in urlparse(self.path).path.split('/') if part]
+        if len(parts) < 2 or parts[0] != 'plans':
+            self.reply(404,{'error':'Not found'})
+            return
+        job = self.server.planner.get(parts[1])
+        if job is None:
+            self.reply(404,{'error':'No plan {0}'.format(parts[1])})
+            return
+
+        if len(parts) == 2:
+            self.reply(200,job.describe())
+        elif len(parts) == 3 and parts[2] == 'result':
+            if job.status == 'failed':
+                self.reply(500,job.describe())
+            elif job.status != 'done':
+                self.reply(200 if job.status == 'done' else 202,job.describe())
+            else:
+                # The profile's files and those of the plan they are drawn from
+                files = set()
+                for directory in (job.directory,job.planDirectory):
+                    files.update(f for f in os.listdir(directory)
+                                 if os.path.isfile(directory+f) and not f.endswith('.tmp'))
+                self.reply(200,dict(job.describe(),summary=job.summary,files=sorted(files)))
+        elif len(parts) == 4 and parts[2] == 'files' and job.status == 'done':
+            # Only plain names of files in the job's or its plan's directory
+            name = parts[3]
+            path = os.path.join(job.directory,name)
+            if not os.path.isfile(path):
+                path = os.path.join(job.planDirectory,name)
+            if name != os.path.basename(name) or name.startswith('.') or not os.path.isfile(path):
+                self.reply(404,{'error':'No file {0}'.format(name)})
+                return
+            content_type = {'.png':'image/png','.gif':'image/gif','.npz':'application/octet-stream',
+                            '.json':'application/json'}.get(os.path.splitext(name)[1],'text/plain')
+            with open(path,'rb') as fin:
+                self.reply(200,fin.read(),content_type)
+        else:
+            self.reply(404,{'error':'Not found'})
+
+class Server(ThreadingMixIn,HTTPServer):
+    daemon_threads = True
+
+def main():
+    description=("Ingress Maxfield - Serve plans over HTTP with one "
+                 "shared pool of worker processes.")
+    parser = argparse.ArgumentParser(description=description,
+                                     prog="planServer.py")
+    parser.add_argument('--host',default='127.0.0.1',
+                        help='Address to listen on. Default: 127.0.0.1')
+    parser.add_argument('-p','--port',type=int,default=8080,
+                        help='Port to listen on. Default: 8080')
+    parser.add_argument('-j','--jobs',type=int,default=os.cpu_count(),
+                        help="Number of worker processes. "
+                        "Default: number of CPUs")
+    parser.add_argument('-q','--max_queue',type=int,default=100,
+                        help="Most plans waiting or running at once. "
+                        "Default: 100")
+    parser.add_argument('-g','--google',action='store_true',
+                        help='Make maps with google maps API. Default: False')
+    parser.add_argument('-a','--api_key',default=None,
+                        help='Google API key for Google maps. Default: None')
+    parser.add_argument('-o','--output_root',
+                        default=os.path.expanduser('~')+"/Ingress/Fielding/planServer",
+                        help="Each plan goes in OUTPUT_ROOT/<plan>/, its "
+                        "maps in OUTPUT_ROOT/<plan>/<profile>/. "
+                        "Default: ~/Ingress/Fielding/planServer")
+    args = vars(parser.parse_args())
+
+    if args['jobs'] < 1:
+        sys.exit("Number of jobs should be positive")
+    if args['max_queue'] < 1:
+        sys.exit("Queue length should be positive")
+    if not os.path.exists(args['output_root']):
+        os.makedirs(args['output_root'])
+
+    server = Server((args['host'],args['port']),Handler)
+    server.planner = Planner(args['output_root'],args['jobs'],args['max_queue'],
+                             args['google'],args['api_key'])
+    print ("Serving plans on http://{0}:{1}/plans with {2} workers".format(
+           args['host'],args['port'],args['jobs']))
+
+    # Stopped by Ctrl-C or kill, running jobs are cancelled and the workers shut down
+    def terminate(signum,frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM,terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    server.planner.close()
+
+if __name__ == "__main__":
+    main()